@@ -0,0 +1,73 @@
+from collections import namedtuple
+
+import numpy as np
+
+import settings as settings
+
+
+class Arc(namedtuple('Arc', ['prn', 'start', 'end', 'gap_before'])):
+    """
+    A continuous arc of a satellite: the valid (not NaN) measures between two data holes greater than
+    settings.MAX_GAP. The arcs are independent of each other, then the detection and the correction run per arc
+
+        prn: The respective PRN
+        start: Index (in the valid measures of the PRN) of the first measure of the arc
+        end: Index (in the valid measures of the PRN) after the last measure of the arc
+        gap_before: The data hole (timedelta64) before the arc, NaT for the first arc
+    """
+    __slots__ = ()
+
+    @property
+    def length(self):
+        return self.end - self.start
+
+
+def boundaries(obs_time, max_gap=settings.MAX_GAP):
+    """
+    Find, in a single pass, where the continuous arcs start: a new arc starts after every data hole greater than
+    'max_gap' minutes
+
+    :param obs_time: Array datetime64 with the times of the valid (not NaN) measures
+    :param max_gap: The data hole, in minutes, that splits two arcs
+    :return: Array with the indexes (in obs_time) where each arc starts. The first arc always starts at 0
+    """
+    gaps = np.flatnonzero(np.diff(obs_time) > np.timedelta64(max_gap, 'm')) + 1
+    return np.concatenate(([0], gaps)).astype(np.int64)
+
+
+def segment(obs_time, prn, max_gap=settings.MAX_GAP):
+    """
+    Split the valid measures of a satellite into its continuous arcs
+
+    :param obs_time: Array datetime64 with the times of the valid (not NaN) measures of the PRN
+    :param prn: The respective PRN
+    :param max_gap: The data hole, in minutes, that splits two arcs
+    :return: List of Arc, in time order (empty if there is no valid measure)
+    """
+    if len(obs_time) == 0:
+        return []
+
+    starts = boundaries(obs_time, max_gap)
+    ends = np.append(starts[1:], len(obs_time))
+    gaps = np.concatenate(([np.timedelta64('NaT')], obs_time[starts[1:]] - obs_time[starts[1:] - 1]))
+
+    return [Arc(prn, int(start), int(end), gap) for start, end, gap in zip(starts, ends, gaps)]
+
+
+def stack(values, starts, lengths):
+    """
+    Gather slices of a series as the rows of a matrix, padded with NaN at the end of the shorter ones
+
+    :param values: The series (1-D array)
+    :param starts: Array with the index (in values) of the first element of each slice
+    :param lengths: Array with the length of each slice
+    :return: Matrix (slices x longest length)
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    width = lengths.max() if len(lengths) else 0
+
+    inside = np.arange(width) < lengths[:, np.newaxis]
+    positions = np.where(inside, starts[:, np.newaxis] + np.arange(width), 0)
+
+    return np.where(inside, values[positions], np.nan) if len(values) else np.full(inside.shape, np.nan)
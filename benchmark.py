@@ -0,0 +1,260 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+import metrics
+import rinex
+import settings as settings
+import store
+import synthetic
+
+# the base case of the sweeps, and the values taken by each swept argument
+BASE = {'rate': 30, 'duration': 24, 'satellites': 12, 'gaps': 2, 'slips': 2}
+SWEEPS = {'rate': [30, 15, 1], 'duration': [3, 6, 12, 24], 'satellites': [4, 12, 24, 36], 'slips': [0, 2, 8]}
+
+# the counts compared with a baseline (see compare): any change means the detection changed
+SCORES = ('injected', 'detected', 'found', 'right')
+
+
+def score(truth, detected, window=4):
+    """
+    Match the cycle-slips detected with the ones injected, in each satellite. The peaks of the 4th order differences
+    (see CycleSlip._detect) may be found up to 4 epochs before the epoch of the cycle-slip, then a detection is right
+    when a cycle-slip was injected in the window epochs after it (or at it), and an injected cycle-slip is found when
+    it has a detection in the window epochs before it (or at it)
+
+    :param truth: The (epoch x sv) boolean matrix of the injected cycle-slips
+    :param detected: The (epoch x sv) boolean matrix of the cycle-slips detected
+    :param window: The maximum number of epochs from a detection to its cycle-slip
+    :return: The number of injected cycle-slips found, the number of detections right and wrong
+    """
+    def spread(matrix, step):
+        spread = matrix.copy()
+        for shift in range(1, window + 1):
+            if step > 0:
+                spread[shift:] |= matrix[:-shift]
+            else:
+                spread[:-shift] |= matrix[shift:]
+        return spread
+
+    found = int((truth & spread(detected, 1)).sum())
+    right = int((detected & spread(truth, -1)).sum())
+
+    return found, right, int(detected.sum()) - right
+
+
+def run_case(folder, rate, duration, satellites, gaps, slips, seed=0):
+    """
+    Check a synthetic rinex through the whole pipeline (see cycle_slip.CycleSlip), then score the cycle-slips found
+    (read back from the station store) against the injected ones
+
+    :param folder: A temporary folder for the rinex and the store
+    :param rate: The sample rate, in seconds
+    :param duration: The hours of observations
+    :param satellites: The number of satellites (a quarter of them GLONASS)
+    :param gaps: The number of data holes per satellite
+    :param slips: The number of cycle-slips per satellite
+    :param seed: The random seed
+    :return: Python dict with the case, the seconds of each stage (see metrics.STAGES), the counters, the recall and
+        the precision
+    """
+    import cycle_slip as cs
+
+    generated = synthetic.SyntheticRinex(rate=rate, duration=duration, gps=satellites - satellites // 4,
+                                         glonass=satellites // 4, gaps=gaps, slips=slips, seed=seed)
+    rinex_folder, store_folder = os.path.join(folder, 'rinex'), os.path.join(folder, 'store')
+    shutil.rmtree(folder, ignore_errors=True)
+    generated.write(rinex_folder)
+
+    start = time.perf_counter()
+    result, = cs.CycleSlip(rinex_folder, workers=1, store_folder=store_folder).initialize()
+    seconds = time.perf_counter() - start
+    if result['status'] != 'ok':
+        raise RuntimeError("The synthetic rinex failed: {}".format(result['error']))
+
+    stored_time, stored_sv, values = store.StationStore(store_folder, generated.station).read(variables=['slips'])
+    detected = np.zeros(generated.truth.shape, dtype=bool)
+    detected[np.ix_(np.searchsorted(generated.time, stored_time), np.searchsorted(generated.sv, stored_sv))] = \
+        values['slips']
+
+    found, right, wrong = score(generated.truth, detected)
+    case = {'rate': rate, 'duration': duration, 'satellites': satellites, 'gaps': gaps, 'slips': slips,
+            'epochs': len(generated.time), 'seconds': seconds}
+    case.update({stage: result['metrics']['stages'].get(stage, 0.0) for stage in metrics.STAGES})
+    case.update({'measures': result['metrics']['counters'].get('measures', 0), 'injected': int(generated.truth.sum()),
+                 'found': found, 'detected': int(detected.sum()), 'right': right, 'wrong': wrong,
+                 'recall': found / generated.truth.sum() if generated.truth.any() else 1.0,
+                 'precision': right / detected.sum() if detected.any() else 1.0,
+                 'peak_rss_growth_mb': result['metrics']['peak_rss_growth_mb']})
+
+    return case
+
+
+def run(sweeps, repeat=1, seed=0):
+    """
+    Run the scaling sweeps: each swept argument takes its values (see SWEEPS), the others keep the base case (see
+    BASE)
+
+    :param sweeps: List with the swept arguments (keys of SWEEPS)
+    :param repeat: Number of runs of each case (the fastest one is kept), with the same synthetic rinex
+    :param seed: The random seed of the synthetic rinex
+    :return: List with the result of each case (see run_case)
+    """
+    cases = []
+    folder = tempfile.mkdtemp(prefix='cycle_slip_benchmark_')
+
+    try:
+        # warm up (e.g. the JIT compilation of the correction loop), out of the timings
+        run_case(os.path.join(folder, 'case'), **dict(BASE, duration=1))
+
+        for sweep in sweeps:
+            for value in SWEEPS[sweep]:
+                arguments = dict(BASE, **{sweep: value})
+                runs = [run_case(os.path.join(folder, 'case'), seed=seed, **arguments) for _ in range(repeat)]
+                case = dict(min(runs, key=lambda item: item['seconds']), sweep=sweep)
+                cases.append(case)
+
+                logging.warning(">> {}={}: {} epochs in {:.3f} s (detection {:.3f} s, correction {:.3f} s), "
+                                "recall {:.3f}, precision {:.3f}".format(sweep, value, case['epochs'],
+                                                                         case['seconds'], case['detection'],
+                                                                         case['correction'], case['recall'],
+                                                                         case['precision']))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return cases
+
+
+def time_reader(repeat=1, seed=0):
+    """
+    Time the decoding of the base case rinex (see BASE) by rinex.RinexObsReader and by georinex, which loaded the
+    observations before it. The observables decoded are all the ones of the synthetic rinex (see synthetic.OBS_TYPES)
+
+    :param repeat: Number of reads by each reader (the fastest one is kept)
+    :param seed: The random seed of the synthetic rinex
+    :return: Python dict with the epochs, the satellites, the seconds of each reader and the speedup
+    """
+    import georinex
+
+    columns = sorted({code for obs_types in synthetic.OBS_TYPES.values() for code in obs_types})
+    generated = synthetic.SyntheticRinex(rate=BASE['rate'], duration=BASE['duration'],
+                                         gps=BASE['satellites'] - BASE['satellites'] // 4,
+                                         glonass=BASE['satellites'] // 4, gaps=BASE['gaps'], slips=BASE['slips'],
+                                         seed=seed)
+    folder = tempfile.mkdtemp(prefix='cycle_slip_benchmark_')
+
+    def fastest(read):
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            read()
+            seconds.append(time.perf_counter() - start)
+        return min(seconds)
+
+    try:
+        file = generated.write(folder)
+        reader = fastest(lambda: rinex.RinexObsReader(file).read(columns, settings.CONSTELLATIONS))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            other = fastest(lambda: georinex.load(file, use=settings.CONSTELLATIONS, meas=columns))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return {'epochs': len(generated.time), 'satellites': len(generated.sv), 'reader_seconds': reader,
+            'georinex_seconds': other, 'speedup': other / reader}
+
+
+def save(file, cases, reader=None):
+    """
+    Save the results of the cases, as JSON and as CSV (next to it, with the same name)
+
+    :param file: Absolute path to the JSON file
+    :param cases: List with the result of each case (see run)
+    :param reader: The reader timing (see time_reader), if any. Saved in the JSON only
+    :return: None
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+    with open(file, mode='w') as fd:
+        results = {'base': BASE, 'kernel': settings.KERNEL_BACKEND, 'cases': cases}
+        if reader is not None:
+            results['reader'] = reader
+        json.dump(results, fd, indent=2)
+
+    with open(os.path.splitext(file)[0] + '.csv', mode='w', newline='') as fd:
+        writer = csv.DictWriter(fd, fieldnames=['sweep'] + [name for name in cases[0] if name != 'sweep'])
+        writer.writeheader()
+        writer.writerows(cases)
+
+    return None
+
+
+def compare(cases, baseline):
+    """
+    Compare the scores of the cases with the ones of a baseline run (e.g. before a change). The synthetic rinex are
+    the same for the same seed, then the cycle-slips detected must be the same
+
+    :param cases: List with the result of each case (see run)
+    :param baseline: Absolute path to the JSON file of the baseline run (see save)
+    :return: List with the cases whose scores changed, as (case, baseline case)
+    """
+    with open(baseline, mode='r') as fd:
+        expected = {(case['sweep'], case[case['sweep']]): case for case in json.load(fd)['cases']}
+
+    changed = []
+    for case in cases:
+        other = expected.get((case['sweep'], case[case['sweep']]))
+        if other is not None and any(case[name] != other[name] for name in SCORES):
+            changed.append((case, other))
+
+    return changed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the cycle-slip checking over synthetic rinex\'s, with '
+                                                 'injected cycle-slips')
+    parser.add_argument('-sweep', action="append", dest='sweeps', choices=sorted(SWEEPS),
+                        help='Swept argument (repeat for many), all of them by default.')
+    parser.add_argument('-repeat', action="store", dest='repeat', type=int, default=1,
+                        help='Number of runs of each case, the fastest one is kept.')
+    parser.add_argument('-seed', action="store", dest='seed', type=int, default=0,
+                        help='Random seed of the synthetic rinex.')
+    parser.add_argument('-output', action="store", dest='output',
+                        help='Results file (JSON). A CSV with the same name is saved next to it.')
+    parser.add_argument('-baseline', action="store", dest='baseline',
+                        help='Results file (JSON) of a baseline run, with the same seed. Fail (exit status 1) when the '
+                             'cycle-slips detected in a case changed.')
+    parser.add_argument('-reader', action="store_true", dest='reader',
+                        help='Also time the rinex reader against georinex (requeriments-dev.txt), over the base case.')
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(message)s", level=logging.WARNING)
+    settings.PLOTS = 'off'
+    settings.use_cache = False
+
+    results = run(args.sweeps or sorted(SWEEPS), args.repeat, args.seed)
+
+    reader = time_reader(args.repeat, args.seed) if args.reader else None
+    if reader is not None:
+        logging.warning(">> reader: {} epochs x {} satellites in {:.3f} s, georinex {:.3f} s ({:.0f}x)".format(
+            reader['epochs'], reader['satellites'], reader['reader_seconds'], reader['georinex_seconds'],
+            reader['speedup']))
+
+    if args.output:
+        save(args.output, results, reader)
+
+    changed = compare(results, args.baseline) if args.baseline else []
+    for case, other in changed:
+        logging.error(">> {}={}: the detection changed, {} (baseline {})".format(
+            case['sweep'], case[case['sweep']], {name: case[name] for name in SCORES},
+            {name: other[name] for name in SCORES}))
+
+    sys.exit(1 if changed else 0)
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+
+import rinex
+import settings as settings
+
+
+class ObservationCache:
+    """
+    On-disk cache of decoded rinex observations. Each entry is a folder with one .npy file per array (time, sv and
+    each observable), which are opened memory-mapped on a warm run, with no parsing or copying. Entries are keyed by
+    the file checksum, the rinex version and the columns/constellations selected, and evicted by least recent use
+    when the cache grows over its size limit
+    """
+    _meta = 'meta.json'
+    _block_size = 1 << 20
+
+    def __init__(self, folder=settings.CACHE_FOLDER, max_size=settings.CACHE_MAX_SIZE):
+        """
+        :param folder: Absolute path of the cache folder
+        :param max_size: Maximum size (bytes) of the cache, before evicting the least recently used entries
+        """
+        self.folder = folder
+        self.max_size = max_size
+
+    @classmethod
+    def checksum(cls, file):
+        """
+        :param file: Absolute path to the rinex file
+        :return: The SHA-1 (hex) of the file content
+        """
+        sha1 = hashlib.sha1()
+        with open(file, mode='rb') as fd:
+            for block in iter(lambda: fd.read(cls._block_size), b''):
+                sha1.update(block)
+
+        return sha1.hexdigest()
+
+    def key(self, file, version, columns, constellations):
+        """
+        :param file: Absolute path to the rinex file
+        :param version: The rinex version, from header
+        :param columns: The observable codes loaded (see Utils.which_cols_to_load)
+        :param constellations: The constellations loaded (e.g. ['G', 'R'])
+        :return: The entry key
+        """
+        selection = json.dumps([self.checksum(file), str(version), sorted(columns), sorted(constellations)])
+        return hashlib.sha1(selection.encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.folder, key)
+
+    def load(self, key):
+        """
+        Open a cached entry. The arrays are memory-mapped (read-only)
+
+        :param key: The entry key
+        :return: The Observations object, or None if the entry does not exist
+        """
+        path = self._entry_path(key)
+        meta_path = os.path.join(path, self._meta)
+
+        if not os.path.exists(meta_path):
+            return None
+
+        with open(meta_path, mode='r') as fd:
+            meta = json.load(fd)
+
+        def open_array(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+        data = {code: open_array(name) for code, name in meta['columns'].items()}
+        obs = rinex.Observations(meta['header'], open_array('time'), open_array('sv'), data)
+
+        os.utime(meta_path)
+        logging.info(">>>>>> Observations loaded from cache ({})".format(key))
+
+        return obs
+
+    def store(self, key, obs, source=None):
+        """
+        Save the observations as a new entry. The entry is written in a temporary folder and then renamed, so a
+        partial entry is never visible
+
+        :param key: The entry key
+        :param obs: The Observations object
+        :param source: The rinex file name (information only)
+        :return: None
+        """
+        path = self._entry_path(key)
+        temporary = path + '.tmp-%d' % os.getpid()
+        os.makedirs(temporary, exist_ok=True)
+
+        columns = {}
+        for i, (code, values) in enumerate(sorted(obs.data.items())):
+            columns[code] = 'obs_%d' % i
+            np.save(os.path.join(temporary, columns[code] + '.npy'), values)
+
+        np.save(os.path.join(temporary, 'time.npy'), obs.time)
+        np.save(os.path.join(temporary, 'sv.npy'), np.asarray(obs.sv, dtype=str))
+
+        with open(os.path.join(temporary, self._meta), mode='w') as fd:
+            json.dump({'source': source, 'created': time.time(), 'header': obs.header, 'columns': columns}, fd)
+
+        try:
+            os.rename(temporary, path)
+        except OSError:
+            # the same entry stored meanwhile (e.g. by another process)
+            shutil.rmtree(temporary, ignore_errors=True)
+
+        self._evict()
+        return None
+
+    def entries(self):
+        """
+        :return: List of the cache entries (dicts with key, source, size and last access), the most recent first
+        """
+        if not os.path.isdir(self.folder):
+            return []
+
+        entries = []
+        for key in os.listdir(self.folder):
+            meta_path = os.path.join(self._entry_path(key), self._meta)
+            if not os.path.exists(meta_path):
+                continue
+
+            with open(meta_path, mode='r') as fd:
+                source = json.load(fd).get('source')
+
+            size = sum(entry.stat().st_size for entry in os.scandir(self._entry_path(key)))
+            entries.append({'key': key, 'source': source, 'size': size, 'accessed': os.path.getmtime(meta_path)})
+
+        return sorted(entries, key=lambda entry: entry['accessed'], reverse=True)
+
+    def _evict(self):
+        """
+        Remove the least recently used entries until the cache size is under the limit
+
+        :return: None
+        """
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries)
+
+        while entries and total > self.max_size:
+            entry = entries.pop()
+            logging.info(">>>>>> Evicting cache entry {} ({})".format(entry['key'], entry['source']))
+            shutil.rmtree(self._entry_path(entry['key']), ignore_errors=True)
+            total -= entry['size']
+
+        return None
+
+    def purge(self):
+        """
+        Remove all entries of the cache
+
+        :return: The number of entries removed
+        """
+        entries = self.entries()
+        for entry in entries:
+            shutil.rmtree(self._entry_path(entry['key']), ignore_errors=True)
+
+        logging.info(">> Cache purged: {} entries removed".format(len(entries)))
+        return len(entries)
+
+    def read(self, reader, columns, constellations):
+        """
+        Returns the observations of a rinex, from the cache if it is there, otherwise decoded by the reader (and
+        then stored)
+
+        :param reader: The rinex.RinexObsReader of the file
+        :param columns: The observable codes to load (see Utils.which_cols_to_load)
+        :param constellations: The constellations to load (e.g. ['G', 'R'])
+        :return: The Observations object
+        """
+        key = self.key(reader.file, reader.header.get('version'), columns, constellations)
+        obs = self.load(key)
+
+        if obs is None:
+            obs = reader.read(columns, constellations)
+            self.store(key, obs, os.path.basename(reader.file))
+
+        return obs
+
+    def __str__(self):
+        entries = self.entries()
+        lines = ["{:<40} {:>12}  {:<19}  {}".format('KEY', 'SIZE (MB)', 'LAST ACCESS', 'SOURCE')]
+        for entry in entries:
+            accessed = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['accessed']))
+            lines.append("{:<40} {:>12.2f}  {:<19}  {}".format(entry['key'], entry['size'] / 1048576, accessed,
+                                                              entry['source']))
+        lines.append("{} entries, {:.2f} MB (limit {:.2f} MB) at {}".format(
+            len(entries), sum(entry['size'] for entry in entries) / 1048576, self.max_size / 1048576, self.folder))
+
+        return "\n".join(lines)
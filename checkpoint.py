@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+
+def _sha1(path, chunk_size=1024 ** 2):
+    digest = hashlib.sha1()
+    with open(path, mode='rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _fingerprint(path):
+    """
+    :param path: Absolute path to the rinex
+    :return: The size and modification time (ns) of the rinex, which must not change between a run and its resume
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _durable(path, write, mode='w'):
+    """
+    Write a file atomically and durably: written aside, flushed to the disk, then renamed over the path
+
+    :param path: Absolute path to the file
+    :param write: Function writing the content, as write(fd)
+    :param mode: The mode of the file ('w' or 'wb')
+    :return: None
+    """
+    temporary = '{}.tmp-{}'.format(path, os.getpid())
+    with open(temporary, mode=mode) as fd:
+        write(fd)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(temporary, path)
+
+    directory = os.open(os.path.dirname(path), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class Checkpoint:
+    """
+    Durable record of a (long) run, kept in a folder, from where a run killed (crash, out of memory, ...) resumes:
+        - files/<file>.json: the result of each finished rinex, with its fingerprint (size and modification time) and
+            the checksum of its corrected rinex, if any
+        - prns/<file>/<prn>.npz: the results of each finished PRN of a rinex still being checked, with the fingerprint
+            of the rinex (removed when the rinex is finished)
+    Every record is written atomically and flushed to the disk as soon as it is produced. A record is only trusted if
+    the rinex did not change since, and its outputs are still the ones recorded: otherwise it is checked again
+    """
+    def __init__(self, folder):
+        """
+        :param folder: The checkpoint folder (created if it does not exist)
+        """
+        self.folder = folder
+        for name in ('files', 'prns'):
+            os.makedirs(os.path.join(folder, name), exist_ok=True)
+
+    def _file_path(self, entry):
+        return os.path.join(self.folder, 'files', entry['file'] + '.json')
+
+    def finished(self, entry):
+        """
+        :param entry: The manifest entry of the rinex (see manifest.Manifest)
+        :return: The result recorded for the rinex (see CycleSlip.process_file), or None if it must be checked (not
+            finished, changed since, or with an output missing or changed)
+        """
+        path = self._file_path(entry)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, mode='r') as fd:
+            record = json.load(fd)
+
+        if record['fingerprint'] != _fingerprint(entry['path']):
+            logging.info(">> {} changed since its checkpoint, checking it again".format(entry['file']))
+            return None
+
+        for output, sha1 in record['outputs'].items():
+            if not os.path.exists(output) or _sha1(output) != sha1:
+                logging.warning(">> Output {} of {} is missing or changed, checking it again".format(output,
+                                                                                                   entry['file']))
+                return None
+
+        return record['result']
+
+    def finish(self, entry, result, outputs=()):
+        """
+        Record a finished rinex, dropping the records of its PRNs
+
+        :param entry: The manifest entry of the rinex
+        :param result: The result of the rinex (see CycleSlip.process_file)
+        :param outputs: Absolute paths to the files written for the rinex (e.g. the corrected rinex)
+        :return: None
+        """
+        record = {'fingerprint': _fingerprint(entry['path']), 'result': result,
+                  'outputs': {os.path.abspath(output): _sha1(output) for output in outputs}}
+        _durable(self._file_path(entry), lambda fd: json.dump(record, fd, default=str))
+        shutil.rmtree(os.path.join(self.folder, 'prns', entry['file']), ignore_errors=True)
+
+        return None
+
+    def prns(self, entry):
+        """
+        :param entry: The manifest entry of the rinex
+        :return: The FilePrns of the rinex
+        """
+        return FilePrns(os.path.join(self.folder, 'prns', entry['file']), _fingerprint(entry['path']))
+
+
+class FilePrns:
+    """
+    The records of the finished PRNs of a rinex being checked (see Checkpoint)
+    """
+    def __init__(self, folder, fingerprint):
+        """
+        :param folder: The folder of the PRNs of the rinex
+        :param fingerprint: The fingerprint of the rinex
+        """
+        self.folder = folder
+        self.fingerprint = np.array(fingerprint, dtype=np.int64)
+
+    def load(self, epochs, names, prns=None):
+        """
+        Load the finished PRNs, skipping the records of another version of the rinex, or unreadable
+
+        :param epochs: Number of epochs of the rinex
+        :param names: The names of the results (see cycle_slip.RESULTS)
+        :param prns: The PRNs to load (e.g. a group of satellites), all of them by default
+        :return: Python dict with the PRN as key and a Python dict with the array of each result as value
+        """
+        finished = {}
+        prns = set(prns) if prns is not None else None
+        if not os.path.isdir(self.folder):
+            return finished
+
+        for file in sorted(os.listdir(self.folder)):
+            if not file.endswith('.npz') or (prns is not None and file[:-len('.npz')] not in prns):
+                continue
+
+            try:
+                with np.load(os.path.join(self.folder, file)) as record:
+                    if not np.array_equal(record['fingerprint'], self.fingerprint):
+                        continue
+                    columns = {name: record[name] for name in names}
+            except (OSError, ValueError, KeyError) as error:
+                logging.warning(">>>> Checkpoint {} unreadable, checking the PRN again: {}".format(file, error))
+                continue
+
+            if all(len(values) == epochs for values in columns.values()):
+                finished[file[:-len('.npz')]] = columns
+
+        if finished:
+            logging.info(">>>> {} PRNs resumed from the checkpoint".format(len(finished)))
+        return finished
+
+    def save(self, prn, columns):
+        """
+        :param prn: The PRN (e.g. 'G01')
+        :param columns: Python dict with the array of each result of the PRN
+        :return: None
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        _durable(os.path.join(self.folder, prn + '.npz'),
+                 lambda fd: np.savez(fd, fingerprint=self.fingerprint, **columns), mode='wb')
+
+        return None
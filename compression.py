@@ -0,0 +1,376 @@
+import gzip
+import io
+import logging
+import re
+import shutil
+
+
+class LZWStream(io.RawIOBase):
+    """
+    Streaming decoder of the Unix 'compress' (.Z) format, producing the uncompressed bytes as they are read. The
+    compressed file is read in fixed-size chunks, then only a chunk of each side is kept in memory (besides the code
+    table). The decoding follows Mark Adler's unlzw, including the flush of unused bits to the next '8 * bits' boundary
+    whenever the code width changes (or a CLEAR code is found)
+    """
+    _magic = b'\x1f\x9d'
+    _clear = 256
+    _chunk_size = 1 << 16
+    # bytes ahead of the current position kept in the input window: a code (up to 2 bytes) after the longest flush
+    # (up to 15 bytes), then the end of the file is known before each of them
+    _lookahead = 18
+
+    def __init__(self, fd):
+        """
+        :param fd: Binary file descriptor of the compressed file
+        """
+        super().__init__()
+        self.fd = fd
+        self._chunks = self._decode(fd)
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            self._pending = next(self._chunks, b'')
+            if not self._pending:
+                return 0
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        self.fd.close()
+        super().close()
+
+    def _decode(self, fd):
+        """
+        :param fd: Binary file descriptor of the compressed file
+        :return: Generator of uncompressed chunks
+        """
+        header = fd.read(3)
+        if header[:2] != self._magic or len(header) < 3:
+            raise ValueError("Not a .Z (LZW) compressed file")
+
+        max_bits = header[2] & 0x1f
+        block_mode = header[2] & 0x80
+        if max_bits < 9 or max_bits > 16:
+            raise ValueError("Invalid .Z maximum code width: {}".format(max_bits))
+        max_bits = 10 if max_bits == 9 else max_bits
+
+        # input window: data[position] is the next byte, mark is where the current code width started (both relative
+        # to the window, then the window may be moved forward keeping their difference)
+        data = fd.read(max(self._chunk_size, 2))
+        if not data:
+            return
+        if len(data) < 2:
+            raise ValueError("Truncated .Z compressed file")
+        size, complete = len(data), False
+
+        bits, mask = 9, 0x1ff
+        table = [bytes([i]) for i in range(256)] + ([b''] if block_mode else [])
+        end = len(table) - 1
+
+        buffer = data[0] | (data[1] << 8)
+        previous = table[buffer & mask]
+        buffer >>= bits
+        left = 16 - bits
+        mark, position = 0, 2
+        limit = size - self._lookahead
+
+        output = [previous]
+        produced = len(previous)
+
+        while True:
+            if position >= limit:
+                while not complete and size - position < self._lookahead:
+                    chunk = fd.read(self._chunk_size)
+                    complete = not chunk
+                    data = data[position:] + chunk
+                    mark -= position
+                    position, size = 0, len(data)
+                limit = size if complete else size - self._lookahead
+                if position >= size:
+                    break
+
+            if end >= mask and bits < max_bits:
+                rem = (position - mark) % bits
+                if rem:
+                    rem = bits - rem
+                    if rem >= size - position:
+                        break
+                    position += rem
+                buffer, left = 0, 0
+                mark = position
+                bits += 1
+                mask = (mask << 1) | 1
+
+            buffer |= data[position] << left
+            position += 1
+            left += 8
+            if left < bits:
+                if position == size:
+                    raise ValueError("Truncated .Z compressed file")
+                buffer |= data[position] << left
+                position += 1
+                left += 8
+            code = buffer & mask
+            buffer >>= bits
+            left -= bits
+
+            if code == self._clear and block_mode:
+                rem = (position - mark) % bits
+                if rem:
+                    rem = bits - rem
+                    if rem > size - position:
+                        break
+                    position += rem
+                buffer, left = 0, 0
+                mark = position
+                bits, mask = 9, 0x1ff
+                del table[257:]
+                end = 255
+                continue
+
+            if code <= end:
+                entry = table[code]
+            elif code == end + 1:
+                entry = previous + previous[:1]
+            else:
+                raise ValueError("Invalid code in .Z compressed file")
+
+            if end < mask:
+                end += 1
+                if end < len(table):
+                    table[end] = previous + entry[:1]
+                else:
+                    table.append(previous + entry[:1])
+
+            previous = entry
+            output.append(entry)
+            produced += len(entry)
+
+            if produced >= self._chunk_size:
+                yield b''.join(output)
+                output, produced = [], 0
+
+        if output:
+            yield b''.join(output)
+
+
+class CrinexStream:
+    """
+    Streaming decoder of Hatanaka compacted files (Compact RINEX 3.0), producing the RINEX 3 lines as they are read:
+        - The epoch line (with the satellites list appended) is text-differenced against the previous one, a line
+            starting with '>' initializes it, together with all the satellites arcs
+        - Each observable is an integer arc (value * 1000), initialized as 'order&value' and then given by its
+            differences of increasing order, up to the arc order
+        - The LLI/SSI flags are text-differenced per satellite ('&' means a blank)
+    """
+    _blank = ord('&')
+
+    def __init__(self, fd):
+        """
+        :param fd: Binary file descriptor (or any iterable of lines) of the compact rinex
+        """
+        self.fd = fd
+        self._lines = self._decode(iter(fd))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._lines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.fd.close()
+
+    @classmethod
+    def _repair(cls, old, new):
+        """
+        Apply a text difference: a space keeps the old character, '&' means a space and any other character
+        replaces the old one
+
+        :param old: The previous line (bytes)
+        :param new: The differenced line (bytes)
+        :return: The repaired line (bytearray)
+        """
+        line = bytearray(old.ljust(len(new)))
+        for i, char in enumerate(new):
+            if char == 32:
+                continue
+            line[i] = 32 if char == cls._blank else char
+
+        return line
+
+    @staticmethod
+    def _arc(arc, field):
+        """
+        Update an arc with a new field. The current value of the arc is its zero order term (differences[0])
+
+        :param arc: List [order, differences] of the arc, or None if not initialized
+        :param field: The field, either 'order&value' or the difference of the highest order
+        :return: The updated arc
+        """
+        if b'&' in field:
+            order, value = field.split(b'&')
+            return [int(order), [int(value)]]
+        elif arc is None:
+            raise ValueError("Compact rinex arc not initialized")
+
+        order, differences = arc
+        if len(differences) <= order:
+            differences.append(int(field))
+        else:
+            differences[-1] = int(field)
+
+        for k in range(len(differences) - 2, -1, -1):
+            differences[k] += differences[k + 1]
+
+        return arc
+
+    @staticmethod
+    def _format(value, decimals, width):
+        sign = '-' if value < 0 else ''
+        integer, fraction = divmod(abs(value), 10 ** decimals)
+        return ('%s%d.%0*d' % (sign, integer, decimals, fraction)).rjust(width).encode()
+
+    def _decode(self, lines):
+        """
+        :param lines: Iterator of the compact rinex lines
+        :return: Generator of the rinex lines
+        """
+        crinex_version = next(lines)[:9].strip()
+        next(lines)
+
+        obs_types = {}
+        system = None
+        for line in lines:
+            yield line
+            label = line[60:80].strip()
+            if label == b'SYS / # / OBS TYPES':
+                if line[0:1].strip():
+                    system = line[0:1]
+                    obs_types[system] = int(line[3:6])
+            elif label == b'END OF HEADER':
+                break
+
+        if not crinex_version.startswith(b'3.'):
+            raise ValueError("Compact rinex version {} is not supported".format(crinex_version.decode()))
+
+        epoch = b''
+        satellites = {}
+        clock = None
+
+        for line in lines:
+            line = line.rstrip(b'\r\n')
+
+            if line[:1] == b'>':
+                epoch = bytes(line)
+                satellites = {}
+                clock = None
+            else:
+                epoch = bytes(self._repair(epoch, line))
+
+            if int(epoch[29:32].strip() or 0) > 1:
+                yield epoch[:41].rstrip() + b'\n'
+                for _ in range(int(epoch[32:35])):
+                    yield next(lines)
+                continue
+
+            clock_line = next(lines).rstrip(b'\r\n')
+            clock = self._arc(clock, clock_line) if clock_line else None
+            epoch_line = epoch[:35]
+            if clock is not None:
+                epoch_line = epoch_line.ljust(41) + self._format(clock[1][0], 12, 15)
+            yield epoch_line + b'\n'
+
+            current = {}
+            sat_list = epoch[41:]
+            for k in range(int(epoch[32:35])):
+                prn = sat_list[3 * k:3 * k + 3]
+                ntype = obs_types[prn[:1]]
+                arcs, flags = satellites.get(prn, ([None] * ntype, b' ' * 2 * ntype))
+
+                fields = next(lines).rstrip(b'\r\n').split(b' ', ntype)
+                fields += [b''] * (ntype + 1 - len(fields))
+
+                flags = bytes(self._repair(flags, fields[ntype])).ljust(2 * ntype)
+                record = [prn]
+                for j in range(ntype):
+                    arcs[j] = self._arc(arcs[j], fields[j]) if fields[j] else None
+                    value = self._format(arcs[j][1][0], 3, 14) if arcs[j] is not None else b' ' * 14
+                    record.append(value + flags[2 * j:2 * j + 2])
+
+                current[prn] = (arcs, flags)
+                yield b''.join(record).rstrip() + b'\n'
+
+            satellites = current
+
+
+_gzip = re.compile(r'\.gz$', re.IGNORECASE)
+_lzw = re.compile(r'\.z$', re.IGNORECASE)
+_crinex = re.compile(r'(\.crx|\.\d\d[dD])$', re.IGNORECASE)
+
+
+def strip_compression(file):
+    """
+    :param file: Rinex file name, possibly compressed (e.g. ALMA00BRA_R_20181520000_01D_30S_MO.crx.gz)
+    :return: The file name without the compression extension (e.g. ALMA00BRA_R_20181520000_01D_30S_MO.crx)
+    """
+    return _lzw.sub('', _gzip.sub('', file))
+
+
+def open_compressed(file):
+    """
+    Open a file, decompressing it in a stream when it is compressed (.Z, .gz)
+
+    :param file: Absolute path to the file
+    :return: A binary file object (iterable by lines) with the uncompressed content
+    """
+    if _gzip.search(file):
+        return gzip.open(file, mode='rb')
+    elif _lzw.search(file):
+        return io.BufferedReader(LZWStream(open(file, mode='rb')))
+
+    return open(file, mode='rb')
+
+
+def open_rinex(file):
+    """
+    Open a rinex file, decompressing it in a stream when it is compressed (.Z, .gz) and/or Hatanaka compacted (.crx,
+    .yyd). No uncompressed copy is written to disk
+
+    :param file: Absolute path to the rinex file
+    :return: A binary file object (iterable by lines) with the plain rinex content
+    """
+    fd = open_compressed(file)
+
+    if _crinex.search(strip_compression(file)):
+        logging.debug(">>>>>> Decoding compact rinex {}".format(file))
+        return CrinexStream(fd)
+
+    return fd
+
+
+def decompress(file, output):
+    """
+    Write the uncompressed content of a .Z or .gz file, in a stream
+
+    :param file: Absolute path to the compressed file
+    :param output: Absolute path to the uncompressed file
+    :return: None
+    """
+    with open_compressed(file) as fd, open(output, mode='wb') as out_file:
+        shutil.copyfileobj(fd, out_file)
+
+    return None
@@ -1,27 +1,48 @@
+import contextlib
 import logging
 import os
 import time
-import sys
-import re
 import datetime
-import dateparser
+import tempfile
+import warnings
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-import georinex as gr
 import numpy as np
 
+import arcs
+import cache
+import checkpoint
+import compression
 import downloads as dw
+import glonass
+import kernel
+import manifest as mf
+import metrics
 import parser as pr
+import plots
+import rinex
+import shared
+import store
 
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
+import settings as settings
 
-from pandas.plotting import register_matplotlib_converters
-register_matplotlib_converters()
+RESULTS = ('rtec', 'rtec_corrected', 'mwlc', 'slips', 'cycles_1', 'cycles_2')
 
-from scipy.signal import find_peaks
+# (epoch x sv) matrices alive while the PRNs are checked, besides the observables decoded: the observables of the
+# analysis, rTEC, MWLC, the arcs, the differences, the peaks and the results (see Utils.satellite_groups)
+WORKING_MATRICES = 20
 
-import settings as settings
+
+def empty_results(shape):
+    """
+    :param shape: The (epoch x sv) shape of the current rinex
+    :return: Python dict with a matrix per result (see RESULTS), with nothing checked yet: NaN for rTEC and MWLC,
+        False for the slips and 0 for the cycles
+    """
+    return {name: np.zeros(shape, dtype=bool) if name == 'slips' else
+            np.zeros(shape) if name.startswith('cycles') else np.full(shape, np.nan) for name in RESULTS}
 
 
 class Utils:
@@ -30,118 +51,199 @@ class Utils:
     """
 
     @staticmethod
-    def array_timestamp_to_datetime(array_timestamp):
+    def observable_matrix(obs, cols_var, prns, name):
         """
-        Convert an array with string timestamp to an array of datetimes
+        Gather an observable of all satellites as a single (epoch x sv) matrix. The observable code depends on the
+        constellation (e.g. 'L2W' for GPS and 'L2C' for GLONASS), then each constellation fills its own columns
+
+        :param obs: Measures of the current rinex
+        :param cols_var: The observable codes per constellation (see settings.COLUMNS_IN_RINEX)
+        :param prns: Array with the satellites names (the columns of the matrix)
+        :param name: The observable name (e.g. 'L1', 'P2')
+        :return: The (epoch x sv) matrix, NaN for constellations not in cols_var
+        """
+        systems = np.array([prn[0:1] for prn in prns], dtype=str)
+        matrix = np.full((len(obs.time), len(prns)), np.nan)
+
+        for system in np.unique(systems):
+            if system in cols_var:
+                columns = systems == system
+                matrix[:, columns] = obs[cols_var[system][name]][:, columns]
+
+        return matrix
 
-        :param array_timestamp: Array with string date in timestamp format
-        :return: Array with datetime format elements
+    @staticmethod
+    def satellite_groups(sv, epochs, codes, budget):
+        """
+        Split the satellites into groups checked one at a time, each one within the memory budget. A satellite takes
+        8 bytes per epoch in each matrix: the observables decoded and the working ones (see WORKING_MATRICES)
+
+        :param sv: Array with the satellites names, sorted
+        :param epochs: The number of epochs of the rinex
+        :param codes: The number of observable codes decoded
+        :param budget: The memory budget, in MB
+        :return: List with the arrays of satellites names of each group (at least one satellite per group)
         """
-        array = []
+        per_satellite = max(epochs, 1) * 8 * (codes + WORKING_MATRICES)
+        if per_satellite > budget * 1024 ** 2:
+            logging.warning(">>>> A single satellite takes {:.0f} MB over {} epochs, above the memory budget ({} MB): "
+                            "each group has at least one, then the budget is exceeded".format(
+                                per_satellite / 1024 ** 2, epochs, budget))
+        size = max(int(budget * 1024 ** 2 // per_satellite), 1)
 
-        for item in array_timestamp.values:
-            array.append(dateparser.parse(str(item)))
+        return [sv[start:start + size] for start in range(0, len(sv), size)] or [sv]
 
-        return array
+    @staticmethod
+    def factors(f1, f2):
+        """
+        :param f1: F1 frequency (scalar or array)
+        :param f2: F2 frequency (scalar or array)
+        :return: List [f1, f2, factor_1, factor_2], the first and second factors of calculus of the frequencies
+        """
+        return [f1, f2, (f1 - f2) / (f1 + f2) / settings.C, (f1 * f2) / (f2 - f1) / settings.C]
 
     @staticmethod
-    def plot_graphs_2(array_original, array, prn):
-        fig, axs = plt.subplots(2, 1)
+    def subtract_cycles(obs, cols_var, prns, cycles_1, cycles_2):
+        """
+        Apply the cycle-slip corrections to the phases: the cycles of each (epoch x sv) matrix are subtracted from the
+        L1 and L2 observables of each constellation (the inverse of observable_matrix)
+
+        :param obs: Measures of the current rinex
+        :param cols_var: The observable codes per constellation (see settings.COLUMNS_IN_RINEX)
+        :param prns: Array with the satellites names (the columns of the matrices)
+        :param cycles_1: The cycles subtracted from L1, as a (epoch x sv) matrix
+        :param cycles_2: The cycles subtracted from L2, as a (epoch x sv) matrix
+        :return: New rinex.Observations, with corrected copies of the L1 and L2 observables (the others are shared)
+        """
+        systems = np.array([prn[0:1] for prn in prns], dtype=str)
+        data = dict(obs.data)
+
+        for name, cycles in (('L1', cycles_1), ('L2', cycles_2)):
+            for system in np.unique(systems):
+                if system in cols_var and cycles[:, systems == system].any():
+                    code = cols_var[system][name]
+                    if data[code] is obs[code]:
+                        data[code] = np.array(obs[code])
+                    data[code][:, systems == system] -= cycles[:, systems == system]
+
+        return rinex.Observations(obs.header, obs.time, obs.sv, data)
 
-        axs[0].plot(array_original)
+    @staticmethod
+    def find_peaks_rows(values, heights):
+        """
+        The same as scipy.signal.find_peaks(row, height=height)[0], for every row of a matrix at once. A peak is a
+        sample greater than both neighbours, NaN values (padding at the end of a row) are never peaks nor neighbours
+        of a peak. Rows with flat peaks (plateaus) fall back to find_peaks, which picks the middle of the plateau
+
+        :param values: Matrix with one series per row
+        :param heights: Array with the minimum height of the peaks of each row
+        :return: List with the array of peak indexes of each row
+        """
+        left, middle, right = values[:, :-2], values[:, 1:-1], values[:, 2:]
+        rising = left < middle
+        peaks = rising & (middle > right) & (middle >= heights[:, np.newaxis])
+        plateaus = (rising & (middle == right)).any(axis=1)
+
+        indexes = []
+        for k in range(len(values)):
+            if plateaus[k]:
+                from scipy.signal import find_peaks
+
+                row = values[k][~np.isnan(values[k])]
+                indexes.append(find_peaks(row, height=heights[k])[0])
+            else:
+                indexes.append(np.flatnonzero(peaks[k]) + 1)
+
+        return indexes
+
+    @staticmethod
+    def plot_graphs_2(fig, array_original, array, prn):
+        """
+        Draw the relative TEC of a PRN, before and after the cycle-slip corrections (see plots.PlotRenderer)
+
+        :param fig: The matplotlib figure
+        :param array_original: The positions and values of the relative TEC (see plots.decimate)
+        :param array: The positions and values of the relative TEC, with cycle-slip corrections
+        :param prn: The respective PRN
+        :return: None
+        """
+        axs = fig.subplots(2, 1)
+
+        axs[0].plot(*array_original)
         axs[0].set_title(prn)
         axs[0].set_ylabel('rTEC-orig')
         axs[0].grid(True)
 
-        axs[1].plot(array)
+        axs[1].plot(*array)
         axs[1].set_title(prn)
         axs[1].set_ylabel('rTEC-corr')
         axs[1].grid(True)
 
-        fig.savefig(prn + "_corrected.pdf")
-
     @staticmethod
-    def plot_graphs(array, limit, fourth_der, indexes, prn):
-        fig, axs = plt.subplots(2, 1)
+    def plot_graphs(fig, array, limit, fourth_der, slips, prn):
+        """
+        Draw the relative TEC of a PRN with the discontinuities detected, and the 4th order differences with their
+        threshold (see plots.PlotRenderer)
+
+        :param fig: The matplotlib figure
+        :param array: The positions and values of the relative TEC (see plots.decimate)
+        :param limit: The positions and values of the threshold (per valid measure)
+        :param fourth_der: The positions and values of the 4th order differences (per valid measure)
+        :param slips: The positions and values (in array) of the discontinuities
+        :param prn: The respective PRN
+        :return: None
+        """
+        axs = fig.subplots(2, 1)
 
-        axs[0].plot(array, label='rTEC')
+        axs[0].plot(*array, label='rTEC')
         axs[0].set_title(prn)
         axs[0].set_ylabel('[rTEC]')
         axs[0].legend(loc='best')
         axs[0].grid(True)
 
-        axs[1].plot(fourth_der, label='4th der')
-        axs[1].plot([0, len(fourth_der) - 1], [limit, limit], lw=0.5, ls='--', color='green')
-        axs[1].plot([0, len(fourth_der) - 1], [-limit, -limit], lw=0.5, ls='--', color='green')
+        axs[1].plot(*fourth_der, label='4th der')
+        axs[1].plot(limit[0], limit[1], lw=0.5, ls='--', color='green')
+        axs[1].plot(limit[0], -limit[1], lw=0.5, ls='--', color='green')
         axs[1].set_xlabel('Time')
         axs[1].set_ylabel('4th derivative')
         axs[1].legend(loc='best')
         axs[1].grid(True)
 
-        axs[0].scatter(indexes, array[indexes], marker='x', color='red', label='Cycle-slip')
-        # axs[1].scatter(indexes, fourth_der[indexes], marker='x', color='red', label='Cycle-slip')
-
-        plt.savefig(prn + ".pdf")
+        axs[0].scatter(*slips, marker='x', color='red', label='Cycle-slip')
 
     @staticmethod
     def setup_rinex_name(rinex_name):
         """
-        Test if rinex name is in the old fashion way or in another formats. In case the format is newer or older, the
-        method will always return the values needed
-            Example of formats name accept:
-                2.11: ALMA1520.18O
-                3.03: ALMA00BRA_R_20181520000_01D_30S_MO.rnx
+        The year, month and doy of a rinex name (see manifest.setup_rinex_name)
 
         :param rinex_name: String rinex filename
-        :return: Returns the String rinex absolute path, and the year, month and doy related
-        """
-        if rinex_name.endswith(".rnx"):
-            day_i, day_f = 16, 19
-            year_i, year_f, year_type = 12, 16, "%Y"
-            extens = "[rR][nN][xX]$"
-        elif bool(re.match("[oO]$", rinex_name[-1:])):
-            day_i, day_f = 4, 7
-            year_i, year_f, year_type = -3, -1, "%y"
-            extens = "[\\d]{2}[oO]$"
-        else:
-            logging.error(">>>> Error during rinex file reading. Check it and try again!")
-            sys.exit()
-
-        if len(rinex_name) == 0:
-            logging.error('>> Something wrong with parameter \'rinex_name\'!. Empty name!')
-            sys.exit()
-        elif not rinex_name[0:4].isalpha():
-            logging.error('>> Something wrong with parameter \'rinex_name\'!. IAGA code not well format!')
-            sys.exit()
-        elif not rinex_name[day_i:day_f].isdigit() or int(rinex_name[day_i:day_f]) > 366:
-            logging.error('>> Something wrong with parameter \'rinex_name\'!. Invalid day of the year!')
-            sys.exit()
-        elif not bool(re.match(extens, rinex_name[-3:])):
-            logging.error('>> Something wrong with parameter \'rinex_name\'!. Wrong extension or not well format!')
-            sys.exit()
-
-        doy = rinex_name[day_i:day_f]
-        year = datetime.datetime.strptime(rinex_name[year_i:year_f], year_type).strftime('%Y')
-        month = datetime.datetime.strptime(doy, '%j').strftime('%m')
-
-        return year, month, doy
+        :return: Returns the year, month and doy related
+        :raise ValueError: If the name is not in any of the formats accept
+        """
+        return mf.setup_rinex_name(rinex_name)
 
     @staticmethod
     def which_cols_to_load():
         """
         The rinex file is an extensive file, sometimes, with a lot of measures that are not interesting for this present
-        work. Said that, in this method is selected only the columns used during the EMBRACE TEC and Bias estimation
+        work. Said that, in this method is selected only the columns used during the EMBRACE TEC and Bias estimation,
+        of the constellations checked (settings.CONSTELLATIONS) in every rinex version supported (e.g. the BeiDou codes
+        differ between versions)
 
         :return: The columns to load in rinex
         """
         columns_to_be_load = []
         requiried_version = str(settings.REQUIRED_VERSION)
-        dict_list_cols = list(settings.COLUMNS_IN_RINEX[requiried_version].values())
+        versions = [requiried_version] + [version for version in settings.COLUMNS_IN_RINEX
+                                          if version != requiried_version]
 
-        for constellation in dict_list_cols:
-            for item in constellation.values():
-                if item not in columns_to_be_load:
-                    columns_to_be_load.append(item)
+        for version in versions:
+            for system, constellation in settings.COLUMNS_IN_RINEX[version].items():
+                if system not in settings.CONSTELLATIONS:
+                    continue
+                for item in constellation.values():
+                    if item not in columns_to_be_load:
+                        columns_to_be_load.append(item)
 
         return columns_to_be_load
 
@@ -161,21 +263,41 @@ class CycleSlip:
                 End
             End
     """
-    def __init__(self, folder):
+    def __init__(self, folder, workers=settings.WORKERS, output_folder=None, store_folder=None,
+                 checkpoint_folder=None):
+        """
+        :param folder: The rinex folder
+        :param workers: Number of processes, each one checking a rinex at a time (0 for one per CPU)
+        :param output_folder: Folder where the corrected rinex are saved (None to not save them)
+        :param store_folder: Folder where the results are appended, per station (see store.StationStore; None to
+            not save them)
+        :param checkpoint_folder: Folder where the finished files and PRNs are recorded, then a run killed resumes
+            from there (see checkpoint.Checkpoint; None to not record them)
+        """
         self.folder = folder
-        # self.output_folder = output_folder
-
-    def _prepare_factor(self, hdr, year, day, month):
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = cache.ObservationCache() if settings.use_cache else None
+        self.output_folder = output_folder
+        self.store_folder = store_folder
+        self.checkpoint_folder = checkpoint_folder
+        self.checkpoint = checkpoint.Checkpoint(checkpoint_folder) if checkpoint_folder is not None else None
+        self.plots = plots.renderer()
+        self._plot_folder = ''
+        self._prns = None
+
+    def _prepare_factor(self, hdr, year, month, doy):
         """
         The factors is used as a weight during the first estimate (relative TEC). For the GLONASS constellation, the
-        factors are selective, per PRN, then, this values can be download from the own rinex or a URL
+        factors are selective, per PRN, then, this values are taken from the own rinex or, when the header lacks
+        them, from the offline channel store (glonass.ChannelStore)
 
         :param hdr: The current rinex header, which brings the information of GLONASS channels
-        :param year: Year of the current rinex
-        :param month: Month of the current rinex
-        :param day: Day of the current rinex
-        :return: The GLONASS factors, already multiply by the frequencies F1 and F2
-            GLONASS factor Python object. Format example:
+        :param year: Year (YYYY) of the current rinex
+        :param month: Month (mm) of the current rinex
+        :param doy: Julian day (ddd) of the current rinex
+        :return: The GLONASS factors (glonass.GlonassFactors), already multiply by the frequencies F1 and F2. They are
+            computed once per header record (or per date, when the header lacks it) and then kept in glonass.factors.
+            Indexed by the slot, as the GLONASS factor Python object. Format example:
                     factor_glonass = {
                                 '01': VALUE_1, VALUE_2, VALUE_3
                                 '02': VALUE_1, VALUE_2, VALUE_3
@@ -184,256 +306,847 @@ class CycleSlip:
                                 '05': ...
                         }
         """
-        if "GLONASS SLOT / FRQ #" not in hdr:
-            glonnas_channel = dw.DownloadGlonassChannel(year, day, month)
-            glonnas_channel.download()
+        return glonass.factors.get(glonass.FactorCache.key(hdr, year, month, doy),
+                                   lambda: glonass.GlonassFactors(self._parse_channels(hdr, year, doy)))
 
-            glonass_channels_parser = pr.ParserChannels(glonnas_channel.file_uncompressed)
-            glonass_channels_parser.parser()
-        else:
+    def _parse_channels(self, hdr, year, doy):
+        """
+        :param hdr: The current rinex header
+        :param year: Year (YYYY) of the current rinex
+        :param doy: Julian day (ddd) of the current rinex
+        :return: Python dict with the slot as key and [f1, f2, factor_1, factor_2] as value
+        :raise ValueError: If the header lacks the channels and the store has none up to the date of the rinex
+        """
+        if "GLONASS SLOT / FRQ #" in hdr:
             glonass_channels_parser = pr.ParserRinexChannels(hdr['GLONASS SLOT / FRQ #'])
             glonass_channels_parser.parser()
+            return glonass_channels_parser.parsed
+
+        date = datetime.datetime.strptime(str(year) + str(doy), '%Y%j')
+        store = glonass.channel_store()
+        parsed = store.factors(date.strftime('%Y-%m-%d'))
+
+        if not parsed and settings.GLONASS_CHANNELS_DOWNLOAD:
+            glonnas_channel = dw.DownloadGlonassChannel(date.strftime('%Y'), date.strftime('%d'), date.strftime('%m'))
+            glonnas_channel.download()
+
+            store.import_channel_file(glonnas_channel.file_uncompressed, date.strftime('%Y-%m-%d'))
+            store.save()
+            parsed = store.factors(date.strftime('%Y-%m-%d'))
 
-        return glonass_channels_parser.parsed
+        if not parsed:
+            raise ValueError("No GLONASS channels in the header, nor in the channel store {} up to {} (see "
+                             "-glonass_import)".format(store.file, date.strftime('%Y-%m-%d')))
 
-    def _detect(self, rtec_nan, rtec_no_nan, prn):
+        logging.info(">> GLONASS channels taken from the channel store ({} slots)".format(len(parsed)))
+        return parsed
+
+    def _detect(self, rtec_arcs):
         """
         The method precisely detect the variations over relative TEC (by the L1 and L2 differences). When a "degree"
-        effect is present, a peak on the fourth derivative occurs. The index of this peak is store on "indexes"
-        variable and then returned
+        effect is present, a peak on the fourth derivative occurs. Each arc is detected on its own (the differences
+        never join samples of different arcs), and all arcs at once: each row of rtec_arcs is an arc, padded with NaN
 
-        :param rtec: The relative TEC (with NaNs)
-        :param rtec_no_nan: The relative TEC (no NaNs)
-        :return: The rtec indexes (in the array with NaN values) where the "degree" effect is presented
+        :param rtec_arcs: Matrix (arcs x samples) with the relative TEC (no NaNs) of each arc
+        :return: List with the indexes (in each arc) where the "degree" effect is presented, and the fourth
+            derivatives and thresholds (standard deviation * settings.LIMIT_STD) of each arc
         """
-        fourth_der_not_nan = np.diff(rtec_no_nan, n=4)
-        std_fourth_der_not_nan = np.nanstd(fourth_der_not_nan) * settings.LIMIT_STD
-        indexes = find_peaks(abs(fourth_der_not_nan), height=std_fourth_der_not_nan)[0]
-        indexes = np.array(indexes)
+        fourth_der = np.diff(rtec_arcs, n=4, axis=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            std_fourth_der = np.nanstd(fourth_der, axis=1) * settings.LIMIT_STD
 
-        if len(indexes) == 0:
-            logging.info(">>>>>> No discontinuities detected (by final differences) for PRN {}".format(prn))
-        else:
-            logging.info(">>>>>> Discontinuities detected in {} (not NaN) for PRN {}".format(indexes, prn))
+        indexes = Utils.find_peaks_rows(np.abs(fourth_der), std_fourth_der)
 
-        # indexes_before: utilizado apenas para plotar
-        indexes_before = []
-        for index in indexes:
-            element = rtec_no_nan.item(index)
-            pos_before = np.where(rtec_nan == element)
-            pos_before = np.array(pos_before).flatten().tolist()
-            indexes_before.append(pos_before[0])
+        return indexes, fourth_der, std_fourth_der
 
-        if settings.plot_it:
-            if len(indexes_before) != 0:
-                Utils.plot_graphs(rtec_nan, std_fourth_der_not_nan, fourth_der_not_nan, indexes_before, prn)
-
-        return indexes
-
-    def _correct(self, l1, l2, c1, p2, rtec, mwlc, f1, f2, factor_1, factor_2, index):
+    def _report(self, rtec_nan, epochs, prn_arcs, indexes, fourth_der, std_fourth_der, prn):
         """
-        As a result of the detection of inconsistencies, this method compensate the irregularities on L1 and L2
-        observations, directly at the rinex (obs variable)
-
-        :param l1: L1 measures (no NaN values)
-        :param l2: L2 measures (no NaN values)
-        :param c1: C1 measures (no NaN values)
-        :param p2: P2 measures (no NaN values)
-        :param rtec_not_nan: relative TEC (no NaNs)
-        :param mlwc: No NaN MLWC factor
-        :param f1: F1 frequency (either GPS or GLONASS)
-        :param f2: F2 frequency (either GPS or GLONASS)
-        :param factor_1: first factor of calculus (either GPS or GLONASS)
-        :param factor_2: second factor of calculus (either GPS or GLONASS)
-        :param index: The point of inconsistence (array with no NaN values)
-        :return: The corrected observation file and the respective relative TEC
+        Log (and plot) the discontinuities detected over the arcs of a PRN
+
+        :param rtec_nan: The relative TEC (with NaNs)
+        :param epochs: The epochs of the valid (not NaN) measures
+        :param prn_arcs: List of (j, arc), the arcs of the PRN and their rows in indexes, fourth_der and std_fourth_der
+        :param indexes: List with the indexes (in each arc) where the "degree" effect is presented (see _detect)
+        :param fourth_der: Matrix with the fourth derivatives of each arc (see _detect)
+        :param std_fourth_der: Array with the threshold of each arc (see _detect)
+        :param prn: The respective PRN
+        :return: None
         """
-        diff_rtec = rtec[index] - rtec[index-1]
-        diff_mwlc = mwlc[index] - mwlc[index-1]
+        positions = np.concatenate([arc.start + indexes[j] for j, arc in prn_arcs] or [[]]).astype(np.int64)
+        logging.debug(">>>>>> {} arc(s) for PRN {}: {}".format(len(prn_arcs), prn,
+                                                            ", ".join(str(arc.length) for _, arc in prn_arcs)))
 
-        var_1 = diff_mwlc * settings.C
-        var_2 = var_1 / f1
-        diff_2 = round((diff_rtec - var_2) * factor_2)
-        diff_1 = diff_2 + round(diff_mwlc)
+        if len(positions) == 0:
+            logging.info(">>>>>> No discontinuities detected (by final differences) for PRN {}".format(prn))
+            return None
 
-        cor_r_1 = l1[index] - diff_1
-        cor_r_2 = l2[index] - diff_2
+        logging.info(">>>>>> Discontinuities detected in {} (not NaN) for PRN {}".format(positions, prn))
 
-        var_corr_1 = cor_r_1 / f1
-        var_corr_2 = cor_r_2 / f2
+        if self.plots.wants():
+            fourth_der_prn = np.full(len(epochs), np.nan)
+            std_fourth_der_prn = np.full(len(epochs), np.nan)
+            for j, arc in prn_arcs:
+                width = max(arc.length - 4, 0)
+                fourth_der_prn[arc.start:arc.start + width] = fourth_der[j, :width]
+                std_fourth_der_prn[arc.start:arc.end] = std_fourth_der[j]
 
-        rtec[index] = (var_corr_1 - var_corr_2) * settings.C
-        mwlc[index] = (cor_r_1 - cor_r_2) - (f1 * c1[index] + f2 * p2[index]) * factor_1
+            with metrics.timer('plots'):
+                self.plots.submit(Utils.plot_graphs, os.path.join(self._plot_folder, prn + ".pdf"),
+                                  plots.decimate(rtec_nan), plots.decimate(std_fourth_der_prn),
+                                  plots.decimate(fourth_der_prn), (epochs[positions], rtec_nan[epochs[positions]]),
+                                  prn)
 
-        l1[index:len(l1)] -= diff_1
-        l2[index:len(l2)] -= diff_2
+        return None
 
-        return rtec, l1, l2
+    def _correct_cycle_slip(self, l1, l2, c1, p2, rtec, mwlc, indexes, f1, f2, factor_1, factor_2):
+        """
+        The sequential step of the correction, over the measures of a single arc
+
+        :param l1: L1 measures of the arc
+        :param l2: L2 measures of the arc
+        :param c1: C1 measures of the arc
+        :param p2: P2 measures of the arc
+        :param rtec: The relative TEC of the arc
+        :param mwlc: The Melbourne-Wubbena combination of the arc
+        :param indexes: The indexes (in the arc) where the 4th order final differences detected a discontinuity
+        :param f1: F1 frequency (of the constellation of the PRN)
+        :param f2: F2 frequency (of the constellation of the PRN)
+        :param factor_1: first factor of calculus (of the constellation of the PRN)
+        :param factor_2: second factor of calculus (of the constellation of the PRN)
+        :return: The relative TEC of the arc, with cycle-slip corrections, a boolean array with True where a
+            cycle-slip was corrected, and the cycles subtracted from L1 and L2 (see kernel.detect_and_correct)
+        """
+        new_arc = np.zeros(len(l1), dtype=bool)
+        peaks = np.zeros(len(l1), dtype=bool)
+        peaks[indexes] = True
+
+        return kernel.detect_and_correct(l1, l2, c1, p2, new_arc, peaks, f1, f2, factor_1, factor_2,
+                                         settings.C, settings.DIFF_TEC_MAX, rtec=rtec, mwlc=mwlc)
+
+    def _detect_and_correct_arcs(self, obs_time, l1, l2, c1, p2, f1, f2, factor_1, factor_2, prns, workers=1,
+                                 finished=None):
+        """
+        Split the measures of each PRN into continuous arcs (see arcs.segment), detect the discontinuities of all
+        arcs at once and correct each arc on its own. As the arcs are independent, they are corrected in parallel
+        (threads, which run concurrently with the 'numba' kernel backend), and taken in the order of the PRNs: each
+        PRN is finished as soon as its last arc is corrected
+
+        :param obs_time: The array of all times (datetime64) regarding the current rinex file
+        :param l1: L1 measures (with NaN values), as a (epoch x sv) matrix
+        :param l2: L2 measures (with NaN values), as a (epoch x sv) matrix
+        :param c1: C1 measures (with NaN values), as a (epoch x sv) matrix
+        :param p2: P2 measures (with NaN values), as a (epoch x sv) matrix
+        :param f1: Array with the F1 frequency of each PRN
+        :param f2: Array with the F2 frequency of each PRN
+        :param factor_1: Array with the first factor of calculus of each PRN
+        :param factor_2: Array with the second factor of calculus of each PRN
+        :param prns: Array with the satellites names
+        :param workers: Number of threads correcting arcs
+        :param finished: Function called with the name and the results (Python dict with the array of each result) of
+            each PRN finished, e.g. to record it in the checkpoint (see _finish_prn)
+        :return: Python dict with the (epoch x sv) matrices of the results (see RESULTS):
+            rtec: The relative TEC (rtec_nan)
+            rtec_corrected: The relative TEC with cycle-slip corrections
+            mwlc: The Melbourne-Wubbena combination
+            slips: True where a cycle-slip was corrected
+            cycles_1, cycles_2: The cycles subtracted from L1 and L2 (0 where nothing was corrected)
+        """
+        rtec = ((l1 / f1) - (l2 / f2)) * settings.C
+        mwlc = (l1 - l2) - (f1 * c1 + f2 * p2) * factor_1
+        not_nan = ~np.isnan(rtec)
+
+        # rows[k]: the epochs of the valid measures of the PRN k (in time order), followed by the invalid ones
+        rows = np.argsort(~not_nan, axis=0, kind='stable').T
+        counts = not_nan.sum(axis=0)
+        rtec_rows = np.take_along_axis(rtec.T, rows, axis=1)
+
+        with metrics.timer('detection'):
+            arc_list, columns = [], []
+            for k, prn in enumerate(prns):
+                prn_arcs = arcs.segment(obs_time[rows[k, :counts[k]]], prn)
+                arc_list.extend(prn_arcs)
+                columns.extend([k] * len(prn_arcs))
+                metrics.count('epochs', counts[k], prn)
+                metrics.count('arcs', len(prn_arcs), prn)
+            columns = np.array(columns, dtype=np.int64)
+
+            logging.info(">>>> Detecting peaks on the 4th order final differences in rTEC ({} arcs of {} PRNs)..."
+                         .format(len(arc_list), len(prns)))
+            rtec_arcs = arcs.stack(rtec_rows.ravel(), columns * len(obs_time) + [arc.start for arc in arc_list],
+                                   [arc.length for arc in arc_list])
+            indexes, fourth_der, std_fourth_der = self._detect(rtec_arcs)
+        metrics.count('measures', counts.sum())
+        metrics.count('arcs', len(arc_list))
+
+        for k, prn in enumerate(prns):
+            prn_arcs = [(j, arc_list[j]) for j in np.flatnonzero(columns == k)]
+            self._report(rtec[:, k], rows[k, :counts[k]], prn_arcs, indexes, fourth_der, std_fourth_der, prn)
+
+        collected = metrics.current()
+
+        def correct(j):
+            arc, k = arc_list[j], columns[j]
+            epochs = rows[k, arc.start:arc.end]
+            with collected.timer('correction', arc.prn):
+                return self._correct_cycle_slip(l1[epochs, k], l2[epochs, k], c1[epochs, k], p2[epochs, k],
+                                                rtec_rows[k, arc.start:arc.end], mwlc[epochs, k], indexes[j],
+                                                float(f1[k]), float(f2[k]), float(factor_1[k]), float(factor_2[k]))
+
+        logging.info(">>>> Finding discontinuities and correcting cycle-slips...")
+        results = empty_results(rtec.shape)
+        results['rtec'], results['mwlc'] = rtec, mwlc
+
+        # the last arc of each PRN (the arcs are in the order of the PRNs), -1 for the PRNs with no arcs
+        last_arc = np.full(len(prns), -1, dtype=np.int64)
+        last_arc[columns] = np.arange(len(arc_list))
+
+        def finish(k):
+            if finished is not None:
+                finished(prns[k], {name: results[name][:, k] for name in RESULTS})
+
+        with metrics.timer('correction'), ThreadPoolExecutor(max_workers=workers) as executor:
+            for k in np.flatnonzero(last_arc < 0):
+                finish(k)
+
+            for j, (rtec_arc, slips, cycles_1, cycles_2) in enumerate(executor.map(correct, range(len(arc_list)))):
+                arc, k = arc_list[j], columns[j]
+                epochs = rows[k, arc.start:arc.end]
+                results['rtec_corrected'][epochs, k] = rtec_arc
+                if slips.any():
+                    metrics.count('slips', slips.sum(), arc.prn)
+                    results['slips'][epochs, k] = slips
+                    results['cycles_1'][epochs, k] = cycles_1
+                    results['cycles_2'][epochs, k] = cycles_2
+                    logging.info(">>>>>> Cycle-slips corrected at {} (PRN {})".format(
+                        arc.start + np.flatnonzero(slips), arc.prn))
+
+                if last_arc[k] == j:
+                    finish(k)
+
+        return results
 
     def _detect_and_correct_cycle_slip(self, obs_time, l1, l2, c1, p2, f1, f2, factor_1, factor_2, prn):
         """
         Start the variables to check cycle-slip for each PRN presented in rinex files
 
-        :param obs_time: The array of all times (already converted to datetimes) regarding the current rinex file
+        :param obs_time: The array of all times (datetime64) regarding the current rinex file
         :param l1: L1 measures (with NaN values)
         :param l2: L2 measures (with NaN values)
         :param c1: C1 measures (with NaN values)
         :param p2: P2 measures (with NaN values)
-        :param f1: F1 frequency (either GPS or GLONASS)
-        :param f2: F2 frequency (either GPS or GLONASS)
-        :param factor_1: first factor of calculus (either GPS or GLONASS)
-        :param factor_2: second factor of calculus (either GPS or GLONASS)
+        :param f1: F1 frequency (of the constellation of the PRN)
+        :param f2: F2 frequency (of the constellation of the PRN)
+        :param factor_1: first factor of calculus (of the constellation of the PRN)
+        :param factor_2: second factor of calculus (of the constellation of the PRN)
         :param prn: The respective PRN
-        :return: The relative TEC base on the differences between L1 and L2 (rtec_nan), with cycle-slip corrections
+        :return: Python dict with the results of the PRN (see _detect_and_correct_arcs), as arrays: among them, the
+            relative TEC base on the differences between L1 and L2 (rtec_nan), with cycle-slip corrections
         """
-        j_start = 0
+        results = self._detect_and_correct_arcs(obs_time, *(np.reshape(values, (-1, 1)) for values in
+                                                             (l1, l2, c1, p2)),
+                                                *(np.array([value], dtype=np.float64) for value in
+                                                  (f1, f2, factor_1, factor_2)), [prn])
 
-        rtec_nan = ((l1 / f1) - (l2 / f2)) * settings.C
-        mwlc_nan = (l1 - l2) - (f1 * c1 + f2 * p2) * factor_1
+        return {name: values[:, 0] for name, values in results.items()}
 
-        rtec_no_nan = rtec_nan.copy()
-        mwlc_no_nan = mwlc_nan.copy()
-        rtec_no_nan = rtec_no_nan[~np.isnan(rtec_no_nan)]
-        mwlc_no_nan = mwlc_no_nan[~np.isnan(mwlc_no_nan)]
+    def _frequencies(self, hdr, prns, year, month, doy):
+        """
+        The frequency table of the rinex, built once per file from the constellations registry (see
+        settings.FREQUENCIES) and, for GLONASS, from the channels of each slot (see _prepare_factor)
 
-        nan_pos = np.where(np.isnan(rtec_nan))
-        nan_pos = np.array(nan_pos).flatten().tolist()
-        not_nan_pos = np.where(~np.isnan(rtec_nan))
-        not_nan_pos = np.array(not_nan_pos).flatten().tolist()
+        :param hdr: Header of the current rinex
+        :param prns: Array with the satellites names
+        :param year: Year (YYYY) of the current rinex
+        :param month: Month (mm) of the current rinex
+        :param doy: Julian day (ddd) of the current rinex
+        :return: Arrays f1, f2, factor_1 and factor_2, with a value per PRN (NaN for the constellations out of the
+            registry and the GLONASS slots with no channel, which are not checked)
+        """
+        prns = np.asarray(prns)
+        systems = np.array([prn[0:1] for prn in prns], dtype=str)
+        frequencies = np.full((4, len(prns)), np.nan)
+
+        for system in np.unique(systems):
+            columns = systems == system
+            if system not in settings.FREQUENCIES:
+                logging.warning(">>>> No frequencies for the constellation {} (see settings.FREQUENCIES), {} not "
+                                "checked".format(system, ", ".join(prns[columns])))
+            elif settings.FREQUENCIES[system] is not None:
+                frequencies[:, columns] = np.reshape(Utils.factors(*settings.FREQUENCIES[system]), (4, 1))
+            else:
+                try:
+                    with metrics.timer('factors'):
+                        factor_glonass = self._prepare_factor(hdr, year, month, doy)
+                except ValueError as error:
+                    logging.warning(">>>> " + str(error))
+                    factor_glonass = glonass.GlonassFactors({})
+                frequencies[:, columns] = factor_glonass.take(prns[columns])
 
-        not_nan_pos = np.array(not_nan_pos).flatten().tolist()
-        not_nan_obs_time = [obs_time[x] for x in not_nan_pos]
-        l1_not_nan = [l1[x] for x in not_nan_pos]
-        l2_not_nan = [l2[x] for x in not_nan_pos]
-        c1_not_nan = [c1[x] for x in not_nan_pos]
-        p2_not_nan = [p2[x] for x in not_nan_pos]
+                unknown = prns[columns][np.isnan(frequencies[0, columns])]
+                if len(unknown):
+                    logging.warning(">>>> No GLONASS channel for {}, not checked".format(", ".join(unknown)))
 
-        logging.info(">>>> Detecting peaks on the 4th order final differences in rTEC...")
-        indexes = self._detect(rtec_nan, rtec_no_nan, prn)
+        return frequencies
 
-        logging.info(">>>> Finding discontinuities and correcting cycle-slips (PRN {})...".format(prn))
-        for i in range(1, len(not_nan_obs_time)):
-            rtec_no_nan[i] = ((l1_not_nan[i] / f1) - (l2_not_nan[i] / f2)) * settings.C
-            mwlc_no_nan[i] = (l1_not_nan[i] - l2_not_nan[i]) - (f1 * c1_not_nan[i] + f2 * p2_not_nan[i]) * factor_1
+    def _plot_results(self, obs_time, prns, results, quicklook=True):
+        """
+        Queue the plots of the relative TEC of each PRN, before and after the cycle-slip corrections, and the
+        quicklook of the rinex (see plots.quicklook)
+
+        :param obs_time: The array of all times (datetime64) regarding the current rinex file
+        :param prns: Array with the satellites names
+        :param results: The results of the current rinex (see _detect_and_correct_arcs)
+        :param quicklook: Queue the quicklook too (False when the PRNs are only a group of the rinex, see
+            _check_groups)
+        :return: None
+        """
+        with metrics.timer('plots'):
+            for k, prn in enumerate(prns):
+                if self.plots.wants(results['slips'][:, k].any()):
+                    self.plots.submit(Utils.plot_graphs_2, os.path.join(self._plot_folder, prn + "_corrected.pdf"),
+                                      plots.decimate(results['rtec'][:, k]),
+                                      plots.decimate(results['rtec_corrected'][:, k]), prn)
 
-            t1 = not_nan_obs_time[i-1]
-            t2 = not_nan_obs_time[i]
+            if quicklook and self.plots.wants_quicklook() and len(obs_time):
+                self._plot_quicklook(prns, [self._quicklook_part(obs_time, results)])
 
-            if t2 - t1 > datetime.timedelta(minutes=15):
-                j_start = i
-                continue
+        return None
 
-            if i in indexes:
-                logging.info(">>>>>> Indexes match ({}): correcting cycle-slips...".format(i, prn))
-                rtec_no_nan, l1_not_nan, l2_not_nan = self._correct(l1_not_nan, l2_not_nan, c1_not_nan, p2_not_nan,
-                                                                    rtec_no_nan, mwlc_no_nan, f1, f2,
-                                                                    factor_1, factor_2, i)
+    @staticmethod
+    def _quicklook_part(obs_time, results):
+        """
+        :param obs_time: The array of all times (datetime64) regarding the current rinex file
+        :param results: The results of (a group of) the PRNs of the current rinex (see _detect_and_correct_arcs)
+        :return: The regular time grid of the relative TEC with corrections (see plots.time_grid), and the hours and
+            columns of the cycle-slips
+        """
+        hours, step, rtec = plots.time_grid(obs_time, results['rtec_corrected'])
+        epochs, columns = np.nonzero(results['slips'])
+        slip_hours = (obs_time[epochs] - obs_time[0].astype('datetime64[D]')) / np.timedelta64(1, 'h')
 
-            if i - j_start + 1 >= 12:
-                add_tec = 0
-                add_tec_2 = 0
+        return hours, step, rtec, slip_hours, columns
 
-                for jj in range(1, 10):
-                    add_tec = add_tec + rtec_no_nan[i-jj] - rtec_no_nan[i-jj-1]
-                    add_tec_2 = add_tec_2 + pow(rtec_no_nan[i-jj] - rtec_no_nan[i-jj-1], 2)
+    def _plot_quicklook(self, prns, parts):
+        """
+        Queue the quicklook of the rinex, joining the parts of its groups of PRNs (see _quicklook_part)
 
-                p_mean = add_tec / 10
-                p_dev = np.maximum(np.sqrt(add_tec_2 / 10 - pow(p_mean, 2)), settings.DIFF_TEC_MAX)
-            else:
-                p_mean = 0
-                p_dev = settings.DIFF_TEC_MAX * 2.5
+        :param prns: Array with the satellites names (of all the groups, in order)
+        :param parts: List with the part of each group
+        :return: None
+        """
+        hours, step = parts[0][:2]
+        offsets = np.cumsum([0] + [part[2].shape[1] for part in parts])
+        rtec = np.concatenate([part[2] for part in parts], axis=1)
+        slips = (np.concatenate([part[3] for part in parts]),
+                 np.concatenate([part[4] + offset for part, offset in zip(parts, offsets)]))
+
+        self.plots.submit(plots.quicklook, os.path.join(self._plot_folder, "quicklook.png"), hours, step,
+                          np.asarray(prns), rtec, slips, self._plot_folder.replace(os.sep, ' '))
 
-            pmin_tec = p_mean - p_dev * 2
-            pmax_tec = p_mean + p_dev * 2
-            diff_rtec = rtec_no_nan[i] - rtec_no_nan[i-1]
+        return None
 
-            if not pmin_tec < diff_rtec and diff_rtec <= pmax_tec:
-                rtec_no_nan, l1_not_nan, l2_not_nan = self._correct(l1_not_nan, l2_not_nan, c1_not_nan, p2_not_nan,
-                                                                    rtec_no_nan, mwlc_no_nan, f1, f2,
-                                                                    factor_1, factor_2, i)
+    def _cycle_slip_analysis_batched(self, hdr, obs, year, month, doy):
+        """
+        The same analysis of _cycle_slip_analysis, with all PRNs at once: the observables are taken as (epoch x sv)
+        matrices, where rTEC, MWLC and the detection (4th order differences, thresholds and peaks) are computed in
+        single array operations. Only the sequential correction runs arc by arc, in parallel, and each PRN is recorded
+        in the checkpoint as soon as its arcs are corrected (see _finish_prn)
+
+        :param hdr: Header of the current rinex
+        :param obs: Measures of the current rinex
+        :param year: Year (YYYY) of the current rinex
+        :param month: Month (mm) of the current rinex
+        :param doy: Julian day (ddd) of the current rinex
+        :return: Python dict with the (epoch x sv) matrices of the results (see _detect_and_correct_arcs)
+        """
+        prns = obs.sv
 
-        for i in range(len(nan_pos)):
-            nan_pos[i] -= i
+        requiried_version = str(hdr.get('version'))
+        cols_var = settings.COLUMNS_IN_RINEX[requiried_version]
 
-        rtec_nan = np.insert(rtec_no_nan, nan_pos, np.nan)
-        rtec_nan = rtec_nan.tolist()
+        f1, f2, factor_1, factor_2 = self._frequencies(hdr, prns, year, month, doy)
+        l1, l2, c1, p2 = (Utils.observable_matrix(obs, cols_var, prns, name) for name in ('L1', 'L2', 'C1', 'P2'))
 
-        return rtec_nan
+        return self._detect_and_correct_arcs(obs.time, l1, l2, c1, p2, f1, f2, factor_1, factor_2, prns,
+                                             workers=settings.ARC_WORKERS, finished=self._finish_prn)
 
-    def _cycle_slip_analysis(self, hdr, obs, year, month, doy):
+    def _cycle_slip_analysis_shared(self, hdr, obs, year, month, doy):
         """
+        The same analysis of _cycle_slip_analysis, with the PRNs checked in parallel by a pool of settings.PRN_WORKERS
+        processes. The observables (epoch x sv matrices) are placed once in shared memory, where the processes read
+        the columns of their PRNs and write back the relative TEC with cycle-slip corrections. Only the PRN indexes
+        (and the log records) are sent between the processes. The PRNs with more measures are submitted first, while
+        the logs are emitted in the order of the PRNs
+
         :param hdr: Header of the current rinex
         :param obs: Measures of the current rinex
         :param year: Year (YYYY) of the current rinex
         :param month: Month (mm) of the current rinex
         :param doy: Julian day (ddd) of the current rinex
-        :return:
+        :return: Python dict with the (epoch x sv) matrices of the results (see _detect_and_correct_arcs)
         """
-        prns = obs.sv.values
-        obs_time = Utils.array_timestamp_to_datetime(obs.time)
+        prns = obs.sv
 
         requiried_version = str(hdr.get('version'))
         cols_var = settings.COLUMNS_IN_RINEX[requiried_version]
 
-        for prn in prns:
-            l1 = np.array(obs[cols_var[prn[0:1]]['L1']].sel(sv=prn).values)
-            l2 = np.array(obs[cols_var[prn[0:1]]['L2']].sel(sv=prn).values)
-            c1 = np.array(obs[cols_var[prn[0:1]]['C1']].sel(sv=prn).values)
-            p2 = np.array(obs[cols_var[prn[0:1]]['P2']].sel(sv=prn).values)
+        frequencies = self._frequencies(hdr, prns, year, month, doy)
+        l1, l2, c1, p2 = (Utils.observable_matrix(obs, cols_var, prns, name) for name in ('L1', 'L2', 'C1', 'P2'))
+        rtec = ((l1 / frequencies[0]) - (l2 / frequencies[1])) * settings.C
 
-            if prn[0:1] == 'R':
-                factor_glonass = self._prepare_factor(hdr, year, month, doy)
-                f1 = factor_glonass[prn[1:]][0]
-                f2 = factor_glonass[prn[1:]][1]
-                factor_1 = factor_glonass[prn[1:]][2]
-                factor_2 = factor_glonass[prn[1:]][3]
-            elif prn[0:1] == 'G':
-                f1 = settings.F1
-                f2 = settings.F2
-                factor_1 = settings.factor_1
-                factor_2 = settings.factor_2
+        level = logging.getLogger().getEffectiveLevel()
+        order = np.argsort(-np.sum(~np.isnan(rtec), axis=0), kind='stable')
 
-            rtec_corrected = self._detect_and_correct_cycle_slip(obs_time, l1, l2, c1, p2,
-                                                                 f1, f2, factor_1, factor_2, prn)
+        logging.info(">>>> Checking {} PRNs with {} processes...".format(len(prns), settings.PRN_WORKERS))
+        with shared.SharedArrays.create(dict(empty_results(rtec.shape), time=obs.time, l1=l1, l2=l2, c1=c1,
+                                             p2=p2)) as arrays:
+            with ProcessPoolExecutor(max_workers=settings.PRN_WORKERS, initializer=_attach_shared,
+                                     initargs=(arrays.spec,)) as executor:
+                futures = {k: executor.submit(_check_prn, self.folder, k, prns[k], frequencies[:, k].tolist(), level,
+                                              self._plot_folder) for k in order}
+                for k in range(len(prns)):
+                    records, prn_metrics = futures[k].result()
+                    for record in records:
+                        logging.getLogger(record.name).handle(record)
+                    metrics.current().merge(prn_metrics)
+                    self._finish_prn(prns[k], {name: arrays[name][:, k] for name in RESULTS})
 
-            rtec = ((l1 / f1) - (l2 / f2)) * settings.C
+            results = {name: np.array(arrays[name]) for name in RESULTS}
 
-            Utils.plot_graphs_2(rtec, rtec_corrected, prn)
+        return results
 
-        return obs
+    def _finish_prn(self, prn, columns):
+        """
+        Record a finished PRN in the checkpoint, if any (see checkpoint.FilePrns)
 
-    def initialize(self):
+        :param prn: The respective PRN
+        :param columns: Python dict with the array of each result of the PRN (see RESULTS)
+        :return: None
+        """
+        if self._prns is not None:
+            self._prns.save(prn, {name: np.asarray(columns[name]) for name in RESULTS})
+
+        return None
+
+    def _cycle_slip_analysis(self, hdr, obs, year, month, doy, quicklook=True):
+        """
+        Check the PRNs of a rinex (see _cycle_slip_analysis_shared and _cycle_slip_analysis_batched), but the ones
+        already finished in the checkpoint, which are taken from there
+
+        :param hdr: Header of the current rinex
+        :param obs: Measures of the current rinex
+        :param year: Year (YYYY) of the current rinex
+        :param month: Month (mm) of the current rinex
+        :param doy: Julian day (ddd) of the current rinex
+        :param quicklook: Plot the quicklook of the rinex (see _plot_results)
+        :return: Python dict with the (epoch x sv) matrices of the results (see _detect_and_correct_arcs)
+        """
+        finished = self._prns.load(len(obs.time), RESULTS, obs.sv) if self._prns is not None else {}
+        pending = np.array([prn not in finished for prn in obs.sv], dtype=bool)
+
+        results = empty_results((len(obs.time), len(obs.sv)))
+        for k, prn in enumerate(obs.sv):
+            if prn in finished:
+                for name in RESULTS:
+                    results[name][:, k] = finished[prn][name]
+
+        if pending.any():
+            pending_obs = obs if pending.all() else rinex.Observations(
+                obs.header, obs.time, obs.sv[pending], {code: matrix[:, pending] for code, matrix in obs.data.items()})
+
+            if settings.PRN_WORKERS > 1 and len(pending_obs.sv) > 1:
+                checked = self._cycle_slip_analysis_shared(hdr, pending_obs, year, month, doy)
+            else:
+                checked = self._cycle_slip_analysis_batched(hdr, pending_obs, year, month, doy)
+
+            for name in RESULTS:
+                results[name][:, pending] = checked[name]
+
+        self._plot_results(obs.time, obs.sv, results, quicklook)
+
+        return results
+
+    def process_file(self, entry):
+        """
+        Read and check a single rinex. Any error is logged and reported in the result, then a bad file does not stop
+        the others
+
+        :param entry: The manifest entry of the rinex (see manifest.Manifest)
+        :return: Python dict with the file, the status ('ok' or 'failed'), the error (if so), the seconds spent and
+            the metrics of each stage and PRN (see metrics.Metrics.as_dict)
+        """
+        start = time.perf_counter()
+        file = entry['file']
+        result = {'file': file, 'status': 'ok', 'error': None}
+
+        with metrics.collect() as file_metrics:
+            try:
+                logging.info(">>>> Reading rinex: " + file)
+                self._plot_folder = os.path.join(entry['station'], '{}-{:03d}'.format(entry['year'],
+                                                                                     int(entry['doy'])))
+                self._prns = self.checkpoint.prns(entry) if self.checkpoint is not None else None
+                with metrics.timer('header'):
+                    reader = rinex.RinexObsReader(entry['path'])
+                    hdr = reader.header
+                columns_to_be_load = Utils.which_cols_to_load()
+
+                if settings.MEMORY_BUDGET_MB is not None:
+                    outputs = self._check_groups(entry, reader, hdr, columns_to_be_load)
+                else:
+                    with metrics.timer('load'):
+                        if self.cache is not None:
+                            obs = self.cache.read(reader, columns_to_be_load, settings.CONSTELLATIONS)
+                        else:
+                            obs = reader.read(columns_to_be_load, settings.CONSTELLATIONS)
+                    metrics.count('epochs', len(obs.time))
+                    metrics.count('satellites', len(obs.sv))
+
+                    results = self._cycle_slip_analysis(hdr, obs, entry['year'], entry['month'], entry['doy'])
+                    metrics.count('slips', np.count_nonzero(results['slips']))
+
+                    outputs = []
+                    with metrics.timer('output'):
+                        if self.output_folder is not None:
+                            outputs.append(self._save_rinex(entry, hdr, obs, results))
+                        if self.store_folder is not None:
+                            store.StationStore(self.store_folder, entry['station']).append(obs.time, obs.sv, results)
+
+                stop = time.perf_counter()
+                logging.info(">> File " + file + " checked! Time: %.4f minutes" % float((stop - start) / 60))
+            except Exception as error:
+                logging.exception(">> File " + file + " failed!")
+                result.update({'status': 'failed', 'error': str(error) or error.__class__.__name__})
+
+        result['seconds'] = time.perf_counter() - start
+        result['metrics'] = file_metrics.as_dict()
+
+        if self.checkpoint is not None and result['status'] == 'ok':
+            self.checkpoint.finish(entry, result, outputs)
+        self._prns = None
+        return result
+
+    def _output_path(self, entry):
+        """
+        :param entry: The manifest entry of the rinex
+        :return: Absolute path to the corrected rinex, in the output folder (created if it does not exist)
+        """
+        os.makedirs(self.output_folder, exist_ok=True)
+        output = os.path.join(self.output_folder, rinex.RinexObsWriter.output_name(entry['file']))
+        if os.path.abspath(output) == os.path.abspath(entry['path']):
+            raise ValueError("The output folder can not be the rinex folder")
+
+        return output
+
+    def _save_rinex(self, entry, hdr, obs, results, temporary=None):
+        """
+        Save the corrected rinex in the output folder, with the same name (as a plain rinex, see rinex.RinexObsWriter).
+        Only the L1 and L2 measures which changed are written over the copy of the original rinex
+
+        :param entry: The manifest entry of the rinex
+        :param hdr: Header of the rinex
+        :param obs: Measures of the rinex
+        :param results: The results of the rinex (see _detect_and_correct_arcs)
+        :param temporary: The corrected rinex being written by satellites groups (see _check_groups and
+            rinex.RinexObsWriter.replacing), None to write the whole corrected rinex at once
+        :return: Absolute path to the corrected rinex
+        """
+        corrected = Utils.subtract_cycles(obs, settings.COLUMNS_IN_RINEX[str(hdr.get('version'))], obs.sv,
+                                          results['cycles_1'], results['cycles_2'])
+        values = {code: np.where(corrected[code] != obs[code], corrected[code], np.nan) for code in corrected.data
+                  if corrected[code] is not obs[code]}
+
+        output = self._output_path(entry)
+        writer = rinex.RinexObsWriter(entry['path'])
+        if temporary is None:
+            writer.write(output, corrected.sv, values)
+        else:
+            writer.patch(temporary, corrected.sv, values)
+        return output
+
+    def _check_groups(self, entry, reader, hdr, columns):
+        """
+        Check a rinex by groups of satellites, within the memory budget (settings.MEMORY_BUDGET_MB): the rinex is
+        decoded once to disk (see rinex.RinexObsReader.spill), then only the measures of a group are read back at once,
+        checked and written before the next group: to the corrected rinex, and to disk for the store, which is
+        appended once after the last group (see store.SpilledResults). The arcs never join different satellites, then
+        the results are the same of checking the whole rinex at once, however many satellites it has. A group has at
+        least one satellite, with all its epochs: a satellite over the budget (e.g. a long multi-day rinex) exceeds
+        it. Only the quicklook of each group is kept meanwhile
+
+        :param entry: The manifest entry of the rinex
+        :param reader: The rinex.RinexObsReader of the rinex
+        :param hdr: Header of the rinex
+        :param columns: The observable codes to decode (see Utils.which_cols_to_load)
+        :return: List with the absolute paths to the files written (the corrected rinex, if so)
+        """
+        with metrics.timer('load'):
+            epochs, sv = reader.scan(settings.CONSTELLATIONS)
+        groups = Utils.satellite_groups(sv, epochs, len(columns), settings.MEMORY_BUDGET_MB)
+        metrics.count('epochs', epochs)
+        metrics.count('satellites', len(sv))
+        metrics.count('groups', len(groups))
+        logging.info(">>>> {} epochs and {} satellites, checked in {} group(s) (memory budget {} MB)".format(
+            epochs, len(sv), len(groups), settings.MEMORY_BUDGET_MB))
+
+        outputs, prns, parts = [], [], []
+        with contextlib.ExitStack() as stack:
+            spilled, collected = None, None
+            if len(groups) > 1:
+                with metrics.timer('load'):
+                    folder = stack.enter_context(tempfile.TemporaryDirectory(prefix='cycle_slip_',
+                                                                             dir=settings.SPILL_FOLDER))
+                    spilled = reader.spill(columns, settings.CONSTELLATIONS, sv, epochs, folder)
+                if self.store_folder is not None:
+                    collected = stack.enter_context(store.SpilledResults(folder, len(spilled.time), spilled.sv))
+
+            temporary = None
+            if self.output_folder is not None:
+                with metrics.timer('output'):
+                    outputs = [self._output_path(entry)]
+                    temporary = stack.enter_context(rinex.RinexObsWriter(entry['path']).replacing(outputs[0]))
+
+            for i, group in enumerate(groups):
+                with metrics.timer('load'):
+                    obs = spilled.observations(group) if spilled is not None else \
+                        reader.read(columns, settings.CONSTELLATIONS, group)
+
+                results = self._cycle_slip_analysis(hdr, obs, entry['year'], entry['month'], entry['doy'],
+                                                    quicklook=False)
+                metrics.count('slips', np.count_nonzero(results['slips']))
+                if self.plots.wants_quicklook() and len(obs.time):
+                    with metrics.timer('plots'):
+                        prns.extend(obs.sv)
+                        parts.append(self._quicklook_part(obs.time, results))
+
+                with metrics.timer('output'):
+                    if temporary is not None:
+                        self._save_rinex(entry, hdr, obs, results, temporary)
+                    if collected is not None:
+                        collected.write(obs.sv, results)
+                    elif self.store_folder is not None:
+                        store.StationStore(self.store_folder, entry['station']).append(obs.time, obs.sv, results)
+
+                logging.info(">>>> Group {}/{} ({} satellites) checked, process peak memory {:.1f} MB".format(
+                    i + 1, len(groups), len(obs.sv), metrics.peak_rss()))
+                del obs, results
+
+            if collected is not None:
+                with metrics.timer('output'):
+                    store.StationStore(self.store_folder, entry['station']).append(spilled.time, spilled.sv,
+                                                                                  collected)
+
+        if parts:
+            with metrics.timer('plots'):
+                self._plot_quicklook(np.asarray(prns), parts)
+
+        return outputs
+
+    def _process_parallel(self, entries):
+        """
+        Distribute the files to a pool of processes. Each process sends back the log records of a file together with
+        its result, and they are emitted here in the order of the files, as soon as all the files before are done.
+        If a process dies (e.g. killed by the system), the pool is broken: the files lost with it are checked again,
+        one by one, so only the file that takes its process down is reported as failed
+
+        :param entries: The manifest entries of the files
+        :return: List with the result of each file (see process_file)
+        """
+        outcomes = [None] * len(entries)
+        emitted = 0
+        level = logging.getLogger().getEffectiveLevel()
+
+        def emit():
+            nonlocal emitted
+            while emitted < len(outcomes) and outcomes[emitted] is not None:
+                for record in outcomes[emitted][1]:
+                    logging.getLogger(record.name).handle(record)
+                emitted += 1
+
+        broken = []
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(_process_entry, self.folder, entry, level, self.output_folder,
+                                       self.store_folder, self.checkpoint_folder) for entry in entries]
+            for i, future in enumerate(futures):
+                try:
+                    outcomes[i] = future.result()
+                except BrokenProcessPool:
+                    broken.append(i)
+                emit()
+
+        for i in broken:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                try:
+                    outcomes[i] = executor.submit(_process_entry, self.folder, entries[i], level,
+                                                  self.output_folder, self.store_folder,
+                                                  self.checkpoint_folder).result()
+                except BrokenProcessPool:
+                    error = "The process checking the file died unexpectedly"
+                    logging.error(">> File " + entries[i]['file'] + " failed! " + error)
+                    outcomes[i] = ({'file': entries[i]['file'], 'status': 'failed', 'error': error, 'seconds': None},
+                                   [])
+            emit()
+
+        return [result for result, _ in outcomes]
+
+    def check(self, entries):
+        """
+        Check a set of rinex files, in parallel when there are many workers, waiting for their plots. With a
+        checkpoint, the files already finished (see checkpoint.Checkpoint.finished) are not checked again
+
+        :param entries: The manifest entries of the files (see manifest.Manifest)
+        :return: List with the result of each file (see process_file), in the order of the entries
+        """
+        results = [None] * len(entries)
+        if self.checkpoint is not None:
+            for i, entry in enumerate(entries):
+                resumed = self.checkpoint.finished(entry)
+                if resumed is not None:
+                    results[i] = dict(resumed, resumed=True)
+            if any(results):
+                logging.info(">> {} file(s) resumed from the checkpoint {}".format(
+                    sum(result is not None for result in results), self.checkpoint.folder))
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        if self.workers > 1 and len(pending) > 1:
+            logging.info(">> Checking {} files with {} processes".format(len(pending), self.workers))
+            checked = self._process_parallel([entries[i] for i in pending])
+        else:
+            checked = [self.process_file(entries[i]) for i in pending]
+        self.plots.close()
+
+        for i, result in zip(pending, checked):
+            results[i] = result
+
+        return results
+
+    def initialize(self, report=None):
         """
         Initialize the process
-        :return:
+        :param report: Absolute path to the run report (JSON, with a CSV next to it, see metrics.save_report), None
+            to not save it
+        :return: List with the result of each file (see process_file)
         """
-        files = sorted(os.listdir(self.folder))
-        logging.info(">> Found " + str(len(files)) + " file(s)")
+        manifest = mf.Manifest.prescan(self.folder)
+        entries = manifest.valid
+        logging.info(">> " + str(manifest))
         start_general = time.perf_counter()
 
-        for file in files:
-            start = time.perf_counter()
+        results = self.check(entries)
 
-            complete_path = os.path.join(self.folder, file)
+        stop_general = time.perf_counter()
+        failed = [result['file'] for result in results if result['status'] != 'ok']
+        logging.info(">> Processing done for " + str(len(results)) + " files in %.4f minutes (%.1f files/hour)"
+                     % (float((stop_general - start_general) / 60),
+                        len(results) / max(stop_general - start_general, 1e-9) * 3600))
+        if failed:
+            logging.warning(">> {} file(s) failed: {}".format(len(failed), ", ".join(failed)))
+        if report is not None:
+            metrics.save_report(report, results, stop_general - start_general)
 
-            logging.info(">>>> Reading rinex: " + file)
-            hdr = gr.rinexheader(complete_path)
+        return results
 
-            version = hdr.get('version')
-            columns_to_be_load = Utils.which_cols_to_load()
 
-            if version >= settings.REQUIRED_VERSION:
-                obs = gr.load(complete_path, meas=columns_to_be_load, use=settings.CONSTELLATIONS)
+class _LogCapture(logging.Handler):
+    """
+    Keep the log records of a worker process, ready to be sent (pickled) back to the main process
+    """
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
 
-                year, month, doy = Utils.setup_rinex_name(file)
-                obs = self._cycle_slip_analysis(hdr, obs, year, month, doy)
-            else:
-                logging.info(">>>>>> Rinex version {}. This code comprises the 3.01+ rinex version.".format(version))
-                continue
 
-            stop = time.process_time()
-            logging.info(">> File " + file + " checked! Time: %.4f minutes" % float((start - stop) / 60))
+@contextlib.contextmanager
+def _captured_logs(level):
+    """
+    Send the log records of a worker process to a _LogCapture, instead of the handlers of the main process
+
+    :param level: The log level of the main process
+    :return: Context manager giving the _LogCapture
+    """
+    capture = _LogCapture()
+    root = logging.getLogger()
+    handlers = root.handlers
+    root.handlers = [capture]
+    root.setLevel(level)
+
+    try:
+        yield capture
+    finally:
+        root.handlers = handlers
+
+
+def _process_entry(folder, entry, level, output_folder=None, store_folder=None, checkpoint_folder=None):
+    """
+    Check a single rinex in a worker process (see CycleSlip._process_parallel). The processes already take all the
+    CPUs, then the arcs are corrected with no extra threads, nor processes
+
+    :param folder: The rinex folder
+    :param entry: The manifest entry of the rinex
+    :param level: The log level of the main process
+    :param output_folder: Folder where the corrected rinex is saved (None to not save it)
+    :param store_folder: Folder where the results are appended (None to not save them)
+    :param checkpoint_folder: Folder where the finished file and PRNs are recorded (None to not record them)
+    :return: The result of the file (see CycleSlip.process_file) and its log records
+    """
+    settings.ARC_WORKERS = 1
+    settings.PRN_WORKERS = 1
+    settings.PLOT_WORKERS = 0
+
+    with _captured_logs(level) as capture:
+        result = CycleSlip(folder, workers=1, output_folder=output_folder, store_folder=store_folder,
+                           checkpoint_folder=checkpoint_folder).process_file(entry)
+
+    return result, capture.records
+
 
-        stop_general = time.process_time()
-        logging.info(">> Processing done for " + str(len(files)) + " files in %.4f minutes"
-                     % float((stop_general - start_general) / 60))
+_shared = {}
+
+
+def _attach_shared(spec):
+    """
+    Initializer of the worker processes of CycleSlip._cycle_slip_analysis_shared: attach (once per process) to the
+    matrices in shared memory
+
+    :param spec: The shared.SharedArrays.spec of the main process
+    :return: None
+    """
+    settings.ARC_WORKERS = 1
+    settings.PLOT_WORKERS = 0
+    _shared['arrays'] = shared.SharedArrays.attach(spec)
+
+    return None
+
+
+def _check_prn(folder, k, prn, frequencies, level, plot_folder):
+    """
+    Check a single PRN in a worker process, over the matrices in shared memory (see _attach_shared). The results
+    of the PRN (see RESULTS) are written in the column k of the shared matrices of the same names
+
+    :param folder: The rinex folder
+    :param k: The column of the PRN in the matrices
+    :param prn: The respective PRN
+    :param frequencies: F1, F2, factor_1 and factor_2 of the PRN
+    :param level: The log level of the main process
+    :param plot_folder: The folder of the plots of the rinex, inside the plots folder
+    :return: The log records and the metrics (see metrics.Metrics.as_dict) of the PRN
+    """
+    arrays = _shared['arrays']
+    cycle_slip = CycleSlip(folder, workers=1)
+    cycle_slip._plot_folder = plot_folder
+
+    with _captured_logs(level) as capture, metrics.collect() as prn_metrics:
+        results = cycle_slip._detect_and_correct_cycle_slip(
+            arrays['time'], arrays['l1'][:, k], arrays['l2'][:, k], arrays['c1'][:, k], arrays['p2'][:, k],
+            *frequencies, prn)
+        for name in RESULTS:
+            arrays[name][:, k] = results[name]
+
+    return capture.records, prn_metrics.as_dict()
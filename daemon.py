@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+import settings as settings
+
+
+def submit(file, path=settings.DAEMON_SOCKET, output_folder=None, store_folder=None, timeout=None):
+    """
+    Thin client: send a rinex to the daemon (see serve) and wait for its result. Only the standard library is loaded
+
+    :param file: Absolute path to the rinex
+    :param path: The socket of the daemon
+    :param output_folder: Folder where the corrected rinex is saved (None to not save it)
+    :param store_folder: Folder where the results are appended (None to not save them)
+    :param timeout: Seconds to wait for the result (None to wait for as long as it takes)
+    :return: The result of the file (see CycleSlip.process_file)
+    """
+    def absolute(folder):
+        return os.path.abspath(folder) if folder is not None else None
+
+    return _request(path, {'file': os.path.abspath(file), 'output_folder': absolute(output_folder),
+                           'store_folder': absolute(store_folder)}, timeout)
+
+
+def status(path=settings.DAEMON_SOCKET, timeout=10):
+    """
+    :param path: The socket of the daemon
+    :param timeout: Seconds to wait for the answer
+    :return: Python dict with the pid of the daemon, its number of workers and the jobs done, failed and running
+    """
+    return _request(path, {'command': 'status'}, timeout)
+
+
+def _request(path, request, timeout):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(path)
+        client.sendall(json.dumps(request).encode() + b'\n')
+
+        with client.makefile('rb') as fd:
+            answer = fd.readline()
+
+    if not answer:
+        raise ConnectionError("No answer from the daemon at {}".format(path))
+
+    return json.loads(answer.decode())
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode())
+            if request.get('command') == 'status':
+                answer = self.server.status()
+            else:
+                answer = self.server.check(request['file'], request.get('output_folder'),
+                                           request.get('store_folder'))
+        except (ValueError, KeyError, TypeError) as error:
+            answer = {'status': 'failed', 'error': "Bad request: {}".format(error)}
+
+        self.wfile.write(json.dumps(answer, default=str).encode() + b'\n')
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Long-running checker of rinex files, sent one by one over a local UNIX socket (see submit). The modules are
+    imported once, and the files are checked by a pool of worker processes kept alive between the requests, each one
+    keeping its caches warm (GLONASS factors, compiled correction loop, decoded observations). Each connection is
+    served by its own thread, and at most 'workers' files are checked at once: the other requests wait for a worker
+    """
+    daemon_threads = True
+
+    def __init__(self, path=settings.DAEMON_SOCKET, workers=settings.DAEMON_WORKERS):
+        """
+        :param path: The socket (a stale one, left by a daemon that died, is replaced)
+        :param workers: Number of files checked at once
+        """
+        # loaded once, before the worker processes are forked
+        import cycle_slip  # noqa: F401
+        import manifest as mf
+
+        self._mf = mf
+        self.workers = workers or os.cpu_count() or 1
+        self.done = 0
+        self.failed = 0
+        self.running = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(path):
+            try:
+                status(path, timeout=1)
+                raise RuntimeError("A daemon is already listening at {}".format(path))
+            except (ConnectionError, OSError):
+                os.remove(path)
+
+        super().__init__(path, _Handler)
+
+    def _pool(self):
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_up)
+            return self._executor
+
+    def check(self, file, output_folder=None, store_folder=None):
+        """
+        Check a rinex in a worker process, emitting its log records here
+
+        :param file: Absolute path to the rinex
+        :param output_folder: Folder where the corrected rinex is saved (None to not save it)
+        :param store_folder: Folder where the results are appended (None to not save them)
+        :return: The result of the file (see CycleSlip.process_file)
+        """
+        from concurrent.futures.process import BrokenProcessPool
+
+        folder, name = os.path.split(os.path.abspath(file))
+        entry = self._mf.Manifest.scan(folder, name)
+        if entry['status'] != self._mf.Manifest.STATUS_OK:
+            logging.warning(">> Skipping {} ({}): {}".format(name, entry['status'], entry['error']))
+            return {'file': name, 'status': 'failed', 'error': entry['error'], 'seconds': None}
+
+        with self._lock:
+            self.running += 1
+        executor = self._pool()
+        try:
+            result, records = executor.submit(_check, folder, entry, logging.getLogger().getEffectiveLevel(),
+                                              output_folder, store_folder).result()
+            for record in records:
+                logging.getLogger(record.name).handle(record)
+        except BrokenProcessPool:
+            logging.error(">> The worker checking {} died, restarting the workers".format(name))
+            result = {'file': name, 'status': 'failed', 'error': "The worker process died", 'seconds': None}
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+
+        with self._lock:
+            self.running -= 1
+            self.done += 1
+            self.failed += result['status'] != 'ok'
+
+        return result
+
+    def status(self):
+        with self._lock:
+            return {'pid': os.getpid(), 'workers': self.workers, 'done': self.done, 'failed': self.failed,
+                    'running': self.running}
+
+    def server_close(self):
+        super().server_close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def _warm_up():
+    """
+    Initializer of the worker processes: load the modules and compile the correction loop before the first file
+
+    :return: None
+    """
+    import cycle_slip
+    import kernel
+    import numpy as np
+
+    n = 16
+    kernel.detect_and_correct(np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n, dtype=bool),
+                              np.zeros(n, dtype=bool), settings.F1, settings.F2, settings.factor_1, settings.factor_2,
+                              settings.C, settings.DIFF_TEC_MAX)
+    logging.debug(">> Worker {} ready ({})".format(os.getpid(), cycle_slip.__name__))
+
+    return None
+
+
+def _check(folder, entry, level, output_folder, store_folder):
+    """
+    Check a rinex in a worker process, waiting for its plots (the process outlives the request)
+
+    :return: The result of the file (see CycleSlip.process_file) and its log records
+    """
+    import cycle_slip as cs
+    import plots
+
+    try:
+        return cs._process_entry(folder, entry, level, output_folder, store_folder)
+    finally:
+        plots.renderer().close()
+
+
+def serve(path=settings.DAEMON_SOCKET, workers=settings.DAEMON_WORKERS):
+    """
+    Run the daemon until it is interrupted (SIGINT/SIGTERM)
+
+    :param path: The socket
+    :param workers: Number of files checked at once
+    :return: None
+    """
+    import signal
+
+    with Daemon(path, workers) as daemon:
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=daemon.shutdown).start())
+        logging.info(">> Daemon {} listening at {} ({} workers)".format(os.getpid(), path, daemon.workers))
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    logging.info(">> Daemon stopped: {done} file(s) checked, {failed} failed".format(**daemon.status()))
+    return None
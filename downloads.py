@@ -1,12 +1,14 @@
 import logging
 import os
-import sys
 
 from xml.etree.ElementTree import fromstring
 from pathlib import Path
 from urllib.error import HTTPError, URLError
 from urllib.request import urlopen
 
+import compression
+import settings as settings
+
 
 class DownloadGeneric:
     """
@@ -100,17 +102,24 @@ class DownloadGeneric:
         except HTTPError as error:
             error.close()
             logging.error(msg_error, self.name, error, self.url)
-            sys.exit(1)
+            self._remove_partial_file()
+            raise ValueError("{} not retrieved: {}".format(self.name, error)) from error
         except URLError as e:
             logging.error(msg_error, self.name, e, self.url)
-            sys.exit(1)
+            self._remove_partial_file()
+            raise ValueError("{} not retrieved: {}".format(self.name, e)) from e
         else:
             logging.info(">>>> File download " + self.filename + " done!")
         return self
 
+    def _remove_partial_file(self):
+        if os.path.exists(self.absolute_path):
+            os.remove(self.absolute_path)
+        return self
+
     def _unzip_file(self):
         logging.info(">> Uncompressing file " + self.absolute_path)
-        os.system("uncompress -k " + self.absolute_path)
+        compression.decompress(self.absolute_path, self.file_uncompressed)
         logging.info(">>>> Uncompressing done!")
         self._delete_zipped_file()
         return self
@@ -131,7 +140,7 @@ class DownloadGlonassChannel(DownloadGeneric):
     """
     _api = 'https://www.glonass-iac.ru/en/CUSGLONASS/'
     _file = "getCUSMessage.php"
-    _root_path = '/home/lotte/embrace/tec/glonasschannel/'
+    _root_path = os.path.join(settings.GLONASS_CHANNELS_FOLDER, '')
     EPOCH = 3657
 
     def __init__(self, year, day, month):
@@ -178,7 +187,8 @@ class DownloadGlonassChannel(DownloadGeneric):
                     self._unzip_file()
         except (HTTPError, URLError) as error:  # pragma: no cover
             logging.error('>>>> %s Data not retrieved because %s - URL: %s', self.name, error, self.url)
-            sys.exit(1)
+            self._remove_partial_file()
+            raise ValueError("{} not retrieved: {}".format(self.name, error)) from error
         else:
             logging.info(">>>> File download " + self.filename + " done!")
         return self
@@ -0,0 +1,337 @@
+import collections
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+
+import compression
+import parser as pr
+import rinex
+import settings as settings
+
+
+class GlonassFactors:
+    """
+    The GLONASS frequencies and factors (f1, f2, factor_1, factor_2) of each slot, kept as a (4 x slots) matrix
+    indexed by the slot number, then taken for many PRNs at once (see GlonassFactors.take)
+    """
+    def __init__(self, parsed):
+        """
+        :param parsed: Python dict with the slot (e.g. '01') as key and [f1, f2, factor_1, factor_2] as value (see
+            parser.ParserChannels)
+        """
+        size = max((int(slot) for slot in parsed), default=0) + 1
+        self.values = np.full((4, size), np.nan)
+        for slot, values in parsed.items():
+            self.values[:, int(slot)] = values
+
+    def __contains__(self, slot):
+        slot = int(slot)
+        return 0 <= slot < self.values.shape[1] and not np.isnan(self.values[0, slot])
+
+    def __getitem__(self, slot):
+        """
+        :param slot: The slot (e.g. '01'), as in the PRN 'R01'
+        :return: List [f1, f2, factor_1, factor_2] of the slot
+        """
+        if slot not in self:
+            raise KeyError(slot)
+
+        return self.values[:, int(slot)].tolist()
+
+    def take(self, prns):
+        """
+        :param prns: Array with GLONASS satellites names (e.g. 'R01')
+        :return: Matrix (4 x len(prns)) with f1, f2, factor_1 and factor_2 of each PRN, NaN for unknown slots
+        """
+        slots = np.array([int(prn[1:]) for prn in prns], dtype=np.int64)
+        known = slots < self.values.shape[1]
+
+        values = np.full((4, len(slots)), np.nan)
+        values[:, known] = self.values[:, slots[known]]
+
+        return values
+
+
+class FactorCache:
+    """
+    GLONASS factors already computed in the run, kept by the 'GLONASS SLOT / FRQ #' header record they were parsed
+    from or, when the header lacks it, by the date of the rinex. Then the channels are parsed once per file (or once
+    per day, for all the stations with no header record), instead of once per GLONASS PRN
+    """
+    def __init__(self, max_size=settings.GLONASS_FACTORS_CACHE_SIZE):
+        """
+        :param max_size: Maximum number of entries, before evicting the least recently used
+        """
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(hdr, year, month, day):
+        """
+        :param hdr: The rinex header
+        :param year: Year of the rinex
+        :param month: Month of the rinex
+        :param day: Day of the rinex
+        :return: The cache key
+        """
+        if "GLONASS SLOT / FRQ #" in hdr:
+            return 'header', hdr["GLONASS SLOT / FRQ #"]
+
+        return 'date', str(year), str(month), str(day)
+
+    def get(self, key, compute):
+        """
+        :param key: The cache key (see FactorCache.key)
+        :param compute: Function with no arguments returning the GlonassFactors, called only if key is not cached
+        :return: The GlonassFactors object
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        factors = compute()
+        logging.debug(">>>> GLONASS factors cached for {} slots ({})".format(int((~np.isnan(factors.values[0])).sum()),
+                                                                            key[0]))
+
+        with self._lock:
+            self._entries[key] = factors
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return factors
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+factors = FactorCache()
+
+
+class ChannelStore:
+    """
+    Offline store of the GLONASS slot -> frequency channel assignments along the time, built from historical channel
+    files (https://www.glonass-iac.ru/en/CUSGLONASS/getCUSMessage.php) and rinex 'GLONASS SLOT / FRQ #' records.
+    Only the changes of channel are kept, as three arrays sorted by slot and day (saved as .npz):
+        slot:    [ 1,  1,  2, ...]
+        day:     [d0, d5, d0, ...] (days since 1970-01-01, from when the channel is valid)
+        channel: [ 1, -4, -4, ...]
+    The channel of a slot at a date is the last change up to that date, found by a binary search (O(log n)) in the
+    changes of the slot
+    """
+    _date = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})')
+    _rinex = re.compile(r'(\.rnx|\.crx|\.\d\d[oOdD])$', re.IGNORECASE)
+
+    def __init__(self, file=settings.GLONASS_CHANNELS_DB):
+        """
+        :param file: Absolute path to the store (.npz), loaded if it exists
+        """
+        self.file = file
+        self.slot = np.array([], dtype=np.int16)
+        self.day = np.array([], dtype=np.int32)
+        self.channel = np.array([], dtype=np.int8)
+
+        if os.path.exists(file):
+            with np.load(file) as data:
+                self.slot, self.day, self.channel = data['slot'], data['day'], data['channel']
+
+        self._pending = []
+        self._index()
+
+    def _index(self):
+        """
+        Compute where the changes of each slot begin in the arrays
+
+        :return: None
+        """
+        self._offsets = np.searchsorted(self.slot, np.arange(self.slot.max(initial=0) + 2))
+        return None
+
+    def __len__(self):
+        self._merge()
+        return len(self.slot)
+
+    @staticmethod
+    def _days(date):
+        return int(np.datetime64(date, 'D').astype(np.int64))
+
+    def add(self, date, channels):
+        """
+        Add the channels of the slots at a date. A channel at the same slot and date of an existing one replaces it.
+        The records are merged into the store (see ChannelStore._merge) only when it is queried or saved, then a bulk
+        import is sorted once
+
+        :param date: The date (e.g. '2018-06-01' or datetime64)
+        :param channels: Python dict with the slot (e.g. '01') as key and the channel as value
+        :return: None
+        """
+        day = self._days(date)
+        self._pending.extend((int(slot), day, int(channel)) for slot, channel in channels.items())
+        return None
+
+    def _merge(self):
+        """
+        Merge the records added into the arrays, sorted by slot and day, keeping only the changes of channel
+
+        :return: None
+        """
+        if not self._pending:
+            return None
+
+        pending = np.array(self._pending, dtype=np.int64).reshape(-1, 3)
+        slot = np.concatenate((self.slot, pending[:, 0])).astype(np.int16)
+        days = np.concatenate((self.day, pending[:, 1])).astype(np.int32)
+        channel = np.concatenate((self.channel, pending[:, 2])).astype(np.int8)
+        self._pending = []
+
+        # sorted by slot and day, with the records added later after the older ones of the same slot and day
+        order = np.lexsort((np.arange(len(slot)), days, slot))
+        slot, days, channel = slot[order], days[order], channel[order]
+
+        last = np.ones(len(slot), dtype=bool)
+        last[:-1] = (slot[1:] != slot[:-1]) | (days[1:] != days[:-1])
+        slot, days, channel = slot[last], days[last], channel[last]
+
+        change = np.ones(len(slot), dtype=bool)
+        change[1:] = (slot[1:] != slot[:-1]) | (channel[1:] != channel[:-1])
+        self.slot, self.day, self.channel = slot[change], days[change], channel[change]
+
+        self._index()
+        return None
+
+    def channel_at(self, slot, date):
+        """
+        :param slot: The slot (e.g. '01' or 1)
+        :param date: The date (e.g. '2018-06-01' or datetime64)
+        :return: The channel of the slot at the date, or None if the store has no channel of the slot up to the date
+        """
+        self._merge()
+        slot = int(slot)
+        if slot < 0 or slot + 1 >= len(self._offsets):
+            return None
+
+        start, end = self._offsets[slot], self._offsets[slot + 1]
+        position = start + np.searchsorted(self.day[start:end], self._days(date), side='right') - 1
+
+        return int(self.channel[position]) if position >= start else None
+
+    def channels(self, date):
+        """
+        :param date: The date (e.g. '2018-06-01' or datetime64)
+        :return: Python dict with the slot (e.g. '01') as key and its channel at the date as value
+        """
+        self._merge()
+        channels = {}
+        for slot in np.unique(self.slot):
+            channel = self.channel_at(slot, date)
+            if channel is not None:
+                channels['%02d' % slot] = channel
+
+        return channels
+
+    def factors(self, date):
+        """
+        :param date: The date (e.g. '2018-06-01' or datetime64)
+        :return: Python dict with the slot as key and [f1, f2, factor_1, factor_2] as value (see parser.ParserChannels)
+        """
+        return {slot: pr.ParserChannels.frequencies(channel) for slot, channel in self.channels(date).items()}
+
+    def import_channel_file(self, file, date=None):
+        """
+        :param file: Absolute path to a channel file (getCUSMessage.php content)
+        :param date: The date of the file, by default taken from its name (e.g. channel-20180601.txt)
+        :return: The number of slots imported
+        """
+        if date is None:
+            match = self._date.search(os.path.basename(file))
+            if not match:
+                raise ValueError("No date (yyyymmdd) in the channel file name {}".format(file))
+            date = '-'.join(match.groups())
+
+        with open(file, mode='r', errors='replace') as fd:
+            channels = pr.ParserChannels.channels(fd.read())
+
+        self.add(date, channels)
+        return len(channels)
+
+    def import_rinex(self, file):
+        """
+        :param file: Absolute path to a rinex file, with the 'GLONASS SLOT / FRQ #' and 'TIME OF FIRST OBS' records
+        :return: The number of slots imported
+        """
+        hdr = rinex.RinexObsReader(file).header
+        if "GLONASS SLOT / FRQ #" not in hdr or "TIME OF FIRST OBS" not in hdr:
+            return 0
+
+        year, month, day = (int(value) for value in hdr["TIME OF FIRST OBS"].split()[:3])
+        channels = pr.ParserRinexChannels.channels(hdr["GLONASS SLOT / FRQ #"])
+
+        self.add('{:04d}-{:02d}-{:02d}'.format(year, month, day), channels)
+        return len(channels)
+
+    def import_path(self, path):
+        """
+        Bulk import of a channel file, a rinex file, or all of them inside a folder (recursively). Files that can not
+        be imported are logged and skipped
+
+        :param path: Absolute path to the file or folder
+        :return: The number of files imported
+        """
+        files = [path] if os.path.isfile(path) else sorted(os.path.join(root, file) for root, _, names in
+                                                           os.walk(path) for file in names)
+        imported = 0
+
+        for file in files:
+            try:
+                if self._rinex.search(compression.strip_compression(file)):
+                    imported += self.import_rinex(file) > 0
+                else:
+                    imported += self.import_channel_file(file) > 0
+            except (OSError, ValueError, KeyError, IndexError, RuntimeError) as error:
+                logging.warning(">>>> Skipping {}: {}".format(file, error))
+
+        return imported
+
+    def save(self):
+        """
+        Save the store (atomically)
+
+        :return: None
+        """
+        self._merge()
+        os.makedirs(os.path.dirname(self.file) or '.', exist_ok=True)
+        temporary = self.file + '.tmp-%d' % os.getpid()
+
+        with open(temporary, mode='wb') as fd:
+            np.savez_compressed(fd, slot=self.slot, day=self.day, channel=self.channel)
+        os.replace(temporary, self.file)
+
+        return None
+
+    def __str__(self):
+        if len(self) == 0:
+            return "GLONASS channel store {}: empty".format(self.file)
+
+        first, last = (np.datetime64(int(day), 'D') for day in (self.day.min(), self.day.max()))
+        return "GLONASS channel store {}: {} slots, {} channel changes, from {} to {}".format(
+            self.file, len(np.unique(self.slot)), len(self), first, last)
+
+
+_store = {}
+_store_lock = threading.Lock()
+
+
+def channel_store():
+    """
+    :return: The ChannelStore of settings.GLONASS_CHANNELS_DB, loaded once
+    """
+    with _store_lock:
+        if 'store' not in _store:
+            _store['store'] = ChannelStore()
+
+    return _store['store']
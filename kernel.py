@@ -0,0 +1,259 @@
+import importlib.util
+import logging
+import math
+import types
+
+import numpy as np
+
+import settings as settings
+
+BACKENDS = ('auto', 'python', 'numba')
+
+
+def _shifted(value, offsets, count, total, low, high):
+    """
+    The value after all corrections applied so far, i.e. the same float as subtracting, one by one, every offset from
+    the value (as the tail updates used to do). When no partial result may leave the binade of the value, all those
+    subtractions are exact and a single subtraction of the accumulated offset gives the same float; otherwise (rare)
+    the offsets are subtracted one by one
+
+    :param value: The raw measure (L1 or L2)
+    :param offsets: Array with the offsets (cycles) of each correction, in order
+    :param count: Number of corrections applied so far
+    :param total: The accumulated offset (exact, offsets are integers)
+    :param low: The lowest partial sum of offsets so far (including 0)
+    :param high: The highest partial sum of offsets so far (including 0)
+    :return: The corrected measure
+    """
+    _, exponent = math.frexp(value)
+    if abs(value) + max(abs(low), abs(high)) < math.ldexp(1.0, exponent):
+        return value - total
+
+    for k in range(count):
+        value = value - offsets[k]
+
+    return value
+
+
+def _correct(i, l1_i, l2_i, c1, p2, rtec, mwlc, f1, f2, factor_1, factor_2, c):
+    """
+    Compensate the irregularity at the index i of L1 and L2, updating rtec[i] and mwlc[i]
+
+    :return: The corrected L1 and L2 at i, and the offsets (cycles) subtracted from L1 and L2
+    """
+    diff_rtec = rtec[i] - rtec[i - 1]
+    diff_mwlc = mwlc[i] - mwlc[i - 1]
+
+    var_1 = diff_mwlc * c
+    var_2 = var_1 / f1
+    diff_2 = np.rint((diff_rtec - var_2) * factor_2)
+    diff_1 = diff_2 + np.rint(diff_mwlc)
+
+    cor_r_1 = l1_i - diff_1
+    cor_r_2 = l2_i - diff_2
+
+    rtec[i] = ((cor_r_1 / f1) - (cor_r_2 / f2)) * c
+    mwlc[i] = (cor_r_1 - cor_r_2) - (f1 * c1[i] + f2 * p2[i]) * factor_1
+
+    return cor_r_1, cor_r_2, diff_1, diff_2
+
+
+def _accumulate(offsets, count, total, low, high, offset):
+    """
+    Store a new offset, updating the accumulated offset and its lowest/highest partial sums
+
+    :return: The accumulated offset, the lowest and the highest partial sums
+    """
+    offsets[count] = offset
+    total = total + offset
+    return total, min(low, total), max(high, total)
+
+
+def detect_and_correct(l1, l2, c1, p2, new_arc, peaks, f1, f2, factor_1, factor_2, c, diff_tec_max, backend=None,
+                       rtec=None, mwlc=None):
+    """
+    Sequential cycle-slip correction over the valid (not NaN) measures of a PRN. Each correction changes the
+    statistics the later epochs are tested against, then this loop runs epoch by epoch, but:
+        - corrections are kept as a running cycle offset, applied to each epoch once, when the loop reaches it
+            (instead of subtracting it from the whole L1/L2 tail, at every correction)
+        - the squared rTEC differences of the 10-samples window are computed once per epoch and kept
+    The float operations (and their order) are the same of the original per-epoch loop, then the results are
+    bit-identical to it. That is also why the window mean is still summed over its 9 terms: a running
+    (add/subtract) sum would round differently
+
+    :param l1: L1 measures (no NaN values)
+    :param l2: L2 measures (no NaN values)
+    :param c1: C1 measures (aligned with l1)
+    :param p2: P2 measures (aligned with l1)
+    :param new_arc: Boolean array, True where a new arc starts (after a data hole)
+    :param peaks: Boolean array, True where the 4th order differences detected a discontinuity
+    :param f1: F1 frequency (either GPS or GLONASS)
+    :param f2: F2 frequency (either GPS or GLONASS)
+    :param factor_1: first factor of calculus (either GPS or GLONASS)
+    :param factor_2: second factor of calculus (either GPS or GLONASS)
+    :param c: Speed of light
+    :param diff_tec_max: The minimum deviation of the rTEC differences (see settings.DIFF_TEC_MAX)
+    :param backend: The loop backend (see select_backend), settings.KERNEL_BACKEND by default
+    :param rtec: The relative TEC of the measures, when already computed (it is not changed)
+    :param mwlc: The Melbourne-Wubbena combination of the measures, when already computed (it is not changed)
+    :return: The corrected relative TEC, a boolean array with True where a cycle-slip was corrected, and the cycles
+        subtracted from each L1 and L2 measure (the sum of the corrections up to it)
+    """
+    n = len(l1)
+    rtec = ((l1 / f1) - (l2 / f2)) * c if rtec is None else np.array(rtec, dtype=np.float64)
+    mwlc = (l1 - l2) - (f1 * c1 + f2 * p2) * factor_1 if mwlc is None else np.array(mwlc, dtype=np.float64)
+
+    if select_backend(backend) == 'numba':
+        slips = np.zeros(n, dtype=np.bool_)
+        offsets_1, offsets_2, positions = np.zeros(2 * n), np.zeros(2 * n), np.full(2 * n, -1, dtype=np.int64)
+        rtec = _compiled_loop()(np.ascontiguousarray(l1, dtype=np.float64), np.ascontiguousarray(l2, dtype=np.float64),
+                                np.ascontiguousarray(c1, dtype=np.float64), np.ascontiguousarray(p2, dtype=np.float64),
+                                rtec, mwlc, np.ascontiguousarray(new_arc, dtype=np.bool_),
+                                np.ascontiguousarray(peaks, dtype=np.bool_), slips, np.zeros(n), offsets_1,
+                                offsets_2, positions, float(f1), float(f2), float(factor_1), float(factor_2),
+                                float(c), float(diff_tec_max))
+        return (rtec, slips) + _cycles(n, offsets_1, offsets_2, positions)
+
+    slips = [False] * n
+    offsets_1, offsets_2, positions = [0.0] * (2 * n), [0.0] * (2 * n), [-1] * (2 * n)
+    rtec = _loop(l1.tolist(), l2.tolist(), c1.tolist(), p2.tolist(), rtec.tolist(), mwlc.tolist(),
+                 new_arc.tolist(), peaks.tolist(), slips, [0.0] * n, offsets_1, offsets_2, positions,
+                 f1, f2, factor_1, factor_2, c, diff_tec_max)
+
+    return (np.array(rtec), np.array(slips, dtype=np.bool_)) + _cycles(n, offsets_1, offsets_2, positions)
+
+
+def _cycles(n, offsets_1, offsets_2, positions):
+    """
+    :param n: Number of measures
+    :param offsets_1: The offsets (cycles) of L1 of each correction, in order
+    :param offsets_2: The offsets (cycles) of L2 of each correction, in order
+    :param positions: The index of each correction, -1 after the last one
+    :return: Arrays with the cycles subtracted from each L1 and L2 measure
+    """
+    positions = np.asarray(positions)
+    done = positions >= 0
+
+    cycles_1, cycles_2 = np.zeros(n), np.zeros(n)
+    np.add.at(cycles_1, positions[done], np.asarray(offsets_1)[done])
+    np.add.at(cycles_2, positions[done], np.asarray(offsets_2)[done])
+
+    return np.cumsum(cycles_1), np.cumsum(cycles_2)
+
+
+def select_backend(backend=None):
+    """
+    Resolve the backend of the per-epoch loop:
+        - 'python': the loop runs in the interpreter, over Python lists
+        - 'numba': the loop is JIT-compiled (nopython mode) over typed arrays
+        - 'auto': 'numba' when it is installed, 'python' otherwise
+    When 'numba' is requested but not installed, the 'python' backend is used instead
+
+    :param backend: One of BACKENDS, settings.KERNEL_BACKEND by default
+    :return: The backend to be used, either 'python' or 'numba'
+    """
+    backend = backend or settings.KERNEL_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError("Unknown kernel backend '{}', use one of {}".format(backend, BACKENDS))
+
+    if backend == 'python':
+        return 'python'
+    elif importlib.util.find_spec('numba') is None:
+        if backend == 'numba':
+            logging.warning(">>>> Numba is not installed, using the pure Python correction loop")
+        return 'python'
+
+    return 'numba'
+
+
+_compiled = {}
+
+
+def _compiled_loop():
+    """
+    JIT-compile (once) the same source of _loop and its helpers, which then call each other compiled. Numba is only
+    imported here, then it is not loaded by the runs with no correction loop (e.g. header-only)
+
+    :return: The compiled loop
+    """
+    if 'loop' not in _compiled:
+        import numba
+
+        namespace = dict(globals())
+        for function in (_shifted, _correct, _accumulate, _loop):
+            namespace[function.__name__] = numba.njit(cache=True, nogil=True)(
+                types.FunctionType(function.__code__, namespace, function.__name__))
+        _compiled['loop'] = namespace['_loop']
+
+    return _compiled['loop']
+
+
+def _loop(l1, l2, c1, p2, rtec, mwlc, new_arc, peaks, slips, squares, offsets_1, offsets_2, positions, f1, f2,
+          factor_1, factor_2, c, diff_tec_max):
+    """
+    The per-epoch loop of detect_and_correct. It only indexes its sequences, then the same source runs either over
+    Python lists (plain floats, cheaper than NumPy scalars in the interpreter) or, compiled, over typed arrays.
+    rtec, mwlc, slips, squares, offsets and positions (the index of each correction) are updated in place
+
+    :return: The corrected relative TEC
+    """
+    n = len(l1)
+    count = 0
+    total_1, low_1, high_1 = 0.0, 0.0, 0.0
+    total_2, low_2, high_2 = 0.0, 0.0, 0.0
+
+    j_start = 0
+    for i in range(1, n):
+        l1_i = l1[i]
+        l2_i = l2[i]
+        if count:
+            l1_i = _shifted(l1_i, offsets_1, count, total_1, low_1, high_1)
+            l2_i = _shifted(l2_i, offsets_2, count, total_2, low_2, high_2)
+            rtec[i] = ((l1_i / f1) - (l2_i / f2)) * c
+            mwlc[i] = (l1_i - l2_i) - (f1 * c1[i] + f2 * p2[i]) * factor_1
+
+        if new_arc[i]:
+            j_start = i
+            squares[i] = (rtec[i] - rtec[i - 1]) * (rtec[i] - rtec[i - 1])
+            continue
+
+        if peaks[i]:
+            l1_i, l2_i, diff_1, diff_2 = _correct(i, l1_i, l2_i, c1, p2, rtec, mwlc, f1, f2, factor_1, factor_2, c)
+            total_1, low_1, high_1 = _accumulate(offsets_1, count, total_1, low_1, high_1, diff_1)
+            total_2, low_2, high_2 = _accumulate(offsets_2, count, total_2, low_2, high_2, diff_2)
+            positions[count] = i
+            count += 1
+            slips[i] = True
+
+        if i - j_start + 1 >= 12:
+            add_tec = 0.0
+            add_tec_2 = 0.0
+
+            for jj in range(1, 10):
+                add_tec = add_tec + rtec[i - jj] - rtec[i - jj - 1]
+                add_tec_2 = add_tec_2 + squares[i - jj]
+
+            p_mean = add_tec / 10
+            variance = add_tec_2 / 10 - p_mean * p_mean
+            p_dev = math.sqrt(variance) if variance >= 0 else np.nan
+            if p_dev < diff_tec_max:
+                p_dev = diff_tec_max
+        else:
+            p_mean = 0.0
+            p_dev = diff_tec_max * 2.5
+
+        pmin_tec = p_mean - p_dev * 2
+        pmax_tec = p_mean + p_dev * 2
+        diff_rtec = rtec[i] - rtec[i - 1]
+
+        if not pmin_tec < diff_rtec and diff_rtec <= pmax_tec:
+            l1_i, l2_i, diff_1, diff_2 = _correct(i, l1_i, l2_i, c1, p2, rtec, mwlc, f1, f2, factor_1, factor_2, c)
+            total_1, low_1, high_1 = _accumulate(offsets_1, count, total_1, low_1, high_1, diff_1)
+            total_2, low_2, high_2 = _accumulate(offsets_2, count, total_2, low_2, high_2, diff_2)
+            positions[count] = i
+            count += 1
+            slips[i] = True
+
+        squares[i] = (rtec[i] - rtec[i - 1]) * (rtec[i] - rtec[i - 1])
+
+    return rtec
@@ -4,17 +4,29 @@ import sys
 
 from logging import handlers
 
+import cache
 import cycle_slip as cs
+import daemon
+import glonass
+import manifest as mf
+import settings as settings
+import watch
+import workqueue as wq
 
 
-def main(rinex_folder):
+def main(rinex_folder, workers=settings.WORKERS, rinex_output=None, store=None, report=None,
+         checkpoint=None):
     """
     :param rinex_folder: rinex folder: formats 3.01 to 3.03 are accept for while
+    :param workers: Number of processes checking rinex files in parallel (0 for one per CPU)
     :param rinex_output: rinex output folder, in order to save possibles corrections
+    :param store: store folder, where the rTEC (raw and corrected), MWLC and cycle-slips are appended per station
+    :param report: run report file (JSON, with a CSV next to it), with the time spent in each stage, per file and PRN
+    :param checkpoint: checkpoint folder, where the finished files and PRNs are recorded, then a run killed resumes
     :return: Analyse and detect cycle-slip per PRN, if so, save new files at the output folder declared
     """
-    object_cs = cs.CycleSlip(rinex_folder)
-    object_cs.initialize()
+    object_cs = cs.CycleSlip(rinex_folder, workers, rinex_output, store, checkpoint)
+    object_cs.initialize(report)
 
 
 if __name__ == "__main__":
@@ -22,9 +34,53 @@ if __name__ == "__main__":
                                                  '(GNSS receiver files)')
     parser.add_argument('-rinex_folder', action="store", dest='rinex_folder',
                         help='Rinex folder: formats 3.01 to 3.03 are accept for while.')
-    # parser.add_argument('-rinex_output', action="store", dest='rinex_output',
-    #                     help='Rinex output folder, in order to save possibles corrections.')
+    parser.add_argument('-rinex_output', action="store", dest='rinex_output',
+                        help='Rinex output folder, in order to save possibles corrections.')
+    parser.add_argument('-store', action="store", dest='store',
+                        help='Store folder, where the rTEC (raw and corrected), MWLC and cycle-slips are appended per '
+                             'station and day.')
+    parser.add_argument('-plots', action="store", dest='plots', choices=['all', 'slipped', 'quicklook', 'off'],
+                        default=settings.PLOTS, help='Plot every PRN (all), only the PRNs with cycle-slips (slipped), '
+                                                     'only a quicklook image per rinex (quicklook) or none (off). '
+                                                     'The quicklook is plotted in every mode but off.')
+    parser.add_argument('-report', action="store", dest='report',
+                        help='Run report file (JSON), with the time of each stage, the epochs, cycle-slips and peak '
+                             'memory per file and PRN. A CSV with the same name is saved next to it.')
+    parser.add_argument('-checkpoint', action="store", dest='checkpoint',
+                        help='Checkpoint folder, where each finished file and PRN is recorded. Running again with the '
+                             'same folder resumes a run killed, skipping the files already finished.')
+    parser.add_argument('-memory', action="store", dest='memory', type=int, default=settings.MEMORY_BUDGET_MB,
+                        help='Memory budget (MB) per process for the measures of a rinex. Larger rinex\'s are read and '
+                             'checked by groups of satellites, with the same results.')
     parser.add_argument('-verbose', action="store", dest='verbose', help='Print log of processing.')
+    parser.add_argument('-cache', action="store", dest='cache', choices=['on', 'info', 'purge'],
+                        help='Keep the decoded observations in a cache (on), for files checked again, or inspect '
+                             '(info) or remove all entries (purge) of the cache.')
+    parser.add_argument('-manifest', action="store", dest='manifest',
+                        help='Only prescan the headers of the rinex folder, saving the manifest (CSV) in this file.')
+    parser.add_argument('-workers', action="store", dest='workers', type=int, default=settings.WORKERS,
+                        help='Number of processes checking rinex files in parallel (0 for one per CPU).')
+    parser.add_argument('-queue', action="store", dest='queue',
+                        help='Work queue folder, shared by the workers of every node. The files of -rinex_folder '
+                             '(if given) are added to the queue, then -workers processes check the queue items.')
+    parser.add_argument('-watch', action="store_true", dest='watch',
+                        help='Watch -rinex_folder (and its sub-folders), checking only the new or changed files, as '
+                             'they arrive. The files checked are kept in a ledger, then they are not checked again '
+                             'after a restart.')
+    parser.add_argument('-ledger', action="store", dest='ledger',
+                        help='Ledger file (JSON) of the watched folder, by default one per folder in ~/.cycle_slip.')
+    parser.add_argument('-once', action="store_true", dest='once',
+                        help='With -watch, check the new or changed files and stop, instead of watching.')
+    parser.add_argument('-daemon', action="store_true", dest='daemon',
+                        help='Run as a daemon, checking the rinex files sent to its socket (see -submit), with '
+                             '-workers files at once.')
+    parser.add_argument('-submit', action="store", dest='submit',
+                        help='Send a rinex file to the daemon and print its result.')
+    parser.add_argument('-socket', action="store", dest='socket', default=settings.DAEMON_SOCKET,
+                        help='Socket of the daemon.')
+    parser.add_argument('-glonass_import', action="store", dest='glonass_import',
+                        help='Import the GLONASS channels of a channel file, rinex file, or all of them in a folder, '
+                             'into the offline channel store.')
     args = parser.parse_args()
 
     if args.verbose:
@@ -44,4 +100,39 @@ if __name__ == "__main__":
     else:
         logging.basicConfig(format="%(levelname)s: %(message)s")
 
-    main(args.rinex_folder)
+    settings.PLOTS = args.plots
+    settings.MEMORY_BUDGET_MB = args.memory
+    settings.use_cache = args.cache == 'on' or settings.use_cache
+
+    if args.cache == 'info':
+        print(cache.ObservationCache())
+    elif args.cache == 'purge':
+        print("{} entries removed".format(cache.ObservationCache().purge()))
+    elif args.submit:
+        try:
+            result = daemon.submit(args.submit, args.socket, args.rinex_output, args.store)
+        except OSError as error:
+            sys.exit("No daemon at {}: {}".format(args.socket, error))
+        print(result)
+        sys.exit(result['status'] != 'ok')
+    elif args.watch:
+        watcher = watch.Watcher(args.rinex_folder, args.ledger, args.workers, args.rinex_output, args.store)
+        watcher.run(once=args.once)
+        print(watcher.ledger)
+    elif args.daemon:
+        daemon.serve(args.socket, args.workers)
+    elif args.glonass_import:
+        store = glonass.channel_store()
+        print("{} files imported".format(store.import_path(args.glonass_import)))
+        store.save()
+        print(store)
+    elif args.queue:
+        if args.rinex_folder:
+            wq.WorkQueue(args.queue).populate(mf.Manifest.prescan(args.rinex_folder))
+        print(wq.run(args.queue, args.workers, args.rinex_output, args.store))
+    elif args.manifest:
+        manifest = mf.Manifest.prescan(args.rinex_folder)
+        manifest.save(args.manifest)
+        print(manifest)
+    else:
+        main(args.rinex_folder, args.workers, args.rinex_output, args.store, args.report, args.checkpoint)
@@ -0,0 +1,205 @@
+import csv
+import datetime
+import logging
+import os
+import re
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import compression
+import rinex
+import settings as settings
+
+
+def setup_rinex_name(rinex_name):
+    """
+    Test if rinex name is in the old fashion way or in another formats. In case the format is newer or older, the
+    method will always return the values needed
+        Example of formats name accept:
+            2.11: ALMA1520.18O
+            3.03: ALMA00BRA_R_20181520000_01D_30S_MO.rnx
+        Compressed (.Z, .gz) and Hatanaka compacted (.crx, .18d) names are accept as well
+
+    :param rinex_name: String rinex filename
+    :return: Returns the String rinex absolute path, and the year, month and doy related
+    :raise ValueError: If the name is not in any of the formats accept
+    """
+    rinex_name = compression.strip_compression(rinex_name)
+
+    if rinex_name.endswith(".rnx") or rinex_name.endswith(".crx"):
+        day_i, day_f = 16, 19
+        year_i, year_f, year_type = 12, 16, "%Y"
+        extens = "([rR][nN]|[cC][rR])[xX]$"
+    elif bool(re.match("[oOdD]$", rinex_name[-1:])):
+        day_i, day_f = 4, 7
+        year_i, year_f, year_type = -3, -1, "%y"
+        extens = "[\\d]{2}[oOdD]$"
+    else:
+        raise ValueError("Error during rinex file reading. Not a rinex file name (.rnx, .crx, .yyO or .yyD)!")
+
+    if len(rinex_name) == 0:
+        raise ValueError('Something wrong with parameter \'rinex_name\'!. Empty name!')
+    elif not rinex_name[0:4].isalpha():
+        raise ValueError('Something wrong with parameter \'rinex_name\'!. IAGA code not well format!')
+    elif not rinex_name[day_i:day_f].isdigit() or int(rinex_name[day_i:day_f]) > 366:
+        raise ValueError('Something wrong with parameter \'rinex_name\'!. Invalid day of the year!')
+    elif not bool(re.match(extens, rinex_name[-3:])):
+        raise ValueError('Something wrong with parameter \'rinex_name\'!. Wrong extension or not well format!')
+
+    doy = rinex_name[day_i:day_f]
+    year = datetime.datetime.strptime(rinex_name[year_i:year_f], year_type).strftime('%Y')
+    month = datetime.datetime.strptime(doy, '%j').strftime('%m')
+
+    return year, month, doy
+
+
+class Manifest:
+    """
+    Header-only prescan of a rinex folder. Every file is checked (name, header, version) before any observation is
+    loaded, then the batch can be planned (and costed) up front, while malformed or unsupported files are skipped
+    instead of aborting the run
+    """
+    STATUS_OK = 'ok'
+    STATUS_UNSUPPORTED = 'unsupported'
+    STATUS_MALFORMED = 'malformed'
+
+    _columns = ['file', 'status', 'station', 'year', 'month', 'doy', 'version', 'interval', 'epochs',
+                'constellations', 'observables', 'error']
+    _units = {'C': 0.01, 'Z': 1, 'S': 1, 'M': 60, 'H': 3600, 'D': 86400, 'Y': 365 * 86400}
+    _long_name = re.compile(r'^.{12}\d{11}_(\d\d)([MHDY])_(\d\d)([CZSMHDU])_')
+
+    def __init__(self, folder, entries):
+        """
+        :param folder: The rinex folder
+        :param entries: List of Python dicts, one per file (see Manifest._columns)
+        """
+        self.folder = folder
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    @property
+    def valid(self):
+        return [entry for entry in self.entries if entry['status'] == self.STATUS_OK]
+
+    @property
+    def skipped(self):
+        return [entry for entry in self.entries if entry['status'] != self.STATUS_OK]
+
+    @classmethod
+    def prescan(cls, folder, workers=settings.PRESCAN_WORKERS):
+        """
+        Read, in parallel, the name and header of every file in the folder
+
+        :param folder: The rinex folder
+        :param workers: Number of threads reading headers
+        :return: The Manifest object, with the entries sorted by file name
+        """
+        files = sorted(file for file in os.listdir(folder) if os.path.isfile(os.path.join(folder, file)))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            entries = list(executor.map(lambda file: cls.scan(folder, file), files))
+
+        manifest = cls(folder, entries)
+        for entry in manifest.skipped:
+            logging.warning(">>>> Skipping {} ({}): {}".format(entry['file'], entry['status'], entry['error']))
+
+        return manifest
+
+    @classmethod
+    def scan(cls, folder, file):
+        """
+        :param folder: The rinex folder
+        :param file: The rinex file name
+        :return: The manifest entry (Python dict) of the file
+        """
+        entry = dict.fromkeys(cls._columns)
+        entry.update({'file': file, 'path': os.path.join(folder, file), 'header': None,
+                      'status': cls.STATUS_MALFORMED})
+
+        try:
+            entry['year'], entry['month'], entry['doy'] = setup_rinex_name(file)
+            entry['station'] = file[0:4].upper()
+
+            hdr = rinex.RinexObsReader(entry['path']).header
+            if 'version' not in hdr:
+                raise ValueError("No 'RINEX VERSION / TYPE' record found")
+        except (OSError, ValueError, KeyError, IndexError, RuntimeError) as error:
+            entry['error'] = str(error) or error.__class__.__name__
+            return entry
+
+        entry['header'] = hdr
+        entry['version'] = hdr['version']
+        entry['interval'] = hdr.get('interval')
+        entry['epochs'] = cls._count_epochs(hdr, file)
+        entry['constellations'] = ''.join(sorted(hdr['fields']))
+        entry['observables'] = ' '.join('{}:{}'.format(system, ','.join(obs_types))
+                                        for system, obs_types in sorted(hdr['fields'].items()))
+
+        if hdr['version'] < settings.REQUIRED_VERSION or str(hdr['version']) not in settings.COLUMNS_IN_RINEX:
+            entry['status'] = cls.STATUS_UNSUPPORTED
+            entry['error'] = "Rinex version {}. This code comprises the 3.01+ rinex version".format(hdr['version'])
+        else:
+            entry['status'] = cls.STATUS_OK
+
+        return entry
+
+    @classmethod
+    def _count_epochs(cls, hdr, file):
+        """
+        Estimate the number of epochs with no reading of the observations: from the 'TIME OF FIRST OBS' and
+        'TIME OF LAST OBS' records, when present, otherwise from the period and sample rate of long names (e.g.
+        ALMA00BRA_R_20181520000_01D_30S_MO.rnx)
+
+        :param hdr: The rinex header
+        :param file: The rinex file name
+        :return: The estimated number of epochs, or None
+        """
+        interval = hdr.get('interval')
+        if interval and 'TIME OF FIRST OBS' in hdr and 'TIME OF LAST OBS' in hdr:
+            first, last = (cls._header_time(hdr[label]) for label in ('TIME OF FIRST OBS', 'TIME OF LAST OBS'))
+            return int((last - first) / np.timedelta64(1, 's') / interval) + 1
+
+        match = cls._long_name.match(file)
+        if match:
+            period = int(match.group(1)) * cls._units[match.group(2)]
+            rate = int(match.group(3)) * cls._units[match.group(4)]
+            if rate:
+                return int(period / rate)
+
+        return None
+
+    @staticmethod
+    def _header_time(content):
+        year, month, day, hour, minute = (int(value) for value in content.split()[:5])
+        seconds = float(content.split()[5])
+        return np.datetime64('{:04d}-{:02d}-{:02d}T{:02d}:{:02d}'.format(year, month, day, hour, minute)) + \
+            np.timedelta64(int(round(seconds * 1e6)), 'us')
+
+    def save(self, file):
+        """
+        Save the manifest as CSV
+
+        :param file: Absolute path to the CSV file
+        :return: None
+        """
+        with open(file, mode='w', newline='') as fd:
+            writer = csv.DictWriter(fd, fieldnames=self._columns, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.entries)
+
+        return None
+
+    def __str__(self):
+        valid = self.valid
+        epochs = sum(entry['epochs'] or 0 for entry in valid)
+        stations = len(set(entry['station'] for entry in valid))
+
+        return "{} file(s) found: {} to process ({} stations, ~{} epochs), {} skipped".format(
+            len(self.entries), len(valid), stations, epochs, len(self.skipped))
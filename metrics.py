@@ -0,0 +1,194 @@
+import contextlib
+import contextvars
+import csv
+import json
+import logging
+import os
+import resource
+import threading
+import time
+
+STAGES = ('header', 'load', 'time', 'factors', 'detection', 'correction', 'plots', 'output')
+
+
+def peak_rss():
+    """
+    :return: The peak resident memory (MB) of the current process so far, since it started (not since a collection,
+        see Metrics.as_dict)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Metrics:
+    """
+    Timers and counters of the check of a rinex, per stage (see STAGES) and per PRN. Timers and counters are added
+    from any thread given the object (e.g. the arcs corrected in parallel), and the metrics of other processes are
+    merged (see merge)
+    """
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.prns = {}
+        self._lock = threading.Lock()
+        self._baseline_rss = peak_rss()
+
+    def _target(self, prn):
+        if prn is None:
+            return self.stages, self.counters
+
+        metrics = self.prns.setdefault(prn, {'stages': {}, 'counters': {}})
+        return metrics['stages'], metrics['counters']
+
+    @contextlib.contextmanager
+    def timer(self, stage, prn=None):
+        """
+        Time the code run inside, adding the seconds to the stage (of the PRN, if given)
+
+        :param stage: The stage name (see STAGES)
+        :param prn: The respective PRN, None for the whole rinex
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start, prn)
+
+    def add_time(self, stage, seconds, prn=None):
+        with self._lock:
+            stages, _ = self._target(prn)
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def count(self, name, value=1, prn=None):
+        """
+        :param name: The counter name (e.g. 'epochs', 'slips')
+        :param value: The value added to the counter
+        :param prn: The respective PRN, None for the whole rinex
+        :return: None
+        """
+        with self._lock:
+            _, counters = self._target(prn)
+            counters[name] = counters.get(name, 0) + int(value)
+
+        return None
+
+    def merge(self, other):
+        """
+        :param other: The metrics (see as_dict) to be added to these
+        :return: None
+        """
+        for stage, seconds in other['stages'].items():
+            self.add_time(stage, seconds)
+        for name, value in other['counters'].items():
+            self.count(name, value)
+        for prn, metrics in other['prns'].items():
+            for stage, seconds in metrics['stages'].items():
+                self.add_time(stage, seconds, prn)
+            for name, value in metrics['counters'].items():
+                self.count(name, value, prn)
+
+        return None
+
+    def as_dict(self):
+        """
+        :return: Python dict (JSON serializable) with the stages (seconds), the counters, the metrics of each PRN, the
+            peak resident memory (MB) of the process since it started and how much this peak grew since these metrics
+            were created (the memory taken by the check itself, on top of what the process held before, e.g. a
+            worker reused across files)
+        """
+        peak = peak_rss()
+        with self._lock:
+            return {'stages': dict(self.stages), 'counters': dict(self.counters),
+                    'prns': {prn: {'stages': dict(metrics['stages']), 'counters': dict(metrics['counters'])}
+                             for prn, metrics in sorted(self.prns.items())},
+                    'process_peak_rss_mb': round(peak, 1), 'peak_rss_growth_mb': round(peak - self._baseline_rss, 1)}
+
+
+_current = contextvars.ContextVar('metrics', default=None)
+
+
+@contextlib.contextmanager
+def collect():
+    """
+    Collect, into a new Metrics, the timers and counters of the code run inside (see timer and count). The
+    collection is per thread (a context variable), then concurrent checks in the same process (e.g. the daemon
+    threads) do not mix their metrics; the threads started inside get the Metrics from current() instead
+
+    :return: The Metrics object
+    """
+    token = _current.set(Metrics())
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def current():
+    """
+    :return: The Metrics being collected (see collect) in this thread, or a new one (discarded) when no collection
+        is running
+    """
+    return _current.get() or Metrics()
+
+
+def timer(stage, prn=None):
+    """
+    Time the code run inside, for the metrics being collected (see Metrics.timer)
+    """
+    return current().timer(stage, prn)
+
+
+def count(name, value=1, prn=None):
+    """
+    Add to a counter of the metrics being collected (see Metrics.count)
+    """
+    return current().count(name, value, prn)
+
+
+def save_report(file, results, seconds):
+    """
+    Save the run report, as JSON (the run and every file, with the metrics of each PRN) and as CSV (next to it, with
+    a row per file and per PRN of each file, with the seconds of each stage and the counters)
+
+    :param file: Absolute path to the JSON report (e.g. 'report.json', then the CSV is 'report.csv')
+    :param results: List with the result of each file, with its metrics (see CycleSlip.process_file)
+    :param seconds: The seconds spent in the run
+    :return: None
+    """
+    stages, counters = {}, {}
+    for result in results:
+        for stage, value in result.get('metrics', {}).get('stages', {}).items():
+            stages[stage] = stages.get(stage, 0.0) + value
+        for name, value in result.get('metrics', {}).get('counters', {}).items():
+            counters[name] = counters.get(name, 0) + value
+
+    report = {'run': {'files': len(results), 'failed': sum(result['status'] != 'ok' for result in results),
+                      'seconds': seconds, 'files_per_hour': len(results) / max(seconds, 1e-9) * 3600,
+                      'stages': stages, 'counters': counters,
+                      'process_peak_rss_mb': round(max([peak_rss()] + [result.get('metrics', {}).get(
+                          'process_peak_rss_mb', 0) for result in results]), 1)},
+              'files': results}
+
+    os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+    with open(file, mode='w') as fd:
+        json.dump(report, fd, indent=2, default=str)
+
+    names = sorted(set(name for result in results for metrics in [result.get('metrics', {})]
+                       for name in list(metrics.get('counters', {})) +
+                       [name for prn in metrics.get('prns', {}).values() for name in prn['counters']]))
+    columns = ['file', 'prn', 'status', 'seconds'] + list(STAGES) + names + ['process_peak_rss_mb',
+                                                                             'peak_rss_growth_mb']
+
+    with open(os.path.splitext(file)[0] + '.csv', mode='w', newline='') as fd:
+        writer = csv.DictWriter(fd, fieldnames=columns, restval='')
+        writer.writeheader()
+        for result in results:
+            metrics = result.get('metrics', {})
+            writer.writerow(dict(metrics.get('stages', {}), **metrics.get('counters', {}), file=result['file'],
+                                 prn='', status=result['status'], seconds=result['seconds'],
+                                 process_peak_rss_mb=metrics.get('process_peak_rss_mb', ''),
+                                 peak_rss_growth_mb=metrics.get('peak_rss_growth_mb', '')))
+            for prn, prn_metrics in metrics.get('prns', {}).items():
+                writer.writerow(dict(prn_metrics['stages'], **prn_metrics['counters'], file=result['file'], prn=prn))
+
+    logging.info(">> Run report saved in {}".format(file))
+    return None
@@ -47,18 +47,34 @@ class ParserChannels(ParserGeneric):
         :param data: The ASCII content from https://www.glonass-iac.ru/en/CUSGLONASS/getCUSMessage.php
         :return: The python channels object, with all the information (prn - value) parsed
         """
-        for prn, channel in re.findall(self.pattern, data):
-            new_channel = float(channel.strip())
-            f1 = 1602.0e+6 + (new_channel * 562500.0)
-            f2 = 1246.0e+6 + (new_channel * 437500.0)
-            factor_1 = (f1 - f2) / (f1 + f2) / self.C
-            factor_2 = (f1 * f2) / (f2 - f1) / self.C
-
-            # self.parsed[prn.strip()] = pow(f1 * f2, 2) / (f1 + f2) / (f1 - f2) / self.A / self.TECU
-            self.parsed[prn.strip()] = [f1, f2, factor_1, factor_2]
+        for prn, channel in self.channels(data).items():
+            # self.parsed[prn] = pow(f1 * f2, 2) / (f1 + f2) / (f1 - f2) / self.A / self.TECU
+            self.parsed[prn] = self.frequencies(channel)
 
         return None
 
+    @classmethod
+    def channels(cls, data):
+        """
+        :param data: The ASCII content with the GLONASS channels
+        :return: Python dict with the slot (e.g. '01') as key and the frequency channel (int) as value
+        """
+        return {prn.strip(): int(channel.strip()) for prn, channel in re.findall(cls._regex, data)}
+
+    @classmethod
+    def frequencies(cls, channel):
+        """
+        :param channel: The GLONASS frequency channel
+        :return: List [f1, f2, factor_1, factor_2] of the channel
+        """
+        new_channel = float(channel)
+        f1 = 1602.0e+6 + (new_channel * 562500.0)
+        f2 = 1246.0e+6 + (new_channel * 437500.0)
+        factor_1 = (f1 - f2) / (f1 + f2) / cls.C
+        factor_2 = (f1 * f2) / (f2 - f1) / cls.C
+
+        return [f1, f2, factor_1, factor_2]
+
     def parser(self):
         logging.info(">> Starting GLONASS channels parsing...")
         self.find()
@@ -0,0 +1,254 @@
+import logging
+import os
+import threading
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import settings as settings
+
+MODES = ('all', 'slipped', 'quicklook', 'off')
+
+
+def decimate(values, max_points=settings.PLOT_MAX_POINTS):
+    """
+    Reduce a long series for display, keeping the lowest and the highest value of each bucket of samples, then the
+    spikes (as the cycle-slips) are still seen
+
+    :param values: The series (1-D array, with NaN values)
+    :param max_points: Maximum number of points of the reduced series
+    :return: The positions (in values) and the values of the reduced series
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) <= max_points:
+        return np.arange(len(values)), values
+
+    size = -(-2 * len(values) // max_points)
+    buckets = -(-len(values) // size)
+    padded = np.full(buckets * size, np.nan)
+    padded[:len(values)] = values
+    padded = padded.reshape(buckets, size)
+
+    positions = np.arange(buckets) * size
+    positions = np.column_stack((positions, np.minimum(positions + size // 2, len(values) - 1))).ravel()
+    reduced = np.column_stack((np.fmin.reduce(padded, axis=1), np.fmax.reduce(padded, axis=1))).ravel()
+
+    return positions, reduced
+
+
+def time_grid(time, matrix, max_rows=settings.PLOT_MAX_POINTS):
+    """
+    Place the epochs of a (epoch x sv) matrix over a regular time grid, for display: the step is the sampling
+    interval of the epochs, widened when needed to give at most max_rows rows, and each row averages the measures
+    of its epochs. Rows with no measure (data holes, gaps between arcs, missing epochs) are NaN
+
+    :param time: Array datetime64 with the epochs (sorted)
+    :param matrix: The (epoch x sv) matrix, with NaN values
+    :param max_rows: Maximum number of rows of the grid
+    :return: The hours (since the beginning of the day of the first epoch) of each row, the step (hours) and the
+        (rows x sv) matrix
+    """
+    time = np.asarray(time, dtype='datetime64[ns]')
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if not len(time):
+        return np.array([]), 1.0, matrix
+
+    elapsed = (time - time[0]).astype(np.int64)
+    step = int(np.median(np.diff(elapsed))) if len(time) > 1 else 1
+    step = max(step, 1) * max(-(-(elapsed[-1] // max(step, 1) + 1) // max_rows), 1)
+
+    rows = elapsed // step
+    starts = np.flatnonzero(np.concatenate(([True], rows[1:] != rows[:-1])))
+    valid = ~np.isnan(matrix)
+    counts = np.add.reduceat(valid, starts, axis=0)
+    sums = np.add.reduceat(np.where(valid, matrix, 0), starts, axis=0)
+
+    grid = np.full((rows[-1] + 1, matrix.shape[1]), np.nan)
+    grid[rows[starts]] = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+    day = time[0].astype('datetime64[D]')
+    hours = ((time[0] - day).astype(np.int64) + np.arange(len(grid)) * step) / 3.6e12
+
+    return hours, step / 3.6e12, grid
+
+
+def quicklook(fig, hours, step, sv, rtec, slips, title):
+    """
+    Draw the quicklook of a rinex: an (epoch x sv) heat map of the corrected relative TEC, drawn at once (a single
+    image), with the cycle-slips over it (a single scatter). The relative TEC of each satellite is taken from its
+    median, then the satellites share a color scale; the data holes (and the gaps between arcs) are left blank
+
+    :param fig: The matplotlib figure
+    :param hours: Array with the hours (since the beginning of the day) of each row of rtec
+    :param step: The hours between two rows
+    :param sv: Array with the satellites names
+    :param rtec: The (rows x sv) matrix of the corrected relative TEC, over a regular time grid (see time_grid)
+    :param slips: The hours and the satellites indexes of the cycle-slips
+    :param title: The title (e.g. station and day)
+    :return: None
+    """
+    fig.set_size_inches(12, max(4, 0.18 * len(sv) + 1.5))
+    ax = fig.add_subplot(1, 1, 1)
+
+    rtec = np.asarray(rtec, dtype=np.float64)
+    valid = ~np.isnan(rtec)
+    if valid.any():
+        medians = np.array([np.median(rtec[valid[:, k], k]) if valid[:, k].any() else 0.0
+                            for k in range(rtec.shape[1])])
+        rtec = rtec - medians
+        low, high = np.percentile(rtec[valid], [2, 98])
+    else:
+        low, high = -1, 1
+
+    image = ax.imshow(np.ma.masked_invalid(rtec.T), aspect='auto', interpolation='nearest', cmap='viridis',
+                      vmin=low, vmax=high, origin='lower', extent=(hours[0], hours[-1] + step, -0.5, len(sv) - 0.5))
+    ax.scatter(*slips, marker='x', s=20, color='red', label='Cycle-slip')
+
+    ax.set_yticks(np.arange(len(sv)))
+    ax.set_yticklabels(sv, fontsize=6)
+    ax.set_xlabel('Hours (UT)')
+    ax.set_title(title)
+    ax.legend(loc='upper right')
+    fig.colorbar(image, ax=ax, label='rTEC - median')
+
+
+_local = threading.local()
+
+
+def _render(function, path, args):
+    """
+    Draw a plot and save it, over the figure of the current worker (created once, and cleared after each plot)
+
+    :param function: Function drawing on the figure, as function(fig, *args)
+    :param path: Absolute path of the plot file
+    :param args: The arguments of function
+    :return: The path of the plot file
+    """
+    if getattr(_local, 'figure', None) is None:
+        # matplotlib is only loaded by the workers which draw, then the runs with no plots do not load it
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        _local.figure = Figure()
+        _local.size = _local.figure.get_size_inches()
+        FigureCanvasAgg(_local.figure)
+
+    fig = _local.figure
+    fig.set_size_inches(_local.size)
+    try:
+        function(fig, *args)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fig.savefig(path)
+    finally:
+        fig.clf()
+
+    return path
+
+
+class PlotRenderer:
+    """
+    Render the plots off the numeric pipeline: each plot is queued to a pool of workers (processes, or a thread when
+    workers is 0), each one drawing on a single figure, reused and cleared for every plot, with no pyplot state left
+    behind. The series are decimated (see decimate) before being queued, and at most max_pending plots wait in the
+    queue (submit blocks beyond that), then the memory stays flat over long batches
+    """
+    def __init__(self, folder=settings.PLOTS_FOLDER, mode=settings.PLOTS, workers=settings.PLOT_WORKERS,
+                 max_pending=settings.PLOT_MAX_PENDING):
+        """
+        :param folder: The plots folder, where each plot is saved in its own path (see submit)
+        :param mode: 'all' (every PRN), 'slipped' (only the PRNs with cycle-slips), 'quicklook' (only the quicklook
+            of each rinex) or 'off' (no plots). The quicklook is rendered in every mode but 'off'
+        :param workers: Number of processes rendering the plots (0 for a thread of the current process)
+        :param max_pending: Maximum number of plots waiting to be rendered
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown plots mode '{}', use one of {}".format(mode, MODES))
+
+        self.folder = folder
+        self.mode = mode
+        self.workers = workers
+        self.rendered = 0
+        self.failed = 0
+
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+
+    def wants(self, slipped=True):
+        """
+        :param slipped: True if the plot shows cycle-slips
+        :return: True if the plot must be rendered, by the mode
+        """
+        return self.mode == 'all' or (self.mode == 'slipped' and slipped)
+
+    def wants_quicklook(self):
+        """
+        :return: True if the quicklook of each rinex must be rendered, by the mode
+        """
+        return self.mode != 'off'
+
+    def submit(self, function, path, *args):
+        """
+        Queue a plot to be rendered
+
+        :param function: Function drawing on a matplotlib figure, as function(fig, *args). It must be picklable (a
+            module level function or a static method), as well as its arguments
+        :param path: Path of the plot file, relative to the plots folder
+        :param args: The arguments of function (decimated series)
+        :return: None
+        """
+        if self.mode == 'off':
+            return None
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 0 else \
+                ThreadPoolExecutor(max_workers=1)
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(_render, function, os.path.join(self.folder, path), args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._done)
+
+        return None
+
+    def _done(self, future):
+        self._slots.release()
+        if future.cancelled() or future.exception() is not None:
+            self.failed += 1
+            logging.warning(">>>> Plot failed: {}".format(future.exception() if not future.cancelled() else
+                                                         "cancelled"))
+        else:
+            self.rendered += 1
+
+    def close(self):
+        """
+        Wait for the plots queued, releasing the workers
+
+        :return: None
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            logging.info(">> {} plots rendered in {} ({} failed)".format(self.rendered, self.folder, self.failed))
+
+        return None
+
+
+_renderers = {}
+_renderers_lock = threading.Lock()
+
+
+def renderer():
+    """
+    :return: The PlotRenderer of the current process, created once per process (a forked process does not share the
+        workers of its parent), with the settings of that moment
+    """
+    with _renderers_lock:
+        if os.getpid() not in _renderers:
+            _renderers[os.getpid()] = PlotRenderer(settings.PLOTS_FOLDER, settings.PLOTS, settings.PLOT_WORKERS,
+                                                   settings.PLOT_MAX_PENDING)
+
+        return _renderers[os.getpid()]
@@ -0,0 +1,572 @@
+import contextlib
+import itertools
+import logging
+import mmap
+import os
+import re
+import shutil
+import socket
+
+import numpy as np
+
+import compression
+import metrics
+
+
+class Observations:
+    """
+    Decoded observables of a rinex file. Each observable is kept as a (epoch x sv) float64 matrix, with NaN where the
+    satellite was not tracked (or the field was blank)
+    """
+    def __init__(self, header, time, sv, data):
+        """
+        :param header: The parsed rinex header (see RinexObsReader.header)
+        :param time: Array datetime64[ns] with the epochs of the rinex
+        :param sv: Array with the satellites names, sorted (e.g. 'G01', 'R24')
+        :param data: Python dict with the observable code as key and the (epoch x sv) matrix as value
+        """
+        self.header = header
+        self.time = time
+        self.sv = sv
+        self.data = data
+        self._sv_index = {prn: i for i, prn in enumerate(sv)}
+
+    def __getitem__(self, code):
+        return self.data[code]
+
+    def __contains__(self, code):
+        return code in self.data
+
+    def sel(self, code, prn):
+        """
+        Returns the observable measures over all epochs for a single satellite
+
+        :param code: Observable code, as declared in settings.COLUMNS_IN_RINEX (e.g. 'L1C')
+        :param prn: The respective PRN (e.g. 'G01')
+        :return: Column view of the (epoch x sv) matrix
+        """
+        return self.data[code][:, self._sv_index[prn]]
+
+
+class RinexObsReader:
+    """
+    Purpose-built reader for RINEX 3.01 to 3.03 observation files. The header 'SYS / # / OBS TYPES' records give the
+    position of every observable in the fixed-width satellite records (F14.3 + LLI + SSI, per observable), then only
+    the columns requested are decoded, straight into (epoch x sv) matrices
+    """
+    _field_width = 14
+    _record_width = 16
+    _chunk_size = 200000
+
+    def __init__(self, file):
+        """
+        :param file: Absolute path to the rinex observation file (plain, .Z/.gz compressed and/or .crx compacted)
+        """
+        self.file = file
+        self._header = None
+
+    def openfile(self):
+        return compression.open_rinex(self.file)
+
+    @property
+    def header(self):
+        """
+        The rinex header, parsed in the same fashion as georinex.rinexheader: each header label points to its
+        content (repeated labels are concatenated), plus 'version', 'systems' and 'fields' (observable codes per
+        constellation)
+
+        :return: The Python dict header
+        """
+        if self._header is None:
+            with self.openfile() as fd:
+                self._header = self._read_header(fd)
+
+        return self._header
+
+    @staticmethod
+    def _read_header(fd):
+        """
+        Read the header records, leaving the file descriptor positioned at the first epoch
+
+        :param fd: Binary file descriptor at the beginning of the file
+        :return: The Python dict header
+        """
+        hdr = {'fields': {}}
+        system = None
+
+        for line in fd:
+            line = line.decode('ascii', errors='replace').rstrip('\r\n')
+            content, label = line[:60], line[60:80].strip()
+
+            if label == 'END OF HEADER':
+                break
+            elif label == 'RINEX VERSION / TYPE':
+                hdr['version'] = float(content[:9])
+                hdr['filetype'] = content[20:21]
+                hdr['systems'] = content[40:41]
+            elif label == 'SYS / # / OBS TYPES':
+                if content[0:1].strip():
+                    system = content[0:1]
+                    hdr['fields'][system] = []
+                hdr['fields'][system].extend(content[7:].split())
+            elif label == 'INTERVAL':
+                hdr['interval'] = float(content[:10])
+
+            hdr[label] = hdr[label] + content if label in hdr else content
+
+        return hdr
+
+    def _field_offsets(self, columns, constellations):
+        """
+        Compute, once per file, the starting column of each observable requested inside the satellite records. As
+        in georinex, a requested code selects every observable starting with it (e.g. 'L1' selects 'L1C' and 'L1W'),
+        and the observables are named by their full code
+
+        :param columns: The observable codes to decode (see Utils.which_cols_to_load)
+        :param constellations: The constellations to decode (e.g. ['G', 'R'])
+        :return: Python dict with the constellation (bytes) as key and a list of (code, offset) as value
+        """
+        offsets = {}
+
+        for system in constellations:
+            obs_types = self.header['fields'].get(system, [])
+            selected = [(obs_type, 3 + self._record_width * i) for i, obs_type in enumerate(obs_types)
+                        if any(obs_type.startswith(code) for code in columns)]
+
+            if selected:
+                offsets[system.encode()] = selected
+
+        return offsets
+
+    def _decode(self, lines, selected):
+        """
+        Decode a chunk of satellite records of the same constellation, only at the selected offsets
+
+        :param lines: List of satellite records (bytes)
+        :param selected: List of (code, offset) to be decoded
+        :return: Matrix (records x selected) with the decoded values (NaN for blank fields)
+        """
+        width = max(offset for _, offset in selected) + self._field_width
+
+        block = np.array(lines, dtype='S%d' % width).view(np.uint8).reshape(len(lines), width)
+        block = np.where(block < 32, 32, block).astype(np.uint8)
+        blank_value = np.frombuffer(b'nan'.rjust(self._field_width), dtype=np.uint8)
+
+        values = np.empty((len(lines), len(selected)))
+        for k, (_, offset) in enumerate(selected):
+            field = np.ascontiguousarray(block[:, offset:offset + self._field_width])
+            field[(field == 32).all(axis=1)] = blank_value
+            values[:, k] = field.view('S%d' % self._field_width).ravel().astype(np.float64)
+
+        return values
+
+    @staticmethod
+    def _epochs_to_datetime64(epochs):
+        """
+        Convert the epoch records ('yyyy mm dd hh mm ss.sssssss') to datetime64[ns], all at once
+
+        :param epochs: List of the epoch records (bytes)
+        :return: Array datetime64[ns]
+        """
+        if not epochs:
+            return np.array([], dtype='datetime64[ns]')
+
+        fields = np.array([epoch.split() for epoch in epochs])
+        date = fields[:, :5].astype(np.int64)
+        seconds = fields[:, 5].astype(np.float64)
+
+        time = (date[:, 0] - 1970).astype('datetime64[Y]')
+        time = time.astype('datetime64[M]') + (date[:, 1] - 1).astype('timedelta64[M]')
+        time = time.astype('datetime64[D]') + (date[:, 2] - 1).astype('timedelta64[D]')
+        time = time.astype('datetime64[ns]') + (date[:, 3] * 3600 + date[:, 4] * 60).astype('timedelta64[s]')
+
+        return time + np.round(seconds * 1e9).astype('timedelta64[ns]')
+
+    @staticmethod
+    def _blocks(records):
+        """
+        Walk the epochs of the rinex body. Epochs with flags other than 0 (OK) or 1 (power failure) are skipped, as
+        they bring header records or event lines instead of measures
+
+        :param records: Iterator over the lines of the rinex, after the header
+        :return: Generator of (epoch record, iterator over its satellite records), each block to be consumed before
+            the next one
+        """
+        for line in records:
+            if line[:1] != b'>':
+                continue
+
+            flag = int(line[29:32].strip() or 0)
+            block = itertools.islice(records, int(line[32:35]))
+
+            if flag > 1:
+                for _ in block:
+                    pass
+                continue
+
+            yield line, block
+
+    def scan(self, constellations):
+        """
+        Walk the rinex with no measure decoded, to plan how it is read (e.g. by satellites groups, see read)
+
+        :param constellations: The constellations of the satellites (e.g. ['G', 'R'])
+        :return: The number of epochs, and the array with the satellites names, sorted
+        """
+        systems = {system.encode() for system in constellations}
+        epochs, sv = 0, set()
+
+        with self.openfile() as fd:
+            self._header = self._read_header(fd)
+            for _, block in self._blocks(iter(fd)):
+                epochs += 1
+                sv.update(record[:3].replace(b' ', b'0') for record in block if record[:1] in systems)
+
+        return epochs, np.array(sorted(prn.decode() for prn in sv))
+
+    def _records(self, offsets, selected_sv, epochs, sv_ids):
+        """
+        Walk the rinex, decoding the satellite records in chunks per constellation (see _decode). Epochs with flags
+        other than 0 (OK) or 1 (power failure) are skipped (see _blocks)
+
+        :param offsets: The observables of each constellation (see _field_offsets)
+        :param selected_sv: Set with the satellites to decode (bytes), None for all of them
+        :param epochs: List, filled with the epoch records (bytes)
+        :param sv_ids: Python dict, filled with the id of each satellite (bytes), in the order they are found
+        :return: Generator of (constellation, rows, satellite ids, (records x observables) matrix), in the order of the
+            epochs for each constellation
+        """
+        pending = {system: ([], [], []) for system in offsets}
+
+        def decoded(system):
+            rows, ids, lines = pending[system]
+            pending[system] = ([], [], [])
+            return system, np.array(rows, dtype=np.int64), np.array(ids, dtype=np.int64), \
+                self._decode(lines, offsets[system])
+
+        with self.openfile() as fd:
+            self._header = self._read_header(fd)
+
+            for line, block in self._blocks(iter(fd)):
+                row = len(epochs)
+                epochs.append(line[2:29])
+
+                for record in block:
+                    system = record[:1]
+                    if system not in pending:
+                        continue
+
+                    prn = record[:3].replace(b' ', b'0')
+                    if selected_sv is not None and prn not in selected_sv:
+                        continue
+                    if prn not in sv_ids:
+                        sv_ids[prn] = len(sv_ids)
+
+                    rows, ids, lines = pending[system]
+                    rows.append(row)
+                    ids.append(sv_ids[prn])
+                    lines.append(record)
+
+                    if len(lines) >= self._chunk_size:
+                        yield decoded(system)
+
+        for system in offsets:
+            if pending[system][2]:
+                yield decoded(system)
+
+    def read(self, columns, constellations, sv=None):
+        """
+        Read the observations of the rinex. Epochs with flags other than 0 (OK) or 1 (power failure) are skipped
+        (see _blocks)
+
+        :param columns: The observable codes to decode (see Utils.which_cols_to_load)
+        :param constellations: The constellations to decode (e.g. ['G', 'R'])
+        :param sv: The satellites to decode (e.g. a group of the ones given by scan), all of them by default. The
+            epochs are the same whatever the satellites
+        :return: The Observations object
+        """
+        offsets = self._field_offsets(columns, constellations)
+        selected_sv = {prn.encode() for prn in sv} if sv is not None else None
+
+        epochs = []
+        sv_ids = {}
+        decoded = {system: [] for system in offsets}
+        for system, rows, ids, values in self._records(offsets, selected_sv, epochs, sv_ids):
+            decoded[system].append((rows, ids, values))
+
+        decoded_sv = sorted(sv_ids)
+        column = np.empty(len(decoded_sv), dtype=np.int64)
+        for i, prn in enumerate(decoded_sv):
+            column[sv_ids[prn]] = i
+
+        data = {}
+        for system, selected in offsets.items():
+            for code, _ in selected:
+                if code not in data:
+                    data[code] = np.full((len(epochs), len(decoded_sv)), np.nan)
+
+            for rows, ids, values in decoded[system]:
+                for k, (code, _) in enumerate(selected):
+                    data[code][rows, column[ids]] = values[:, k]
+
+        logging.info(">>>>>> {} epochs and {} satellites decoded ({})".format(len(epochs), len(decoded_sv),
+                                                                             ", ".join(sorted(data))))
+
+        with metrics.timer('time'):
+            time = self._epochs_to_datetime64(epochs)
+
+        return Observations(self._header, time, np.array([prn.decode() for prn in decoded_sv]), data)
+
+    def spill(self, columns, constellations, sv, epochs, folder):
+        """
+        Read the observations of the rinex in a single pass, as read does, but writing them to disk instead of
+        memory: a file per observable, with the whole time series of each satellite in a row (sv x epoch). Each
+        satellite is appended in the order of the epochs, then only a chunk of records is held in memory. The
+        observations of a group of satellites are then read back at once (see SpilledObservations)
+
+        :param columns: The observable codes to decode (see Utils.which_cols_to_load)
+        :param constellations: The constellations to decode (e.g. ['G', 'R'])
+        :param sv: Array with all the satellites names, sorted (see scan)
+        :param epochs: The number of epochs (see scan)
+        :param folder: An existing folder for the files (e.g. a temporary one, removed by the caller)
+        :return: The SpilledObservations object
+        """
+        offsets = self._field_offsets(columns, constellations)
+        index = {prn.encode(): k for k, prn in enumerate(sv)}
+        codes = sorted({code for selected in offsets.values() for code, _ in selected})
+        files = {code: os.open(os.path.join(folder, code + '.bin'), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+                 for code in codes}
+        written = {code: np.zeros(len(sv), dtype=np.int64) for code in codes}
+
+        def append(code, k, rows, values):
+            # from the last epoch written of the satellite up to its last one in the chunk, NaN where not tracked
+            first = written[code][k]
+            segment = np.full(rows[-1] + 1 - first, np.nan)
+            segment[rows - first] = values
+            os.pwrite(files[code], segment.tobytes(), (k * epochs + first) * 8)
+            written[code][k] = rows[-1] + 1
+
+        decoded_epochs, sv_ids = [], {}
+        try:
+            for system, rows, ids, values in self._records(offsets, set(index), decoded_epochs, sv_ids):
+                column = np.empty(len(sv_ids), dtype=np.int64)
+                for prn, i in sv_ids.items():
+                    column[i] = index[prn]
+                sv_columns = column[ids]
+
+                # the records of each satellite, in the order of the epochs
+                order = np.argsort(sv_columns, kind='stable')
+                for positions in np.split(order, np.flatnonzero(np.diff(sv_columns[order])) + 1):
+                    k = sv_columns[positions[0]]
+                    for j, (code, _) in enumerate(offsets[system]):
+                        append(code, k, rows[positions], values[positions, j])
+
+            if len(decoded_epochs) != epochs:
+                raise ValueError("The rinex {} has {} epochs, {} were expected".format(self.file, len(decoded_epochs),
+                                                                                   epochs))
+            for code in codes:
+                for k in np.flatnonzero(written[code] < epochs):
+                    append(code, k, np.array([epochs - 1]), np.nan)
+        finally:
+            for fd in files.values():
+                os.close(fd)
+
+        logging.info(">>>>>> {} epochs and {} satellites decoded to {} ({})".format(epochs, len(sv), folder,
+                                                                                   ", ".join(codes)))
+
+        with metrics.timer('time'):
+            time = self._epochs_to_datetime64(decoded_epochs)
+
+        return SpilledObservations(self._header, time, np.asarray(sv),
+                                   {code: os.path.join(folder, code + '.bin') for code in codes})
+
+
+class SpilledObservations:
+    """
+    Decoded observables of a rinex kept on disk (see RinexObsReader.spill), read back by groups of consecutive
+    satellites as Observations
+    """
+    def __init__(self, header, time, sv, files):
+        """
+        :param header: The parsed rinex header (see RinexObsReader.header)
+        :param time: Array datetime64[ns] with the epochs of the rinex
+        :param sv: Array with the satellites names, sorted
+        :param files: Python dict with the observable code as key and its file (sv x epoch, float64) as value
+        """
+        self.header = header
+        self.time = time
+        self.sv = sv
+        self.files = files
+
+    def observations(self, sv):
+        """
+        :param sv: Array with consecutive satellites names of the rinex (e.g. a group, see Utils.satellite_groups)
+        :return: The Observations object of the satellites, with (epoch x sv) views of the rows read
+        """
+        start = int(np.searchsorted(self.sv, sv[0])) if len(sv) else 0
+        if list(self.sv[start:start + len(sv)]) != list(sv):
+            raise ValueError("The satellites {} are not consecutive in the rinex".format(list(sv)))
+
+        epochs = len(self.time)
+        data = {}
+        for code, file in self.files.items():
+            with open(file, mode='rb') as fd:
+                fd.seek(start * epochs * 8)
+                data[code] = np.fromfile(fd, dtype=np.float64, count=len(sv) * epochs).reshape(len(sv), epochs).T
+
+        return Observations(self.header, self.time, np.asarray(sv), data)
+
+
+class RinexObsWriter:
+    """
+    Writer of the corrected rinex observation files. The original rinex is copied as is (in bulk) to a temporary
+    file, then only the fixed-width fields (F14.3) of the corrected observables are overwritten in place (mmap), at
+    the epochs and satellites where they changed: the header, the other observables and the LLI/SSI flags are kept
+    byte for byte. The output is replaced by the temporary file only when it is complete (see replacing). Compressed
+    (.Z, .gz) and/or compact (.crx, .yyd) rinex are written as plain rinex
+    """
+    _field_width = 14
+    _record_width = 16
+    _epoch = re.compile(rb'^>', re.MULTILINE)
+    _compact = re.compile(r'\.(crx|\d\d[dD])$', re.IGNORECASE)
+
+    def __init__(self, file):
+        """
+        :param file: Absolute path to the original rinex observation file
+        """
+        self.file = file
+
+    @classmethod
+    def output_name(cls, file):
+        """
+        :param file: The original rinex file name (e.g. ALMA00BRA_R_20181520000_01D_30S_MO.crx.gz)
+        :return: The plain rinex file name (e.g. ALMA00BRA_R_20181520000_01D_30S_MO.rnx)
+        """
+        def plain(match):
+            extension = match.group(1)
+            if extension.lower() == 'crx':
+                return '.rnx' if extension.islower() else '.RNX'
+            return '.' + extension[:2] + ('o' if extension[2] == 'd' else 'O')
+
+        return cls._compact.sub(plain, compression.strip_compression(os.path.basename(file)))
+
+    def _copy(self, output):
+        """
+        Copy the original rinex, uncompressed, to the output file
+
+        :param output: Absolute path to the output file
+        :return: None
+        """
+        if self._compact.search(compression.strip_compression(self.file)):
+            with compression.open_rinex(self.file) as fd, open(output, mode='wb') as out_file:
+                out_file.writelines(fd)
+        elif compression.strip_compression(self.file) != self.file:
+            compression.decompress(self.file, output)
+        else:
+            shutil.copyfile(self.file, output)
+
+        return None
+
+    def _epoch_offsets(self, buffer):
+        """
+        :param buffer: The plain rinex content (mmap)
+        :return: List with the position of each epoch record, skipping the epochs with flags other than 0 or 1 (as
+            in RinexObsReader.read, then the epochs match the rows of the Observations)
+        """
+        offsets = []
+        for match in self._epoch.finditer(buffer):
+            position = match.start()
+            if int(buffer[position + 29:position + 32].strip() or 0) <= 1:
+                offsets.append(position)
+
+        return offsets
+
+    @contextlib.contextmanager
+    def replacing(self, output):
+        """
+        Copy the original rinex to a temporary file next to the output, to be patched inside (see patch), then replace
+        the output with it at once (os.replace), as the other files shared by the workers (see
+        workqueue.WorkQueue._write). A worker checking the same file (e.g. after a lease expired) or a killed run
+        never leaves a partial rinex as the output. The temporary file is removed on errors
+
+        :param output: Absolute path to the output file (a plain rinex)
+        :return: Absolute path to the temporary file
+        """
+        temporary = '{}.tmp-{}-{}'.format(output, socket.gethostname(), os.getpid())
+        try:
+            self._copy(temporary)
+            yield temporary
+            os.replace(temporary, output)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temporary)
+
+    def write(self, output, sv, values):
+        """
+        Write the corrected rinex (see replacing)
+
+        :param output: Absolute path to the output file (a plain rinex)
+        :param sv: Array with the satellites names (the columns of the matrices)
+        :param values: Python dict with the observable code (e.g. 'L1C') as key and a (epoch x sv) matrix as value,
+            with the new values where they changed and NaN where the original field is kept
+        :return: The number of fields overwritten
+        """
+        with self.replacing(output) as temporary:
+            return self.patch(temporary, sv, values)
+
+    def patch(self, output, sv, values):
+        """
+        Overwrite the corrected fields of a rinex being written, in place, e.g. for each satellites group. Only for the
+        temporary file of replacing: the output itself is never patched in place
+
+        :param output: Absolute path to the temporary file (a plain rinex, see replacing)
+        :param sv: Array with the satellites names (the columns of the matrices)
+        :param values: Python dict with the observable code as key and a (epoch x sv) matrix as value (see write)
+        :return: The number of fields overwritten
+        """
+        fields = {}
+        for system, obs_types in RinexObsReader(output).header['fields'].items():
+            fields[system] = [(code, 3 + self._record_width * obs_types.index(code)) for code in values
+                              if code in obs_types]
+
+        columns = {prn: k for k, prn in enumerate(sv)}
+        changed = np.any([~np.isnan(matrix) for matrix in values.values()], axis=0)
+        rows = np.flatnonzero(np.any(changed, axis=-1)) if values else []
+
+        patched = 0
+        if not len(rows):
+            return patched
+
+        with open(output, mode='r+b') as fd, mmap.mmap(fd.fileno(), 0) as buffer:
+            epochs = self._epoch_offsets(buffer)
+            if len(epochs) <= rows[-1]:
+                raise ValueError("The rinex {} has {} epochs, the corrections have {}"
+                                 .format(self.file, len(epochs), rows[-1] + 1))
+
+            for row in rows:
+                start = buffer.find(b'\n', epochs[row]) + 1
+                for _ in range(int(buffer[epochs[row] + 32:epochs[row] + 35])):
+                    end = buffer.find(b'\n', start)
+                    end = len(buffer) if end < 0 else end
+
+                    prn = buffer[start:start + 3].replace(b' ', b'0').decode('ascii', errors='replace')
+                    k = columns.get(prn)
+                    if k is not None and changed[row, k]:
+                        for code, offset in fields.get(prn[0:1], []):
+                            value = values[code][row, k]
+                            if np.isnan(value):
+                                continue
+
+                            field = b'%14.3f' % value
+                            if len(field) != self._field_width or start + offset + self._field_width > end:
+                                raise ValueError("Can not write {} = {} of {} at the epoch {}"
+                                                 .format(code, value, prn, row))
+                            buffer[start + offset:start + offset + self._field_width] = field
+                            patched += 1
+
+                    start = end + 1
+
+            buffer.flush()
+
+        logging.info(">>>> {} fields corrected in {}".format(patched, output))
+        return patched
@@ -1,6 +1,7 @@
 """
 Commom settings to all applications
 """
+import os
 
 A = 40.3
 TECU = 1.0e16
@@ -11,19 +12,77 @@ factor_1 = (F1 - F2) / (F1 + F2) / C
 factor_2 = (F1 * F2) / (F2 - F1) / C
 DIFF_TEC_MAX = 0.05
 LIMIT_STD = 7.5
+MAX_GAP = 15
 
-plot_it = True
+PLOTS = 'quicklook'
+PLOTS_FOLDER = 'plots'
+PLOT_WORKERS = 1
+PLOT_MAX_PENDING = 64
+PLOT_MAX_POINTS = 4000
+
+KERNEL_BACKEND = 'auto'
+ARC_WORKERS = os.cpu_count() or 1
+WORKERS = 1
+PRN_WORKERS = 1
+# memory (MB) for the measures of a rinex checked at once, per process: above it, the rinex is read and checked by
+# satellites groups (see CycleSlip._check_groups). None to check every rinex at once
+MEMORY_BUDGET_MB = None
+# folder where a rinex checked by satellites groups is decoded once (see rinex.RinexObsReader.spill), None for the
+# system temporary folder. It should be on disk, not in memory (e.g. tmpfs)
+SPILL_FOLDER = None
+
+# decoded observations kept on disk (see cache.ObservationCache), for files checked again (e.g. reprocessing with
+# other settings). Off by default: a single run over each file only pays the checksum and the copy. -cache on
+use_cache = False
+CACHE_FOLDER = os.path.join(os.path.expanduser('~'), '.cycle_slip', 'cache')
+CACHE_MAX_SIZE = 10 * 1024 ** 3
 
 REQUIRED_VERSION = 3.01
 
+PRESCAN_WORKERS = 8
+
+LEASE_SECONDS = 600
+QUEUE_POLL_SECONDS = 5
+QUEUE_MAX_ATTEMPTS = 3
+
+WATCH_POLL_SECONDS = 60
+WATCH_SETTLE_SECONDS = 30
+WATCH_MAX_BATCH = 50
+
+DAEMON_SOCKET = os.path.join(os.path.expanduser('~'), '.cycle_slip', 'daemon.sock')
+DAEMON_WORKERS = 2
+
+GLONASS_FACTORS_CACHE_SIZE = 64
+GLONASS_CHANNELS_DB = os.path.join(os.path.expanduser('~'), '.cycle_slip', 'glonass_channels.npz')
+GLONASS_CHANNELS_FOLDER = os.path.join(os.path.expanduser('~'), '.cycle_slip', 'glonasschannel')
+GLONASS_CHANNELS_DOWNLOAD = False
+
 CONSTELLATIONS = ['G', 'R']
+# the carrier frequencies (Hz) of the two signals combined in each constellation (the L1 and L2 columns of
+# COLUMNS_IN_RINEX), then a new constellation only needs its entry here and its columns. None for frequencies per
+# channel (GLONASS FDMA), taken from the GLONASS channels of each slot (see glonass.GlonassFactors)
+FREQUENCIES = {'G': (F1, F2),
+               'R': None,
+               'E': (1.57542e9, 1.17645e9),
+               'C': (1.561098e9, 1.20714e9),
+               'J': (F1, F2)}
+# the BeiDou B1I code is 'C2I'/'L2I' in RINEX 3.01 and 3.03, but 'C1I'/'L1I' in RINEX 3.02
 COLUMNS_IN_RINEX = {'3.03': {'G': {'L1': 'L1C', 'L2': 'L2W', 'C1': 'C1C', 'P1': 'C1W', 'P2': 'C2W'},
-                             'R': {'L1': 'L1C', 'L2': 'L2C', 'C1': 'C1C', 'P1': 'C1P', 'P2': 'C2P'}
+                             'R': {'L1': 'L1C', 'L2': 'L2C', 'C1': 'C1C', 'P1': 'C1P', 'P2': 'C2P'},
+                             'E': {'L1': 'L1C', 'L2': 'L5Q', 'C1': 'C1C', 'P1': 'C1C', 'P2': 'C5Q'},
+                             'C': {'L1': 'L2I', 'L2': 'L7I', 'C1': 'C2I', 'P1': 'C2I', 'P2': 'C7I'},
+                             'J': {'L1': 'L1C', 'L2': 'L2L', 'C1': 'C1C', 'P1': 'C1C', 'P2': 'C2L'}
                              },
                     '3.02': {'G': {'L1': 'L1', 'L2': 'L2', 'C1': 'C1C', 'P1': 'C1W', 'P2': 'C2W'},
-                             'R': {'L1': 'L1', 'L2': 'L2', 'C1': 'C1C', 'P1': 'C1P', 'P2': 'C2P'}
+                             'R': {'L1': 'L1', 'L2': 'L2', 'C1': 'C1C', 'P1': 'C1P', 'P2': 'C2P'},
+                             'E': {'L1': 'L1C', 'L2': 'L5Q', 'C1': 'C1C', 'P1': 'C1C', 'P2': 'C5Q'},
+                             'C': {'L1': 'L1I', 'L2': 'L7I', 'C1': 'C1I', 'P1': 'C1I', 'P2': 'C7I'},
+                             'J': {'L1': 'L1C', 'L2': 'L2L', 'C1': 'C1C', 'P1': 'C1C', 'P2': 'C2L'}
                              },
                     '3.01': {'G': {'L1': 'L1', 'L2': 'L2', 'C1': 'C1C', 'P1': 'C1W', 'P2': 'C2W'},
-                             'R': {'L1': 'L1', 'L2': 'L2', 'C1': 'C1C', 'P1': 'C1P', 'P2': 'C2P'}
+                             'R': {'L1': 'L1', 'L2': 'L2', 'C1': 'C1C', 'P1': 'C1P', 'P2': 'C2P'},
+                             'E': {'L1': 'L1C', 'L2': 'L5Q', 'C1': 'C1C', 'P1': 'C1C', 'P2': 'C5Q'},
+                             'C': {'L1': 'L2I', 'L2': 'L7I', 'C1': 'C2I', 'P1': 'C2I', 'P2': 'C7I'},
+                             'J': {'L1': 'L1C', 'L2': 'L2L', 'C1': 'C1C', 'P1': 'C1C', 'P2': 'C2L'}
                              }
                     }
@@ -0,0 +1,115 @@
+import contextlib
+import inspect
+
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+class SharedArrays:
+    """
+    NumPy arrays placed in shared memory, once, by the main process. Worker processes attach to them by name (see
+    SharedArrays.spec) and work over views of the same memory: no array is pickled, copied or sent to them
+    """
+    def __init__(self, blocks, arrays, owner):
+        """
+        :param blocks: Python dict with the name of the array as key and its SharedMemory block as value
+        :param arrays: Python dict with the name of the array as key and its view (over the block) as value
+        :param owner: True if the blocks were created here, and then must be released (unlinked) here
+        """
+        self.blocks = blocks
+        self.arrays = arrays
+        self.owner = owner
+
+    @classmethod
+    def create(cls, arrays):
+        """
+        :param arrays: Python dict with the name of the array as key and the array as value
+        :return: The SharedArrays object, with a copy of each array in shared memory
+        """
+        blocks, views = {}, {}
+        try:
+            for name, values in arrays.items():
+                values = np.asarray(values)
+                blocks[name] = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+                views[name] = np.ndarray(values.shape, dtype=values.dtype, buffer=blocks[name].buf)
+                views[name][...] = values
+        except BaseException:
+            cls(blocks, views, True).close()
+            raise
+
+        return cls(blocks, views, True)
+
+    @property
+    def spec(self):
+        """
+        :return: What a worker process needs to attach to the arrays (see SharedArrays.attach)
+        """
+        return {name: (self.blocks[name].name, values.shape, values.dtype.str) for name, values in self.arrays.items()}
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        Attach to the blocks of the main process, without registering them in the resource tracker: they belong to
+        the main process, which removes them (see close). The tracker process is shared with the main process, then
+        unregistering them after the attach would drop the registration of the main process as well
+
+        :param spec: The SharedArrays.spec of the main process
+        :return: The SharedArrays object, with views over the same memory of the main process
+        """
+        blocks, views = {}, {}
+        for name, (block_name, shape, dtype) in spec.items():
+            blocks[name] = _attach_block(block_name)
+            views[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+
+        return cls(blocks, views, False)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Release the views and the blocks (which are also removed, if created here)
+
+        :return: None
+        """
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self.blocks = {}
+
+        return None
+
+
+def _attach_block(name):
+    """
+    :param name: The name of a shared memory block
+    :return: The SharedMemory block, not registered in the resource tracker (track=False, from Python 3.13 on)
+    """
+    if 'track' in inspect.signature(shared_memory.SharedMemory).parameters:
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    with _untracked():
+        return shared_memory.SharedMemory(name=name)
+
+
+@contextlib.contextmanager
+def _untracked():
+    """
+    Skip the registration of the shared memory blocks in the resource tracker, while attaching to them (a worker
+    process attaches in its initializer, before any other thread)
+    """
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None if rtype == 'shared_memory' else register(name, rtype)
+    try:
+        yield
+    finally:
+        resource_tracker.register = register
@@ -0,0 +1,503 @@
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import zlib
+
+import numpy as np
+
+
+class ChunkedArray:
+    """
+    A (epoch x sv) matrix of a day in the store, kept in chunks of rows (epochs), each one compressed on its own: the
+    bytes of the values are shuffled (the 1st byte of every value, then the 2nd, ...), which groups the sign and the
+    exponent of the float64 values, before zlib. Slicing rows only reads and decompresses the chunks of the slice
+        <name>.chunks: the compressed chunks, one after the other
+        <name>.offsets.npy: where each chunk starts in <name>.chunks (and where the last one ends)
+    The file is opened once (see StationStore._load), then the chunks are still read after the day is appended
+    """
+    def __init__(self, path, shape, dtype, chunk_rows):
+        """
+        :param path: Absolute path to the .chunks file
+        :param shape: The shape of the matrix (epochs, sv)
+        :param dtype: The dtype of the matrix
+        :param chunk_rows: Number of rows of each chunk (but the last one)
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_rows = chunk_rows
+        self._offsets = np.load(path[:-len('.chunks')] + '.offsets.npy')
+        self._fd = open(path, mode='rb')
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.step in (None, 1):
+            return self.rows(*key.indices(len(self))[:2])
+
+        return self.rows(0, len(self))[key]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.rows(0, len(self))
+        return values if dtype is None else values.astype(dtype)
+
+    def rows(self, start, stop):
+        """
+        :param start: The first row
+        :param stop: The row after the last one
+        :return: The (stop - start) x sv matrix, with only the chunks of the rows decompressed
+        """
+        stop = max(start, stop)
+        values = np.empty((stop - start, self.shape[1]), dtype=self.dtype)
+
+        for chunk in range(start // self.chunk_rows, -(-stop // self.chunk_rows)):
+            first = chunk * self.chunk_rows
+            size = int(self._offsets[chunk + 1] - self._offsets[chunk])
+            block = _decode(os.pread(self._fd.fileno(), size, int(self._offsets[chunk])), self.dtype, self.shape[1])
+            begin, end = max(start, first), min(stop, first + len(block))
+            values[begin - start:end - start] = block[begin - first:end - first]
+
+        return values
+
+    def close(self):
+        self._fd.close()
+
+    @staticmethod
+    def write(path, values, chunk_rows):
+        """
+        Compress a matrix chunk by chunk: only a chunk of rows of values is taken (and held in memory) at a time
+
+        :param path: Absolute path to the .chunks file
+        :param values: The matrix, or any object sliced by rows (e.g. a memory-map, see StationStore._merge)
+        :param chunk_rows: Number of rows of each chunk
+        :return: None
+        """
+        offsets = [0]
+        with open(path, mode='wb') as fd:
+            for first in range(0, len(values), chunk_rows):
+                offsets.append(offsets[-1] + fd.write(_encode(np.asarray(values[first:first + chunk_rows]))))
+        np.save(path[:-len('.chunks')] + '.offsets.npy', np.array(offsets, dtype=np.int64))
+
+        return None
+
+
+def _encode(block):
+    """
+    :param block: A chunk of rows
+    :return: The shuffled bytes of the chunk, compressed
+    """
+    block = np.ascontiguousarray(block)
+    return zlib.compress(block.view(np.uint8).reshape(-1, block.dtype.itemsize).T.tobytes(), 1)
+
+
+def _decode(data, dtype, columns):
+    """
+    :param data: A compressed chunk (see _encode)
+    :param dtype: The dtype of the matrix
+    :param columns: Number of columns of the matrix
+    :return: The chunk of rows
+    """
+    shuffled = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(shuffled.T).view(dtype).reshape(-1, columns)
+
+
+class _Merged:
+    """
+    A matrix of a day merged with the one of a rinex (see StationStore._merge), built a chunk of rows at a time, as
+    it is sliced (see ChunkedArray.write)
+    """
+    def __init__(self, shape, rows, columns, values, new_rows, new_columns, new_values, fill):
+        """
+        :param shape: The shape of the merged matrix
+        :param rows: The rows of values in the merged matrix (sorted)
+        :param columns: The columns of values in the merged matrix
+        :param values: The matrix of the day, or any object sliced by rows
+        :param new_rows: The rows of new_values in the merged matrix (sorted)
+        :param new_columns: The columns of new_values in the merged matrix
+        :param new_values: The matrix of the rinex, or any object sliced by rows
+        :param fill: The value where neither has a value
+        """
+        self.shape = shape
+        self.dtype = np.dtype(values.dtype)
+        self._old = (rows, columns, values)
+        self._new = (new_rows, new_columns, new_values)
+        self._fill = fill
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(len(self))
+        block = np.full((max(stop - start, 0), self.shape[1]), self._fill, dtype=self.dtype)
+
+        # the epochs of the rinex replace the whole rows
+        for (rows, columns, values), whole_rows in ((self._old, False), (self._new, True)):
+            first, last = np.searchsorted(rows, start), np.searchsorted(rows, stop)
+            if whole_rows:
+                block[rows[first:last] - start] = self._fill
+            block[np.ix_(rows[first:last] - start, columns)] = values[first:last]
+
+        return block
+
+
+class _Rows:
+    """
+    A block of rows of a matrix, or of any object sliced by rows, sliced only when it is sliced itself
+    """
+    def __init__(self, values, rows):
+        """
+        :param values: The matrix, or any object sliced by rows
+        :param rows: The slice of rows of the block
+        """
+        self.dtype = np.dtype(values.dtype)
+        self._values = values
+        self._start, self._stop, _ = rows.indices(len(values))
+
+    def __len__(self):
+        return max(self._stop - self._start, 0)
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(len(self))
+        return self._values[self._start + start:self._start + max(start, stop)]
+
+
+class StationStore:
+    """
+    Columnar store of the results of a station, kept in a folder per station, with a folder per day appended as the
+    days are checked:
+        <folder>/<station>/<yyyy>-<ddd>/<version>/{time,sv}.npy
+        <folder>/<station>/<yyyy>-<ddd>/<version>/{rtec,rtec_corrected,mwlc,slips}.chunks (see ChunkedArray)
+    Each day holds its epochs (time), its satellites (sv) and a (epoch x sv) matrix per variable (see
+    StationStore.variables), in compressed chunks of chunk_rows epochs. A reader only opens the days of the time
+    slice asked for, and only the variables asked for, and decompresses only the chunks of the epochs sliced (see
+    StationStore.read), with no need to load the whole years. Appending to a day writes its next version, a chunk at
+    a time, which replaces the previous one at once (a rename), then a reader never sees a day partially written
+    """
+    variables = ('rtec', 'rtec_corrected', 'mwlc', 'slips')
+    chunk_rows = 1024
+    _day = re.compile(r'^(\d{4})-(\d{3})$')
+    _lock = '.lock'
+    _meta = 'meta.json'
+
+    def __init__(self, folder, station):
+        """
+        :param folder: The store folder, with a folder per station (created if it does not exist)
+        :param station: The station name (e.g. 'ALMA')
+        """
+        self.folder = os.path.join(folder, station.upper())
+        self.station = station.upper()
+
+        os.makedirs(self.folder, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self, shared=False):
+        with open(os.path.join(self.folder, self._lock), mode='a+') as fd:
+            fcntl.lockf(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+
+    def _day_path(self, day):
+        year = day.astype('datetime64[Y]')
+        doy = (day - year.astype('datetime64[D]')).astype(np.int64) + 1
+        return os.path.join(self.folder, '{}-{:03d}'.format(year, doy))
+
+    @staticmethod
+    def _versions(path):
+        """
+        :param path: The folder of a day
+        :return: List with the versions of the day (complete ones only), sorted
+        """
+        if not os.path.isdir(path):
+            return []
+
+        return sorted(int(name) for name in os.listdir(path) if name.isdigit())
+
+    @property
+    def days(self):
+        """
+        :return: Array datetime64[D] with the days in the store, sorted
+        """
+        days = []
+        for name in os.listdir(self.folder):
+            match = self._day.match(name)
+            if match and self._versions(os.path.join(self.folder, name)):
+                year, doy = match.groups()
+                days.append(np.datetime64(year, 'D') + np.timedelta64(int(doy) - 1, 'D'))
+
+        return np.array(sorted(days), dtype='datetime64[D]')
+
+    def _load(self, day, variables):
+        """
+        :param day: The day (datetime64[D])
+        :param variables: The variables to be loaded
+        :return: The time, the sv (memory-mapped, read-only) and a Python dict with the (epoch x sv) matrix of each
+            variable of the day (see ChunkedArray, which must be closed)
+        """
+        path = self._day_path(day)
+        path = os.path.join(path, str(self._versions(path)[-1]))
+        with open(os.path.join(path, self._meta), mode='r') as fd:
+            meta = json.load(fd)
+
+        time = np.load(os.path.join(path, 'time.npy'), mmap_mode='r')
+        sv = np.load(os.path.join(path, 'sv.npy'), mmap_mode='r')
+        values = {name: ChunkedArray(os.path.join(path, name + '.chunks'), (len(time), len(sv)), meta['dtypes'][name],
+                                     meta['chunk_rows']) for name in variables}
+
+        return time, sv, values
+
+    def _save(self, day, time, sv, values):
+        """
+        Write the next version of a day (in a temporary folder, then renamed), removing the previous ones. The
+        readers of a previous version keep their open files
+
+        :param day: The day (datetime64[D])
+        :param time: The epochs of the day
+        :param sv: The satellites of the day
+        :param values: Python dict with the (epoch x sv) matrix of each variable, or any object sliced by rows (see
+            ChunkedArray.write)
+        :return: None
+        """
+        path = self._day_path(day)
+        versions = self._versions(path)
+        version = os.path.join(path, str(versions[-1] + 1 if versions else 0))
+
+        temporary = '{}.tmp-{}-{}'.format(version, socket.gethostname(), os.getpid())
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        np.save(os.path.join(temporary, 'time.npy'), time)
+        np.save(os.path.join(temporary, 'sv.npy'), sv)
+        for name, matrix in values.items():
+            ChunkedArray.write(os.path.join(temporary, name + '.chunks'), matrix, self.chunk_rows)
+        with open(os.path.join(temporary, self._meta), mode='w') as fd:
+            json.dump({'chunk_rows': self.chunk_rows,
+                       'dtypes': {name: np.dtype(matrix.dtype).str for name, matrix in values.items()}}, fd)
+        os.rename(temporary, version)
+
+        for name in os.listdir(path):
+            if os.path.join(path, name) != version:
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+        return None
+
+    @staticmethod
+    def _merge(time, sv, values, new_time, new_sv, new_values):
+        """
+        Merge two sets of epochs and satellites. Where both have the same epoch, the new values replace the old ones.
+        The merged matrices are built a chunk of rows at a time, as they are written (see ChunkedArray.write)
+
+        :return: The time, the sv and a Python dict with the (epoch x sv) matrix of each variable, merged
+        """
+        merged_time = np.union1d(time, new_time)
+        merged_sv = np.union1d(sv, new_sv)
+        rows, new_rows = np.searchsorted(merged_time, time), np.searchsorted(merged_time, new_time)
+        columns, new_columns = np.searchsorted(merged_sv, sv), np.searchsorted(merged_sv, new_sv)
+
+        merged = {}
+        for name in values:
+            fill = False if values[name].dtype == bool else np.nan
+            merged[name] = _Merged((len(merged_time), len(merged_sv)), rows, columns, values[name], new_rows,
+                                   new_columns, new_values[name], fill)
+
+        return merged_time, merged_sv, merged
+
+    def append(self, time, sv, results):
+        """
+        Append the results of a rinex, split by day. Days already in the store are merged: the epochs of the rinex
+        replace the ones already stored (then checking a rinex again gives the same store)
+
+        :param time: Array datetime64[ns] with the epochs of the rinex
+        :param sv: Array with the satellites names, sorted
+        :param results: Python dict with the (epoch x sv) matrices of the results (see
+            CycleSlip._detect_and_correct_arcs), or any object sliced by rows (see SpilledResults): they are taken a
+            chunk of rows at a time
+        :return: The number of days written
+        """
+        time = np.asarray(time, dtype='datetime64[ns]')
+        sv = np.asarray(sv, dtype=str)
+        days = time.astype('datetime64[D]')
+
+        with self._locked():
+            for day in np.unique(days):
+                # the epochs are sorted: the rows of a day are a block
+                rows = slice(np.searchsorted(days, day, side='left'), np.searchsorted(days, day, side='right'))
+                day_time, day_sv = time[rows], sv
+                values = {name: _Rows(results[name], rows) for name in self.variables}
+
+                if not self._versions(self._day_path(day)):
+                    self._save(day, day_time, day_sv, values)
+                    continue
+
+                stored_time, stored_sv, stored = self._load(day, self.variables)
+                try:
+                    self._save(day, *self._merge(np.array(stored_time), np.array(stored_sv), stored, day_time,
+                                                 day_sv, values))
+                finally:
+                    for matrix in stored.values():
+                        matrix.close()
+
+        logging.info(">>>> Results of {} saved in {} ({} days)".format(self.station, self.folder,
+                                                                     len(np.unique(days))))
+        return len(np.unique(days))
+
+    def read(self, start=None, end=None, sv=None, variables=None):
+        """
+        Read a slice of the store, by time and satellite
+
+        :param start: The first epoch (e.g. '2018-06-01' or datetime64), from the first day in the store by default
+        :param end: The epoch after the last one (e.g. '2018-06-02T12:00'), up to the last day in the store by default
+        :param sv: List of satellites names (e.g. ['G01', 'R24']), all by default
+        :param variables: List of variables (see StationStore.variables), all by default
+        :return: The time (datetime64[ns]), the sv and a Python dict with the (epoch x sv) matrix of each variable,
+            with NaN (or False) where a satellite has no measure
+        """
+        variables = list(variables or self.variables)
+        start = np.datetime64(start, 'ns') if start is not None else None
+        end = np.datetime64(end, 'ns') if end is not None else None
+
+        days = self.days
+        if start is not None:
+            days = days[days >= start.astype('datetime64[D]')]
+        if end is not None:
+            days = days[days <= end.astype('datetime64[D]')]
+
+        parts = []
+        for day in days:
+            # the lock only while the files are opened: they are still read if the day is appended meanwhile
+            with self._locked(shared=True):
+                day_time, day_sv, day_values = self._load(day, variables)
+
+            # the epochs of a day are sorted: the slice is a block of rows, then only its chunks are decompressed
+            rows = slice(np.searchsorted(day_time, start) if start is not None else 0,
+                         np.searchsorted(day_time, end) if end is not None else len(day_time))
+            columns = np.flatnonzero(np.isin(day_sv, sv)) if sv is not None else slice(None)
+
+            parts.append((np.array(day_time[rows]), np.array(day_sv[columns]),
+                          {name: day_values[name][rows][:, columns] for name in variables}))
+            for matrix in day_values.values():
+                matrix.close()
+
+        # the days do not overlap: the slice is their concatenation, over the satellites of all of them
+        time = np.concatenate([np.array([], dtype='datetime64[ns]')] + [part[0] for part in parts])
+        all_sv = np.unique(np.concatenate([np.array([], dtype=str)] + [part[1] for part in parts]))
+        values = {}
+        for name in variables:
+            fill = False if name == 'slips' else np.nan
+            values[name] = np.full((len(time), len(all_sv)), fill, dtype=bool if name == 'slips' else np.float64)
+
+        row = 0
+        for day_time, day_sv, day_values in parts:
+            columns = np.searchsorted(all_sv, day_sv)
+            for name in variables:
+                values[name][row:row + len(day_time), columns] = day_values[name]
+            row += len(day_time)
+
+        return time, all_sv, values
+
+    def __str__(self):
+        days = self.days
+        if not len(days):
+            return "Station store {}: empty".format(self.folder)
+
+        return "Station store {}: {} days, from {} to {}".format(self.folder, len(days), days[0], days[-1])
+
+
+class SpilledResults:
+    """
+    The (epoch x sv) matrices of the results of a rinex checked by groups of consecutive satellites (see
+    CycleSlip._check_groups), kept on disk until they are appended to the store at once: a file per variable, with
+    the epochs of each satellite in a row (sv x epoch), written a group at a time (see write) and read a chunk of
+    epochs at a time (see StationStore.append), then neither of them holds the whole matrices in memory
+    """
+    def __init__(self, folder, epochs, sv, variables=StationStore.variables):
+        """
+        :param folder: The folder of the files (e.g. a temporary one)
+        :param epochs: The number of epochs of the rinex
+        :param sv: Array with all the satellites names of the rinex, sorted
+        :param variables: The variables kept (see StationStore.variables)
+        """
+        self.folder = folder
+        self.epochs = epochs
+        self.sv = np.asarray(sv)
+        self.variables = variables
+        self._matrices = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getitem__(self, name):
+        return self._matrices[name]
+
+    def write(self, sv, results):
+        """
+        :param sv: Array with consecutive satellites names of the rinex (a group)
+        :param results: Python dict with the (epoch x sv) matrices of the results of the group
+        :return: None
+        """
+        start = int(np.searchsorted(self.sv, sv[0])) if len(sv) else 0
+        for name in self.variables:
+            if name not in self._matrices:
+                self._matrices[name] = _SatelliteRows(os.path.join(self.folder, name + '.results'),
+                                                      (self.epochs, len(self.sv)), results[name].dtype)
+            self._matrices[name].write(start, results[name])
+
+        return None
+
+    def close(self):
+        for matrix in self._matrices.values():
+            matrix.close()
+        self._matrices = {}
+
+
+class _SatelliteRows:
+    """
+    A (epoch x sv) matrix kept on disk by satellite (sv x epoch): written by blocks of satellites and read by blocks
+    of epochs (see SpilledResults)
+    """
+    def __init__(self, path, shape, dtype):
+        """
+        :param path: Absolute path to the file (created)
+        :param shape: The shape of the matrix (epochs, sv)
+        :param dtype: The dtype of the matrix
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def write(self, start, values):
+        """
+        :param start: The column of the first satellite of values
+        :param values: The (epoch x sv) matrix of consecutive satellites
+        :return: None
+        """
+        rows = np.ascontiguousarray(np.asarray(values, dtype=self.dtype).T)
+        os.pwrite(self._fd, rows.tobytes(), start * self.shape[0] * self.dtype.itemsize)
+
+        return None
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(len(self))
+        stop = max(start, stop)
+        size = (stop - start) * self.dtype.itemsize
+
+        block = np.empty((self.shape[1], stop - start), dtype=self.dtype)
+        for k in range(self.shape[1]):
+            offset = (k * self.shape[0] + start) * self.dtype.itemsize
+            block[k] = np.frombuffer(os.pread(self._fd, size, offset), dtype=self.dtype)
+
+        return block.T
+
+    def close(self):
+        os.close(self._fd)
@@ -0,0 +1,289 @@
+import os
+
+import numpy as np
+
+import rinex
+import settings as settings
+
+# slot -> frequency channel of the GLONASS constellation (2018)
+GLONASS_CHANNELS = {1: 1, 2: -4, 3: 5, 4: 6, 5: 1, 6: -4, 7: 5, 8: 6, 9: -2, 10: -7, 11: 0, 12: -1, 13: -2, 14: -7,
+                    15: 0, 16: -1, 17: 4, 18: -3, 19: 3, 20: 2, 21: 4, 22: -3, 23: 3, 24: 2}
+
+# observables written per system, in the order of the 'SYS / # / OBS TYPES' records (see settings.COLUMNS_IN_RINEX)
+OBS_TYPES = {'G': ['C1C', 'L1C', 'C2W', 'L2W'], 'R': ['C1C', 'L1C', 'C2P', 'L2C'], 'E': ['C1C', 'L1C', 'C5Q', 'L5Q'],
+             'C': ['C2I', 'L2I', 'C7I', 'L7I'], 'J': ['C1C', 'L1C', 'C2L', 'L2L']}
+
+
+class SyntheticRinex:
+    """
+    Synthetic GPS/GLONASS (and Galileo, BeiDou, QZSS) observations (L1, L2, C1, P2) of a day, with a known set of
+    cycle-slips, given either as arrays (see SyntheticRinex.observations) or as a RINEX 3.03 file (see
+    SyntheticRinex.write). Each satellite has:
+        - a pass geometry: the range and the elevation follow the orbital period, and the satellite is tracked (in
+            arcs of some hours) while above the elevation mask
+        - a slant TEC: a diurnal vertical TEC, scaled by the elevation mapping function
+        - phase (cycles, with an integer ambiguity) and code (meters) noise
+        - data holes (see gaps) and cycle-slips (see slips), added to L1 and L2 from the slip epoch on
+    The measures are rounded to the 3 decimals of the rinex, then the arrays and the file give the same values
+    """
+    _periods = {'G': 43082.0, 'R': 40544.0, 'E': 50680.0, 'C': 46400.0, 'J': 86164.0}
+
+    def __init__(self, rate=30, duration=24, gps=8, glonass=4, gaps=2, gap_length=(60, 1800), slips=2,
+                 margin=20, station='SYNT', date='2018-06-01', seed=0, galileo=0, beidou=0, qzss=0):
+        """
+        :param rate: The sample rate, in seconds (e.g. 30, 15 or 1)
+        :param duration: The hours of observations, from the beginning of the day
+        :param gps: Number of GPS satellites (G01, G02, ...)
+        :param glonass: Number of GLONASS satellites (R01, R02, ...)
+        :param gaps: Number of data holes per satellite, at random epochs where it is tracked
+        :param gap_length: The shortest and the longest data hole, in seconds (holes longer than settings.MAX_GAP
+            split the arcs)
+        :param slips: Number of cycle-slips per satellite, or a list of (sv, epoch index, cycles L1, cycles L2)
+        :param margin: The cycle-slips (drawn at random) are at least margin epochs away from the beginning and the
+            end of each run of continuous measures, and from each other
+        :param station: The station name (4 letters)
+        :param date: The day of the observations
+        :param seed: The random seed, then the same arguments give the same observations
+        :param galileo: Number of Galileo satellites (E01, E02, ...)
+        :param beidou: Number of BeiDou satellites (C01, C02, ...)
+        :param qzss: Number of QZSS satellites (J01, J02, ...)
+        """
+        self.rate = rate
+        self.duration = duration
+        self.station = station.upper()
+        self.date = np.datetime64(date, 'D')
+        self.margin = margin
+
+        self._random = np.random.RandomState(seed)
+        self.sv = np.array(['%s%02d' % (system, k + 1) for system, count in
+                            (('G', gps), ('R', glonass), ('E', galileo), ('C', beidou), ('J', qzss))
+                            for k in range(count)])
+        self.time = self.date.astype('datetime64[ns]') + \
+            (np.arange(int(duration * 3600 // rate)) * rate * 1e9).astype('timedelta64[ns]')
+        self._phases = np.arange(len(self.sv)) * 2 * np.pi / max(len(self.sv), 1) + \
+            self._random.uniform(0, 0.5, len(self.sv))
+
+        self.tracked = self._tracking(gaps, gap_length)
+        self.slips = self._slips(slips) if np.ndim(slips) == 0 else [tuple(slip) for slip in slips]
+        self.data = self._measures()
+
+    @property
+    def frequencies(self):
+        """
+        :return: Arrays with F1 and F2 of each satellite, from the constellations registry (see settings.FREQUENCIES)
+            and, for GLONASS, from the channel of each slot
+        """
+        channels = np.array([GLONASS_CHANNELS[int(prn[1:])] if prn[0] == 'R' else 0 for prn in self.sv])
+        glonass = np.array([prn[0] == 'R' for prn in self.sv])
+        registry = np.array([settings.FREQUENCIES[prn[0]] or (np.nan, np.nan) for prn in self.sv]).reshape(-1, 2)
+
+        f1 = np.where(glonass, 1602.0e+6 + channels * 562500.0, registry[:, 0])
+        f2 = np.where(glonass, 1246.0e+6 + channels * 437500.0, registry[:, 1])
+        return f1, f2
+
+    def _elevation(self):
+        """
+        :return: The (epoch x sv) matrix with the sine of the elevation of each satellite
+        """
+        seconds = (self.time - self.date).astype(np.int64) / 1e9
+        periods = np.array([self._periods[prn[0]] for prn in self.sv])
+        return np.sin(2 * np.pi * seconds[:, None] / periods + self._phases)
+
+    def _tracking(self, gaps, gap_length):
+        """
+        :return: The (epoch x sv) boolean matrix, True where the satellite is tracked (above the mask, out of holes)
+        """
+        tracked = self._elevation() > 0.1
+        lengths = np.asarray(gap_length) // self.rate
+
+        for k in range(len(self.sv)):
+            epochs = np.flatnonzero(tracked[:, k])
+            if not len(epochs):
+                continue
+
+            for start in self._random.choice(epochs, size=min(gaps, len(epochs)), replace=False):
+                tracked[start:start + self._random.randint(max(lengths[0], 1), max(lengths[1], 1) + 1), k] = False
+
+        return tracked
+
+    def _slips(self, count):
+        """
+        Draw the cycle-slips of each satellite, inside its runs of continuous measures. The cycles of L1 and L2 are
+        drawn until the jump of the relative TEC is at least 10 times settings.DIFF_TEC_MAX
+
+        :param count: Number of cycle-slips per satellite
+        :return: List of (sv, epoch index, cycles L1, cycles L2), sorted by satellite and epoch
+        """
+        f1, f2 = self.frequencies
+        slips = []
+
+        for k, prn in enumerate(self.sv):
+            # epochs at least margin epochs inside a run of continuous measures
+            column = np.concatenate(([False], self.tracked[:, k], [False])).astype(np.int8)
+            starts, ends = np.flatnonzero(np.diff(column) == 1), np.flatnonzero(np.diff(column) == -1)
+            candidates = np.concatenate([np.arange(start + self.margin, end - self.margin)
+                                         for start, end in zip(starts, ends)] + [np.array([], dtype=np.int64)])
+
+            chosen = []
+            for epoch in self._random.permutation(candidates):
+                if len(chosen) == count:
+                    break
+                if all(abs(epoch - other) >= self.margin for other in chosen):
+                    chosen.append(int(epoch))
+
+            for epoch in sorted(chosen):
+                while True:
+                    cycles_1, cycles_2 = self._random.randint(-9, 10, size=2)
+                    if abs((cycles_1 / f1[k] - cycles_2 / f2[k]) * settings.C) >= 10 * settings.DIFF_TEC_MAX:
+                        break
+                slips.append((prn, epoch, int(cycles_1), int(cycles_2)))
+
+        return slips
+
+    def _measures(self):
+        """
+        :return: Python dict with the observable code (see OBS_TYPES) as key and the (epoch x sv) matrix as value,
+            with NaN where the satellite is not tracked
+        """
+        f1, f2 = self.frequencies
+        elevation = self._elevation()
+        seconds = (self.time - self.date).astype(np.int64)[:, None] / 1e9
+        shape = elevation.shape
+
+        distance = 2.02e7 + 5.5e6 * (1 - np.clip(elevation, 0, 1))
+        mapping = 1 / np.sqrt(1 - (0.95 * np.cos(np.arcsin(np.clip(elevation, 0, 1)))) ** 2)
+        vertical_tec = 12 + 10 * np.sin(2 * np.pi * (seconds - 6 * 3600) / 86400)
+        delay_1 = settings.A * vertical_tec * mapping * settings.TECU / f1 ** 2
+        delay_2 = settings.A * vertical_tec * mapping * settings.TECU / f2 ** 2
+
+        ambiguity = self._random.randint(-10 ** 6, 10 ** 6, size=(2, len(self.sv)))
+        l1 = (distance - delay_1) * f1 / settings.C + ambiguity[0] + self._random.normal(0, 0.003, shape)
+        l2 = (distance - delay_2) * f2 / settings.C + ambiguity[1] + self._random.normal(0, 0.003, shape)
+        c1 = distance + delay_1 + self._random.normal(0, 0.3, shape)
+        p2 = distance + delay_2 + self._random.normal(0, 0.3, shape)
+
+        column = {prn: k for k, prn in enumerate(self.sv)}
+        for prn, epoch, cycles_1, cycles_2 in self.slips:
+            l1[epoch:, column[prn]] += cycles_1
+            l2[epoch:, column[prn]] += cycles_2
+
+        data = {}
+        for system, obs_types in self._obs_types.items():
+            for code, values in zip(obs_types, (c1, l1, p2, l2)):
+                matrix = data.setdefault(code, np.full(shape, np.nan))
+                columns = np.array([prn[0] == system for prn in self.sv])
+                matrix[:, columns] = np.round(values[:, columns], 3)
+
+        for matrix in data.values():
+            matrix[~self.tracked] = np.nan
+
+        return data
+
+    @property
+    def _obs_types(self):
+        """
+        :return: The observables written (see OBS_TYPES) of GPS and GLONASS, and of the other systems with satellites
+        """
+        systems = {prn[0] for prn in self.sv} | {'G', 'R'}
+        return {system: obs_types for system, obs_types in OBS_TYPES.items() if system in systems}
+
+    @property
+    def truth(self):
+        """
+        :return: The (epoch x sv) boolean matrix, True where a cycle-slip was injected
+        """
+        truth = np.zeros(self.tracked.shape, dtype=bool)
+        column = {prn: k for k, prn in enumerate(self.sv)}
+        for prn, epoch, _, _ in self.slips:
+            truth[epoch, column[prn]] = True
+
+        return truth
+
+    @property
+    def file_name(self):
+        """
+        :return: The rinex 3 long name (e.g. SYNT00BRA_R_20181520000_01D_30S_MO.rnx)
+        """
+        year = self.date.astype('datetime64[Y]')
+        doy = (self.date - year.astype('datetime64[D]')).astype(np.int64) + 1
+        period = '{:02d}D'.format(int(self.duration // 24)) if self.duration % 24 == 0 else \
+            '{:02d}H'.format(int(self.duration))
+        rate = '{:02d}S'.format(self.rate) if self.rate < 60 else '{:02d}M'.format(self.rate // 60)
+
+        return '{}00BRA_R_{}{:03d}0000_{}_{}_MO.rnx'.format(self.station, year, doy, period, rate)
+
+    def _glonass_slots(self):
+        """
+        :return: List with the content (60 characters) of each 'GLONASS SLOT / FRQ #' record
+        """
+        glonass = [prn for prn in self.sv if prn[0] == 'R']
+        slots = ['{} {:2d} '.format(prn, GLONASS_CHANNELS[int(prn[1:])]) for prn in glonass]
+
+        return ['{:<60}'.format(('{:3d} '.format(len(glonass)) if i == 0 else '    ') + ''.join(slots[i:i + 8]))
+                for i in range(0, max(len(slots), 1), 8)]
+
+    def _header(self):
+        """
+        :return: The rinex 3.03 header (text)
+        """
+        def record(content, label):
+            return '{:<60}{:<20}\n'.format(content, label)
+
+        def epoch(time):
+            date = str(time.astype('datetime64[us]'))
+            return '{}  {}  {}  {}  {}  {:10.7f}     GPS'.format(date[0:4], date[5:7], date[8:10], date[11:13],
+                                                                 date[14:16], float(date[17:]))
+
+        lines = [record('     3.03           OBSERVATION DATA    M', 'RINEX VERSION / TYPE'),
+                 record('synthetic.py', 'PGM / RUN BY / DATE'),
+                 record('Synthetic observations, with {} cycle-slips'.format(len(self.slips)), 'COMMENT'),
+                 record(self.station, 'MARKER NAME')]
+        for system, obs_types in self._obs_types.items():
+            lines.append(record('{}  {:3d} {}'.format(system, len(obs_types), ' '.join(obs_types)),
+                                'SYS / # / OBS TYPES'))
+        lines.append(record('{:10.3f}'.format(self.rate), 'INTERVAL'))
+        if len(self.time):
+            lines.append(record(epoch(self.time[0]), 'TIME OF FIRST OBS'))
+            lines.append(record(epoch(self.time[-1]), 'TIME OF LAST OBS'))
+        lines.extend(record(content, 'GLONASS SLOT / FRQ #') for content in self._glonass_slots())
+        lines.append(record('', 'END OF HEADER'))
+
+        return ''.join(lines)
+
+    def observations(self):
+        """
+        :return: The observations (see rinex.Observations), as decoded from the rinex file by rinex.RinexObsReader
+        """
+        fields = {system: list(obs_types) for system, obs_types in self._obs_types.items()}
+        header = {'version': 3.03, 'filetype': 'O', 'systems': 'M', 'fields': fields, 'interval': float(self.rate),
+                  'GLONASS SLOT / FRQ #': ''.join(self._glonass_slots())}
+
+        return rinex.Observations(header, self.time.copy(), self.sv.copy(),
+                                  {code: matrix.copy() for code, matrix in self.data.items()})
+
+    def write(self, folder):
+        """
+        Write the observations as a RINEX 3.03 file
+
+        :param folder: The folder of the rinex (created if it does not exist)
+        :return: Absolute path to the rinex
+        """
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, self.file_name)
+
+        records = np.full(self.tracked.shape, '', dtype=object)
+        for k, prn in enumerate(self.sv):
+            fields = [np.char.mod('%14.3f  ', self.data[code][:, k]) for code in OBS_TYPES[prn[0]]]
+            records[:, k] = [prn + ''.join(values).rstrip() + '\n' for values in zip(*fields)]
+
+        with open(path, mode='w') as fd:
+            fd.write(self._header())
+            for i, time in enumerate(self.time):
+                date = str(time.astype('datetime64[us]'))
+                columns = np.flatnonzero(self.tracked[i])
+                fd.write('> {} {} {} {} {}{:11.7f}  0{:3d}\n'.format(date[0:4], date[5:7], date[8:10], date[11:13],
+                                                                     date[14:16], float(date[17:]), len(columns)))
+                fd.writelines(records[i, columns])
+
+        return path
+
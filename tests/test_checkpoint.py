@@ -0,0 +1,59 @@
+"""
+Resuming a killed check from the PRNs recorded in the checkpoint (see checkpoint.Checkpoint), in the batched analysis
+(see CycleSlip._cycle_slip_analysis_batched)
+"""
+import logging
+import os
+
+import numpy as np
+import pytest
+
+import cycle_slip as cs
+import settings as settings
+import store
+import synthetic
+
+
+@pytest.fixture
+def rinex_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'PLOTS', 'off')
+    monkeypatch.setattr(settings, 'use_cache', False)
+    monkeypatch.setattr(settings, 'ARC_WORKERS', 2)
+    monkeypatch.setattr(settings, 'PRN_WORKERS', 1)
+    return os.path.dirname(synthetic.SyntheticRinex(duration=6, gps=8, glonass=4, slips=3).write(
+        str(tmp_path / 'rinex')))
+
+
+def test_batched_prns_resume(tmp_path, rinex_folder, monkeypatch, caplog):
+    cs.CycleSlip(rinex_folder, workers=1, store_folder=str(tmp_path / 'expected')).initialize()
+
+    # killed while correcting the arcs: the PRNs whose arcs were all corrected before are recorded
+    correct, calls = cs.CycleSlip._correct_cycle_slip, []
+
+    def killed(self, *args):
+        calls.append(None)
+        if len(calls) > 15:
+            raise MemoryError("killed")
+        return correct(self, *args)
+
+    monkeypatch.setattr(cs.CycleSlip, '_correct_cycle_slip', killed)
+    checkpoint = str(tmp_path / 'checkpoint')
+    result, = cs.CycleSlip(rinex_folder, workers=1, store_folder=str(tmp_path / 'store'),
+                           checkpoint_folder=checkpoint).initialize()
+    assert result['status'] == 'failed'
+
+    file, = os.listdir(rinex_folder)
+    recorded = os.listdir(os.path.join(checkpoint, 'prns', file))
+    assert 0 < len(recorded) < 12
+
+    monkeypatch.setattr(cs.CycleSlip, '_correct_cycle_slip', correct)
+    with caplog.at_level(logging.INFO):
+        result, = cs.CycleSlip(rinex_folder, workers=1, store_folder=str(tmp_path / 'store'),
+                               checkpoint_folder=checkpoint).initialize()
+    assert result['status'] == 'ok'
+    assert any('{} PRNs resumed'.format(len(recorded)) in record.getMessage() for record in caplog.records)
+
+    expected = store.StationStore(str(tmp_path / 'expected'), 'SYNT').read()
+    resumed = store.StationStore(str(tmp_path / 'store'), 'SYNT').read()
+    assert np.array_equal(expected[0], resumed[0]) and np.array_equal(expected[1], resumed[1])
+    assert all(expected[2][name].tobytes() == resumed[2][name].tobytes() for name in expected[2])
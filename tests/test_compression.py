@@ -0,0 +1,45 @@
+"""
+Streaming decoding of .Z files (see compression.LZWStream) against ncompress, with input chunks of any size
+"""
+import io
+
+import numpy as np
+import pytest
+
+import compression
+
+ncompress = pytest.importorskip('ncompress')
+
+rng = np.random.default_rng(0)
+SAMPLES = {'empty': b'', 'byte': b'a', 'repeated': b'ab' * 5,
+           'random': rng.integers(0, 256, 200000, dtype=np.uint8).tobytes(),
+           'letters': (rng.integers(0, 4, 300000, dtype=np.uint8) + 65).tobytes(),
+           'rinex': b''.join(b'G%02d %14.3f  %14.3f  \n' % (k % 32, k * 1.5e3, -k * 7.25) for k in range(40000))}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 100, 1 << 16])
+@pytest.mark.parametrize('name', sorted(SAMPLES))
+def test_lzw_stream(name, chunk_size, monkeypatch):
+    monkeypatch.setattr(compression.LZWStream, '_chunk_size', chunk_size)
+    data = SAMPLES[name]
+
+    with io.BufferedReader(compression.LZWStream(io.BytesIO(ncompress.compress(data)))) as fd:
+        assert fd.read() == data
+
+
+def test_lzw_stream_reads_in_chunks(monkeypatch):
+    compressed = io.BytesIO(ncompress.compress(SAMPLES['rinex']))
+    reads = []
+    read = compressed.read
+    compressed.read = lambda size=-1: reads.append(size) or read(size)
+
+    with io.BufferedReader(compression.LZWStream(compressed)) as fd:
+        fd.readline()
+        assert compressed.tell() < len(compressed.getvalue())
+
+    assert reads and all(0 < size <= compression.LZWStream._chunk_size for size in reads)
+
+
+def test_not_lzw():
+    with pytest.raises(ValueError):
+        io.BufferedReader(compression.LZWStream(io.BytesIO(b'\x1f\x8b\x08'))).read()
@@ -0,0 +1,68 @@
+"""
+Checking a multi-system rinex (GPS, GLONASS, Galileo, BeiDou and QZSS), with the constellations enabled only through
+settings.CONSTELLATIONS: the frequencies (settings.FREQUENCIES) and the columns (settings.COLUMNS_IN_RINEX) of each
+one are in the settings
+"""
+import os
+
+import numpy as np
+import pytest
+
+import benchmark
+import cycle_slip as cs
+import rinex
+import settings as settings
+import store
+import synthetic
+
+SYSTEMS = ['G', 'R', 'E', 'C', 'J']
+
+
+@pytest.fixture
+def generated(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'PLOTS', 'off')
+    monkeypatch.setattr(settings, 'use_cache', False)
+
+    generated = synthetic.SyntheticRinex(duration=12, gps=3, glonass=2, galileo=3, beidou=3, qzss=2, slips=3)
+    generated.write(str(tmp_path / 'rinex'))
+    return generated
+
+
+def test_multi_system_rinex(tmp_path, generated, monkeypatch):
+    monkeypatch.setattr(settings, 'CONSTELLATIONS', SYSTEMS)
+    result, = cs.CycleSlip(str(tmp_path / 'rinex'), workers=1, output_folder=str(tmp_path / 'output'),
+                           store_folder=str(tmp_path / 'store')).initialize()
+    assert result['status'] == 'ok'
+
+    stored_time, stored_sv, values = store.StationStore(str(tmp_path / 'store'), generated.station).read()
+    assert sorted({prn[0] for prn in stored_sv}) == sorted(SYSTEMS)
+
+    column = {prn: k for k, prn in enumerate(generated.sv)}
+    detected = np.zeros(generated.truth.shape, dtype=bool)
+    detected[np.ix_(np.searchsorted(generated.time, stored_time), [column[prn] for prn in stored_sv])] = \
+        values['slips']
+
+    file = os.path.join(str(tmp_path / 'rinex'), generated.file_name)
+    output = os.path.join(str(tmp_path / 'output'), rinex.RinexObsWriter.output_name(generated.file_name))
+    codes = cs.Utils.which_cols_to_load()
+    original, corrected = (rinex.RinexObsReader(path).read(codes, SYSTEMS) for path in (file, output))
+    assert list(corrected.sv) == list(original.sv)
+
+    for system in SYSTEMS:
+        columns = np.array([prn[0] == system for prn in generated.sv])
+        found, right, wrong = benchmark.score(generated.truth[:, columns], detected[:, columns])
+        assert found > 0 and right > wrong
+
+        # the cycles are subtracted from the phases of the constellation
+        phases = [settings.COLUMNS_IN_RINEX['3.03'][system][name] for name in ('L1', 'L2')]
+        sv = np.array([prn[0] == system for prn in original.sv])
+        assert all(not np.array_equal(original[code][:, sv], corrected[code][:, sv], equal_nan=True)
+                   for code in phases)
+
+
+def test_constellations_not_checked(tmp_path, generated):
+    result, = cs.CycleSlip(str(tmp_path / 'rinex'), workers=1, store_folder=str(tmp_path / 'store')).initialize()
+    assert result['status'] == 'ok'
+
+    stored_sv = store.StationStore(str(tmp_path / 'store'), generated.station).read()[1]
+    assert sorted({prn[0] for prn in stored_sv}) == ['G', 'R']
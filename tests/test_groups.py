@@ -0,0 +1,106 @@
+"""
+Checking a rinex by satellites groups (see CycleSlip._check_groups), decoded once to disk (see
+rinex.RinexObsReader.spill), against checking it at once
+"""
+import logging
+import os
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import cycle_slip as cs
+import rinex
+import settings as settings
+import store
+import synthetic
+
+COLUMNS = ['L1C', 'L2W', 'L2C', 'C1C', 'C1W', 'C2W', 'C1P', 'C2P']
+
+
+@pytest.fixture
+def rinex_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'PLOTS', 'off')
+    monkeypatch.setattr(settings, 'use_cache', False)
+    return synthetic.SyntheticRinex(duration=6, gps=9, glonass=4, gaps=3, slips=3).write(str(tmp_path / 'rinex'))
+
+
+def test_spill_matches_read(tmp_path, rinex_file):
+    reader = rinex.RinexObsReader(rinex_file)
+    epochs, sv = reader.scan(['G', 'R'])
+    spilled = reader.spill(COLUMNS, ['G', 'R'], sv, epochs, str(tmp_path))
+
+    for group in (sv, sv[:1], sv[2:7], sv[-3:]):
+        obs, expected = spilled.observations(group), reader.read(COLUMNS, ['G', 'R'], group)
+        assert (obs.time == expected.time).all() and list(obs.sv) == list(expected.sv)
+        assert sorted(obs.data) == sorted(expected.data)
+        for code in expected.data:
+            assert obs[code].tobytes() == expected[code].tobytes()
+
+    with pytest.raises(ValueError):
+        spilled.observations(sv[[0, 2]])
+
+
+def test_groups_match_the_whole_rinex(tmp_path, rinex_file, monkeypatch, caplog):
+    folder = os.path.dirname(rinex_file)
+    cs.CycleSlip(folder, workers=1, output_folder=str(tmp_path / 'whole'),
+                 store_folder=str(tmp_path / 'whole_store')).initialize()
+
+    monkeypatch.setattr(settings, 'MEMORY_BUDGET_MB', 0.05)
+    with caplog.at_level(logging.WARNING):
+        result, = cs.CycleSlip(folder, workers=1, output_folder=str(tmp_path / 'groups'),
+                               store_folder=str(tmp_path / 'groups_store')).initialize()
+
+    counters = result['metrics']['counters']
+    assert result['status'] == 'ok' and counters['groups'] == counters['satellites'] > 1
+    assert any('A single satellite takes' in record.getMessage() for record in caplog.records)
+
+    name = rinex.RinexObsWriter.output_name(os.path.basename(rinex_file))
+    assert open(str(tmp_path / 'groups' / name), mode='rb').read() == \
+        open(str(tmp_path / 'whole' / name), mode='rb').read()
+
+    whole = store.StationStore(str(tmp_path / 'whole_store'), 'SYNT').read()
+    groups = store.StationStore(str(tmp_path / 'groups_store'), 'SYNT').read()
+    assert np.array_equal(whole[0], groups[0]) and np.array_equal(whole[1], groups[1])
+    assert all(whole[2][name].tobytes() == groups[2][name].tobytes() for name in whole[2])
+
+
+def test_groups_write_the_store_day_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'PLOTS', 'off')
+    monkeypatch.setattr(settings, 'use_cache', False)
+    rinex_file = synthetic.SyntheticRinex(rate=10, duration=24, gps=9, glonass=4, gaps=3,
+                                          slips=3).write(str(tmp_path / 'rinex'))
+    monkeypatch.setattr(settings, 'MEMORY_BUDGET_MB', 0.5)
+    monkeypatch.setattr(store.StationStore, 'chunk_rows', 64)
+
+    # peak memory taken by the store, over the memory already taken when it is appended
+    peaks, append = [], store.StationStore.append
+
+    def traced(self, *args, **kwargs):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            return append(self, *args, **kwargs)
+        finally:
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+
+    monkeypatch.setattr(store.StationStore, 'append', traced)
+    tracemalloc.start()
+    try:
+        # the buffers of zlib, taken by any chunk whatever the size of the day
+        tracemalloc.reset_peak()
+        store._encode(np.zeros((64, 13)))
+        compression = tracemalloc.get_traced_memory()[1] - tracemalloc.get_traced_memory()[0]
+
+        result, = cs.CycleSlip(os.path.dirname(rinex_file), workers=1, output_folder=None,
+                               store_folder=str(tmp_path / 'store')).initialize()
+    finally:
+        tracemalloc.stop()
+
+    counters = result['metrics']['counters']
+    assert result['status'] == 'ok' and counters['groups'] > 1
+
+    # appended once after the last group, without the whole (epoch x sv) matrices of the day
+    station = store.StationStore(str(tmp_path / 'store'), 'SYNT')
+    assert station._versions(station._day_path(np.datetime64('2018-06-01'))) == [0] and len(peaks) == 1
+    assert peaks[0] - compression < counters['epochs'] * counters['satellites'] * 8 / 4
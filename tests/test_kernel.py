@@ -0,0 +1,209 @@
+"""
+Equivalence of the correction loop backends (see kernel.detect_and_correct) with the original per-epoch loop, which
+subtracted each correction from the whole L1/L2 tail
+"""
+import importlib.util
+import math
+
+import numpy as np
+import pytest
+
+import kernel
+import settings as settings
+
+F1, F2, FACTOR_1, FACTOR_2 = settings.F1, settings.F2, settings.factor_1, settings.factor_2
+BACKENDS = ['python', pytest.param('numba', marks=pytest.mark.skipif(importlib.util.find_spec('numba') is None,
+                                                                    reason="numba is not installed"))]
+
+
+def reference(l1, l2, c1, p2, new_arc, peaks, f1, f2, factor_1, factor_2, c, diff_tec_max):
+    """
+    The original per-epoch loop (CycleSlip._correct and _detect_and_correct_cycle_slip before kernel.py), over arrays
+    """
+    l1, l2 = np.array(l1, dtype=np.float64), np.array(l2, dtype=np.float64)
+    n = len(l1)
+    rtec = ((l1 / f1) - (l2 / f2)) * c
+    mwlc = (l1 - l2) - (f1 * c1 + f2 * p2) * factor_1
+    slips, cycles_1, cycles_2 = np.zeros(n, dtype=bool), np.zeros(n), np.zeros(n)
+
+    def correct(index):
+        diff_rtec = rtec[index] - rtec[index - 1]
+        diff_mwlc = mwlc[index] - mwlc[index - 1]
+
+        var_1 = diff_mwlc * c
+        var_2 = var_1 / f1
+        diff_2 = round((diff_rtec - var_2) * factor_2)
+        diff_1 = diff_2 + round(diff_mwlc)
+
+        cor_r_1 = l1[index] - diff_1
+        cor_r_2 = l2[index] - diff_2
+
+        rtec[index] = ((cor_r_1 / f1) - (cor_r_2 / f2)) * c
+        mwlc[index] = (cor_r_1 - cor_r_2) - (f1 * c1[index] + f2 * p2[index]) * factor_1
+
+        l1[index:] -= diff_1
+        l2[index:] -= diff_2
+        slips[index] = True
+        cycles_1[index] += diff_1
+        cycles_2[index] += diff_2
+
+    j_start = 0
+    for i in range(1, n):
+        rtec[i] = ((l1[i] / f1) - (l2[i] / f2)) * c
+        mwlc[i] = (l1[i] - l2[i]) - (f1 * c1[i] + f2 * p2[i]) * factor_1
+
+        if new_arc[i]:
+            j_start = i
+            continue
+
+        if peaks[i]:
+            correct(i)
+
+        if i - j_start + 1 >= 12:
+            add_tec = 0
+            add_tec_2 = 0
+            for jj in range(1, 10):
+                add_tec = add_tec + rtec[i - jj] - rtec[i - jj - 1]
+                add_tec_2 = add_tec_2 + pow(rtec[i - jj] - rtec[i - jj - 1], 2)
+
+            p_mean = add_tec / 10
+            with np.errstate(invalid='ignore'):
+                p_dev = np.maximum(np.sqrt(add_tec_2 / 10 - pow(p_mean, 2)), diff_tec_max)
+        else:
+            p_mean = 0
+            p_dev = diff_tec_max * 2.5
+
+        pmin_tec = p_mean - p_dev * 2
+        pmax_tec = p_mean + p_dev * 2
+        diff_rtec = rtec[i] - rtec[i - 1]
+
+        if not pmin_tec < diff_rtec and diff_rtec <= pmax_tec:
+            correct(i)
+
+    return rtec, slips, np.cumsum(cycles_1), np.cumsum(cycles_2)
+
+
+def arc(n, seed, slips=0, gaps=0, peaks=0, base=2.2e7, rate=600.0, acceleration=0.02):
+    """
+    Dual-frequency measures of a synthetic pass, with cycle-slips injected in L1/L2 (from an epoch to the end)
+
+    :param n: Number of measures
+    :param seed: The random seed
+    :param slips: Number of cycle-slips injected
+    :param gaps: Number of data holes (new arcs)
+    :param peaks: Number of epochs flagged by the detection (4th order differences)
+    :param base: The geometric range (m) at the start of the pass
+    :param rate: The range rate (m per epoch)
+    :param acceleration: The range acceleration (m per epoch squared)
+    :return: l1, l2, c1, p2, new_arc and peaks
+    """
+    random = np.random.default_rng(seed)
+    epochs = np.arange(n)
+    rho = base + rate * epochs + acceleration * epochs ** 2
+    tec = 4.0 + 2.0 * np.sin(epochs / 400.0) + np.cumsum(random.normal(0, 0.002, n))
+    delay_1, delay_2 = 40.3e16 * tec / F1 ** 2, 40.3e16 * tec / F2 ** 2
+
+    l1 = (rho - delay_1) * F1 / settings.C + random.normal(0, 0.01, n)
+    l2 = (rho - delay_2) * F2 / settings.C + random.normal(0, 0.01, n)
+    c1 = rho + delay_1 + random.normal(0, 0.5, n)
+    p2 = rho + delay_2 + random.normal(0, 0.5, n)
+
+    for epoch in random.choice(np.arange(20, n), size=slips, replace=False):
+        l1[epoch:] += random.integers(-50, 50)
+        l2[epoch:] += random.integers(-50, 50)
+
+    new_arc = np.zeros(n, dtype=bool)
+    new_arc[random.choice(np.arange(1, n), size=gaps, replace=False)] = True
+    flagged = np.zeros(n, dtype=bool)
+    flagged[random.choice(np.arange(1, n), size=peaks, replace=False)] = True
+
+    return l1, l2, c1, p2, new_arc, flagged
+
+
+CASES = {'clean': dict(n=3000, seed=1),
+         'slips': dict(n=3000, seed=2, slips=12, peaks=6),
+         'gappy': dict(n=5000, seed=3, slips=20, gaps=15, peaks=10),
+         'short arcs': dict(n=400, seed=4, slips=5, gaps=60, peaks=20),
+         'day at 1 Hz': dict(n=86400, seed=5, slips=45, gaps=8, peaks=30),
+         # L1 slowly crosses a power of two (2 ** 28 cycles): near it, the accumulated offset can not be subtracted at
+         # once, then the offsets are subtracted one by one (see kernel._shifted)
+         'binade': dict(n=4000, seed=6, slips=30, peaks=10, base=2 ** 28 * settings.C / F1 - 1000.0, rate=0.5,
+                        acceleration=0.0)}
+
+
+def check(case, backend):
+    l1, l2, c1, p2, new_arc, peaks = arc(**case)
+    arguments = (F1, F2, FACTOR_1, FACTOR_2, settings.C, settings.DIFF_TEC_MAX)
+
+    expected = reference(l1, l2, c1, p2, new_arc, peaks, *arguments)
+    found = kernel.detect_and_correct(l1, l2, c1, p2, new_arc, peaks, *arguments, backend=backend)
+
+    for name, values, expected_values in zip(('rtec', 'slips', 'cycles_1', 'cycles_2'), found, expected):
+        assert np.array_equal(values, expected_values, equal_nan=True), name
+        assert np.asarray(values).tobytes() == np.asarray(expected_values).tobytes(), name
+
+    return expected
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('name', sorted(CASES))
+def test_backend_matches_reference(name, backend):
+    check(CASES[name], backend)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('seed', range(20))
+def test_random_arcs(seed, backend):
+    random = np.random.default_rng(100 + seed)
+    n = int(random.integers(50, 3000))
+    check(dict(n=n, seed=seed, slips=int(random.integers(0, 15)), gaps=int(random.integers(0, 10)),
+               peaks=int(random.integers(0, 10))), backend)
+
+
+def test_cases_correct_slips():
+    """
+    The cases are not trivial: every case with cycle-slips injected has corrections
+    """
+    for name, case in CASES.items():
+        if case.get('slips'):
+            assert check(case, 'python')[1].any(), name
+
+
+def test_binade_case_takes_the_fallback(monkeypatch):
+    """
+    The 'binade' case goes through the one-by-one subtraction of kernel._shifted
+    """
+    fallbacks = []
+    shifted = kernel._shifted
+
+    def spy(value, offsets, count, total, low, high):
+        _, exponent = math.frexp(value)
+        if not abs(value) + max(abs(low), abs(high)) < math.ldexp(1.0, exponent):
+            fallbacks.append(value)
+        return shifted(value, offsets, count, total, low, high)
+
+    monkeypatch.setattr(kernel, '_shifted', spy)
+    check(CASES['binade'], 'python')
+    assert fallbacks
+
+
+@pytest.mark.parametrize('value', [2.0 ** 27 - 3.7, 2.0 ** 27 + 0.3, -(2.0 ** 26) + 1.1, 1.5, 0.75])
+def test_shifted_matches_sequential_subtraction(value):
+    random = np.random.default_rng(7)
+    offsets = random.integers(-40, 40, size=25).astype(np.float64)
+    partial = np.concatenate(([0.0], np.cumsum(offsets)))
+
+    for count in range(len(offsets) + 1):
+        expected = value
+        for offset in offsets[:count]:
+            expected = expected - offset
+        found = kernel._shifted(value, offsets, count, partial[count], partial[:count + 1].min(),
+                                partial[:count + 1].max())
+        assert found == expected
+
+
+def test_select_backend():
+    assert kernel.select_backend('python') == 'python'
+    assert kernel.select_backend('auto') == ('numba' if importlib.util.find_spec('numba') else 'python')
+    with pytest.raises(ValueError):
+        kernel.select_backend('fortran')
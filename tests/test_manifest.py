@@ -0,0 +1,44 @@
+"""
+The header-only prescan of a rinex folder (see manifest.Manifest), imported on its own: it does not depend on
+cycle_slip, which imports it
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+import manifest as mf
+import synthetic
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_without_cycle_slip():
+    code = "import sys, manifest; assert 'cycle_slip' not in sys.modules"
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+
+
+@pytest.mark.parametrize('name, expected', [('ALMA1520.18O', ('2018', '06', '152')),
+                                            ('ALMA1520.18d.Z', ('2018', '06', '152')),
+                                            ('ALMA00BRA_R_20181520000_01D_30S_MO.rnx', ('2018', '06', '152')),
+                                            ('ALMA00BRA_R_20190600000_01D_30S_MO.crx.gz', ('2019', '03', '060'))])
+def test_setup_rinex_name(name, expected):
+    assert mf.setup_rinex_name(name) == expected
+
+
+@pytest.mark.parametrize('name', ['ALMA1520.18N', '1LMA1520.18O', 'ALMA00BRA_R_20184000000_01D_30S_MO.rnx'])
+def test_setup_rinex_name_invalid(name):
+    with pytest.raises(ValueError):
+        mf.setup_rinex_name(name)
+
+
+def test_prescan(tmp_path):
+    folder = os.path.dirname(synthetic.SyntheticRinex(duration=1, gps=2, glonass=1).write(str(tmp_path / 'rinex')))
+    open(os.path.join(folder, 'notes.txt'), mode='w').close()
+
+    manifest = mf.Manifest.prescan(folder)
+
+    entry, = manifest.valid
+    assert (entry['station'], entry['year'], entry['doy']) == ('SYNT', '2018', '152')
+    assert [entry['file'] for entry in manifest.skipped] == ['notes.txt']
@@ -0,0 +1,47 @@
+"""
+Isolation of the metrics collected (see metrics.collect) by concurrent checks in the same process
+"""
+import threading
+
+import metrics
+
+
+def test_threads_collect_apart():
+    barrier = threading.Barrier(2)
+    collected = {}
+
+    def check(name, value):
+        with metrics.collect() as file_metrics:
+            barrier.wait()
+            metrics.count('epochs', value)
+            barrier.wait()
+            collected[name] = file_metrics.as_dict()['counters']
+
+    threads = [threading.Thread(target=check, args=(name, value)) for name, value in (('a', 1), ('b', 10))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert collected == {'a': {'epochs': 1}, 'b': {'epochs': 10}}
+
+
+def test_nested_collection_is_restored():
+    with metrics.collect() as outer:
+        with metrics.collect() as inner:
+            metrics.count('arcs')
+        metrics.count('arcs', 2)
+
+    assert inner.counters == {'arcs': 1} and outer.counters == {'arcs': 2}
+    assert metrics.current() is not outer
+
+
+def test_peak_rss_growth():
+    with metrics.collect() as file_metrics:
+        block = bytearray(64 * 1024 * 1024)
+        block[::4096] = b'x' * len(block[::4096])
+        values = file_metrics.as_dict()
+        del block
+
+    assert values['peak_rss_growth_mb'] >= 0
+    assert values['process_peak_rss_mb'] >= values['peak_rss_growth_mb']
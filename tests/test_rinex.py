@@ -0,0 +1,59 @@
+"""
+Equivalence of the rinex reader (see rinex.RinexObsReader) with georinex, which loaded the observations before it.
+georinex is a development dependency only (see requeriments-dev.txt), then these tests are skipped without it
+
+The real rinex is data/sample.rnx (RINEX 3.01, GPS/GLONASS/SBAS, with a blank padded PRN), the sample of the RNXCMP
+documentation as shipped with the hatanaka package (MIT). More files may be checked through CYCLE_SLIP_RINEX (paths
+separated by os.pathsep), e.g. a day of an EMBRACE station
+"""
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+import rinex
+import synthetic
+
+georinex = pytest.importorskip('georinex')
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+COLUMNS = ['L1C', 'L2P', 'L2W', 'L2C', 'C1C', 'C1P', 'C1W', 'C2P', 'C2W']
+CONSTELLATIONS = ['G', 'R']
+FILES = [os.path.join(DATA, 'sample.rnx')] + [path for path in os.environ.get('CYCLE_SLIP_RINEX', '').split(os.pathsep)
+                                              if path]
+
+
+def assert_same_observations(file, columns, constellations):
+    obs = rinex.RinexObsReader(file).read(columns, constellations)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = georinex.load(file, use=constellations, meas=columns)
+
+    np.testing.assert_array_equal(obs.time, expected.time.values.astype('datetime64[ns]'))
+    assert set(obs.sv) <= set(expected.sv.values)
+
+    column = {prn: i for i, prn in enumerate(expected.sv.values)}
+    index = [column[prn] for prn in obs.sv]
+    for code in columns:
+        if code not in expected:
+            assert code not in obs or np.isnan(obs[code]).all()
+            continue
+        np.testing.assert_array_equal(obs[code], expected[code].values[:, index])
+
+    other = np.setdiff1d(expected.sv.values, obs.sv)
+    assert all(np.isnan(expected[code].sel(sv=other).values).all() for code in expected.data_vars)
+
+
+@pytest.mark.parametrize('file', FILES, ids=os.path.basename)
+def test_real_rinex(file):
+    assert_same_observations(file, COLUMNS, CONSTELLATIONS)
+
+
+def test_real_rinex_single_constellation():
+    assert_same_observations(FILES[0], COLUMNS, ['R'])
+
+
+def test_synthetic_rinex(tmp_path):
+    file = synthetic.SyntheticRinex(duration=1, gps=6, glonass=2, gaps=1, slips=1).write(str(tmp_path))
+    assert_same_observations(file, COLUMNS, CONSTELLATIONS)
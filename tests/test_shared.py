@@ -0,0 +1,77 @@
+"""
+Checking the PRNs of a rinex with a pool of processes over shared memory (see CycleSlip._cycle_slip_analysis_shared
+and shared.SharedArrays), against the batched analysis in a single process
+"""
+import logging
+import os
+
+import numpy as np
+import pytest
+
+from multiprocessing import resource_tracker
+
+import cycle_slip as cs
+import rinex
+import settings as settings
+import shared
+import store
+import synthetic
+
+SHM = '/dev/shm'
+
+
+@pytest.fixture
+def rinex_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'PLOTS', 'off')
+    monkeypatch.setattr(settings, 'use_cache', False)
+    return synthetic.SyntheticRinex(duration=6, gps=6, glonass=3, gaps=3, slips=3).write(str(tmp_path / 'rinex'))
+
+
+def segments():
+    return set(os.listdir(SHM)) if os.path.isdir(SHM) else set()
+
+
+def test_shared_matches_batched(tmp_path, rinex_file, monkeypatch, caplog):
+    folder = os.path.dirname(rinex_file)
+    monkeypatch.setattr(settings, 'PRN_WORKERS', 1)
+    cs.CycleSlip(folder, workers=1, output_folder=str(tmp_path / 'batched'),
+                 store_folder=str(tmp_path / 'batched_store')).initialize()
+
+    before = segments()
+    monkeypatch.setattr(settings, 'PRN_WORKERS', 2)
+    with caplog.at_level(logging.INFO):
+        result, = cs.CycleSlip(folder, workers=1, output_folder=str(tmp_path / 'shared'),
+                               store_folder=str(tmp_path / 'shared_store')).initialize()
+
+    assert result['status'] == 'ok' and result['metrics']['counters']['slips'] > 0
+    assert any('with 2 processes' in record.getMessage() for record in caplog.records)
+    assert segments() <= before
+
+    name = rinex.RinexObsWriter.output_name(os.path.basename(rinex_file))
+    assert open(str(tmp_path / 'shared' / name), mode='rb').read() == \
+        open(str(tmp_path / 'batched' / name), mode='rb').read()
+
+    batched = store.StationStore(str(tmp_path / 'batched_store'), 'SYNT').read()
+    pooled = store.StationStore(str(tmp_path / 'shared_store'), 'SYNT').read()
+    assert np.array_equal(batched[0], pooled[0]) and np.array_equal(batched[1], pooled[1])
+    assert all(batched[2][name].tobytes() == pooled[2][name].tobytes() for name in batched[2])
+
+
+def test_attach_is_not_tracked(monkeypatch):
+    with shared.SharedArrays.create({'values': np.arange(6.0)}) as arrays:
+        spec = arrays.spec
+        registered = []
+
+        def register(name, rtype):
+            registered.append((name, rtype))
+
+        monkeypatch.setattr(resource_tracker, 'register', register)
+
+        attached = shared.SharedArrays.attach(spec)
+        attached['values'][0] = -1
+        assert arrays['values'][0] == -1
+        attached.close()
+
+        assert registered == [] and resource_tracker.register is register
+
+    assert not any(name.lstrip('/') in segments() for name, _, _ in spec.values())
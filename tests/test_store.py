@@ -0,0 +1,97 @@
+"""
+Appending to and reading from the station store (see store.StationStore), in compressed chunks of epochs per day and
+variable (see store.ChunkedArray)
+"""
+import io
+import os
+
+import numpy as np
+import pytest
+
+import store
+
+SV = np.array(['G01', 'G05', 'R09'])
+
+
+def results(time, sv, seed):
+    rng = np.random.default_rng(seed)
+    values = {name: rng.normal(size=(len(time), len(sv))) for name in ('rtec', 'rtec_corrected', 'mwlc')}
+    values['slips'] = rng.random((len(time), len(sv))) < 0.1
+    return values
+
+
+def day(start, hours, rate=30):
+    return np.datetime64(start, 'ns') + np.arange(0, hours * 3600, rate) * np.timedelta64(1, 's')
+
+
+@pytest.fixture(params=[1024, 7], ids=['chunks', 'small_chunks'])
+def station(tmp_path, request, monkeypatch):
+    monkeypatch.setattr(store.StationStore, 'chunk_rows', request.param)
+    return store.StationStore(str(tmp_path), 'synt')
+
+
+def test_append_and_read(station):
+    time = np.concatenate([day('2018-06-01T12:00', 12), day('2018-06-02', 12)])
+    values = results(time, SV, 0)
+
+    assert station.append(time, SV, values) == 2
+    assert list(station.days) == [np.datetime64('2018-06-01'), np.datetime64('2018-06-02')]
+
+    read_time, read_sv, read = station.read()
+    assert (read_time == time).all() and (read_sv == SV).all()
+    assert all(read[name].tobytes() == values[name].tobytes() for name in values)
+
+    rows = (time >= np.datetime64('2018-06-01T20:00')) & (time < np.datetime64('2018-06-02T03:00'))
+    read_time, read_sv, read = station.read('2018-06-01T20:00', '2018-06-02T03:00', sv=['R09', 'G01'],
+                                            variables=['mwlc'])
+    assert (read_time == time[rows]).all() and list(read_sv) == ['G01', 'R09'] and list(read) == ['mwlc']
+    assert read['mwlc'].tobytes() == values['mwlc'][rows][:, [0, 2]].tobytes()
+
+
+def test_append_again_replaces_the_epochs(station):
+    time = day('2018-06-01', 6)
+    station.append(time, SV, results(time, SV, 0))
+
+    _, _, before = station._load(np.datetime64('2018-06-01'), ['rtec'])
+    kept = np.array(before['rtec'])
+
+    again = results(time[100:200], SV[1:], 1)
+    station.append(time[100:200], SV[1:], again)
+
+    # a reader of the previous version keeps it
+    assert before['rtec'][:].tobytes() == kept.tobytes()
+    before['rtec'].close()
+
+    read_time, _, read = station.read()
+    # the epochs of the rinex replace the whole rows: a satellite not in it has no measure there
+    expected = kept.copy()
+    expected[100:200, 0] = np.nan
+    expected[100:200, 1:] = again['rtec']
+    assert (read_time == time).all() and read['rtec'].tobytes() == expected.tobytes()
+    assert station._versions(station._day_path(np.datetime64('2018-06-01'))) == [1]
+
+
+def test_slice_decompresses_its_chunks(tmp_path, monkeypatch):
+    station = store.StationStore(str(tmp_path), 'synt')
+    time = day('2018-06-01', 24, rate=1)
+    hours = (time - time[0]) / np.timedelta64(1, 'h')
+
+    # smooth series with holes, as the rTEC of a day
+    rtec = np.sin(hours[:, np.newaxis] / 3 + np.arange(len(SV))) * 30 + 50
+    rtec[(hours % 8 < 3)[:, np.newaxis] & np.array([True, False, True])] = np.nan
+    values = {'rtec': rtec, 'rtec_corrected': rtec, 'mwlc': rtec, 'slips': np.zeros(rtec.shape, dtype=bool)}
+    station.append(time, SV, values)
+
+    # as compressed as a whole .npz of the day
+    version = os.path.join(station._day_path(np.datetime64('2018-06-01')), '0')
+    compressed = io.BytesIO()
+    np.savez_compressed(compressed, rtec=rtec)
+    assert os.path.getsize(os.path.join(version, 'rtec.chunks')) < len(compressed.getvalue()) * 1.05
+
+    decoded = []
+    decode = store._decode
+    monkeypatch.setattr(store, '_decode', lambda *args: decoded.append(args) or decode(*args))
+
+    read_time, _, read = station.read('2018-06-01T06:00', '2018-06-01T07:00', variables=['rtec'])
+    assert len(read_time) == 3600 and read['rtec'].tobytes() == rtec[6 * 3600:7 * 3600].tobytes()
+    assert len(decoded) == len(range(6 * 3600 // station.chunk_rows, -(-7 * 3600 // station.chunk_rows)))
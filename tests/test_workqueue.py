@@ -0,0 +1,119 @@
+"""
+Two local workers over a work queue (see workqueue.run), with a short lease, and the atomic writing of the corrected
+rinex (see rinex.RinexObsWriter.replacing)
+"""
+import os
+import shutil
+import time
+
+import numpy as np
+import pytest
+
+import cycle_slip as cs
+import manifest as mf
+import rinex
+import settings as settings
+import synthetic
+import workqueue as wq
+
+
+@pytest.fixture
+def rinex_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'PLOTS', 'off')
+    monkeypatch.setattr(settings, 'use_cache', False)
+
+    folder = str(tmp_path / 'rinex')
+    for k, station in enumerate(('SYNA', 'SYNB', 'SYNC', 'SYND')):
+        synthetic.SyntheticRinex(duration=3, gps=6, glonass=2, station=station, seed=k).write(folder)
+    return folder
+
+
+def outputs(folder):
+    return {file: open(os.path.join(folder, file), mode='rb').read() for file in sorted(os.listdir(folder))}
+
+
+def test_two_workers(tmp_path, rinex_folder):
+    expected = str(tmp_path / 'expected')
+    cs.CycleSlip(rinex_folder, workers=1, output_folder=expected).initialize()
+
+    folder, output = str(tmp_path / 'queue'), str(tmp_path / 'output')
+    queue = wq.WorkQueue(folder, lease=1)
+    assert queue.populate(mf.Manifest.prescan(rinex_folder)) == 4
+
+    # an item left by a dead worker, claimed again when its lease expires
+    item_id = wq.WorkQueue.item_id(rinex_folder, sorted(os.listdir(rinex_folder))[0])
+    queue._write('leases', item_id, {'worker': 'dead:1', 'expires': time.time() + 1, 'attempts': 1})
+
+    status = wq.run(folder, workers=2, output_folder=output, lease=1, poll=0.1).status()
+
+    assert status == {'items': 4, 'done': 4, 'failed': 0, 'leased': 0, 'pending': 0}
+    assert outputs(output) == outputs(expected)
+    assert queue._read('done', item_id)['worker'] != 'dead:1'
+
+
+def test_failed_write_keeps_the_output(tmp_path, rinex_folder):
+    file = os.path.join(rinex_folder, sorted(os.listdir(rinex_folder))[0])
+    output = str(tmp_path / 'corrected.rnx')
+    obs = rinex.RinexObsReader(file).read(['L1C'], ['G', 'R'])
+    writer = rinex.RinexObsWriter(file)
+
+    values = np.full(obs['L1C'].shape, np.nan)
+    values[10, 0] = obs['L1C'][10, 0] + 1
+    assert writer.write(output, obs.sv, {'L1C': values}) == 1
+    written = open(output, mode='rb').read()
+
+    values[10, 0] += 1
+    values[20, 1] = 1e15
+    with pytest.raises(ValueError):
+        writer.write(output, obs.sv, {'L1C': values})
+
+    assert open(output, mode='rb').read() == written
+    assert sorted(os.listdir(str(tmp_path))) == ['corrected.rnx', 'rinex']
+
+
+def test_claim_and_status_skip_finished_items(tmp_path, monkeypatch):
+    entries = [{'file': 'SYNT{:03d}0.18O'.format(k), 'status': mf.Manifest.STATUS_OK} for k in range(1, 201)]
+    queue = wq.WorkQueue(str(tmp_path / 'queue'))
+    assert queue.populate(mf.Manifest(str(tmp_path / 'rinex'), entries)) == 200
+
+    for k in range(198):
+        item = queue.claim('worker')
+        queue.complete(item['id'], 'worker', {'file': item['file'], 'status': 'failed' if k < 3 else 'ok'})
+    leased = queue.claim('worker')
+
+    reads, read = [], wq.WorkQueue._read
+
+    def counted(self, name, item_id):
+        reads.append(name)
+        return read(self, name, item_id)
+
+    monkeypatch.setattr(wq.WorkQueue, '_read', counted)
+
+    assert queue.status() == {'items': 200, 'done': 198, 'failed': 3, 'leased': 1, 'pending': 1}
+    assert reads == ['leases']
+
+    reads.clear()
+    last = queue.claim('other')
+    assert reads == ['leases', 'items'] and last['id'] != leased['id']
+    assert queue.claim('other') is None
+    assert sorted(os.listdir(str(tmp_path / 'queue' / 'pending'))) == []
+
+
+def test_queue_without_pending_folder(tmp_path):
+    entries = [{'file': 'SYNT{:03d}0.18O'.format(k), 'status': mf.Manifest.STATUS_OK} for k in range(1, 6)]
+    folder = str(tmp_path / 'queue')
+    queue = wq.WorkQueue(folder)
+    queue.populate(mf.Manifest(str(tmp_path / 'rinex'), entries))
+
+    failed, done, leased = (queue.claim('worker') for _ in range(3))
+    queue.complete(failed['id'], 'worker', {'file': failed['file'], 'status': 'failed'})
+    queue.complete(done['id'], 'worker', {'file': done['file'], 'status': 'ok'})
+
+    # a queue of the earlier layout: no pending and failed folders
+    for name in ('pending', 'failed'):
+        shutil.rmtree(os.path.join(folder, name))
+
+    queue = wq.WorkQueue(folder)
+    assert queue.status() == {'items': 5, 'done': 2, 'failed': 1, 'leased': 1, 'pending': 2}
+    claimed = {queue.claim('other')['id'] for _ in range(2)}
+    assert leased['id'] not in claimed and queue.claim('other') is None
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+import cycle_slip as cs
+import manifest as mf
+import settings as settings
+
+
+def checksum(path, chunk_size=1024 ** 2):
+    """
+    :param path: Absolute path to the file
+    :param chunk_size: Bytes read at once
+    :return: The SHA-1 (hex) of the file content
+    """
+    digest = hashlib.sha1()
+    with open(path, mode='rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class Ledger:
+    """
+    Persistent record of the files of a folder already checked, kept as JSON (saved atomically), with the path
+    (relative to the folder) as key:
+        {"ALMA/ALMA00BRA_R_20181520000_01D_30S_MO.rnx": {"size": ..., "mtime": ..., "sha1": ..., "status": "ok",
+                                                         "error": null, "checked": ...}, ...}
+    A file is new or changed when its size or modification time differ from the ledger and, then, its content does
+    too (a file only touched, or copied again, is not checked again)
+    """
+    def __init__(self, file):
+        """
+        :param file: Absolute path to the ledger (loaded if it exists)
+        """
+        self.file = file
+        self.files = {}
+
+        if os.path.exists(file):
+            with open(file, mode='r') as fd:
+                self.files = json.load(fd)
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, path):
+        return path in self.files
+
+    @staticmethod
+    def default(folder):
+        """
+        :param folder: The watched folder
+        :return: The path of the ledger of the folder, out of it (then the ledger is never taken as a new file)
+        """
+        name = hashlib.sha1(os.path.abspath(folder).encode()).hexdigest()[:12]
+        return os.path.join(os.path.expanduser('~'), '.cycle_slip', 'ledgers', name + '.json')
+
+    def unchanged(self, path, stat):
+        """
+        :param path: The path, relative to the folder
+        :param stat: The os.stat_result of the file
+        :return: True if the size and modification time of the file are the ones in the ledger
+        """
+        record = self.files.get(path)
+        return record is not None and record['size'] == stat.st_size and record['mtime'] == stat.st_mtime_ns
+
+    def same_content(self, path, sha1):
+        record = self.files.get(path)
+        return record is not None and record['sha1'] == sha1
+
+    def touch(self, path, stat):
+        """
+        Update the size and modification time of a file whose content did not change
+        """
+        self.files[path].update({'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+
+    def record(self, path, stat, sha1, status, error=None):
+        """
+        :param path: The path, relative to the folder
+        :param stat: The os.stat_result of the file, when it was read
+        :param sha1: The checksum of the file content
+        :param status: 'ok', 'failed' or 'skipped' (not a supported rinex)
+        :param error: The error, if so
+        :return: None
+        """
+        self.files[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': sha1, 'status': status,
+                            'error': error, 'checked': time.time()}
+        return None
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.file)), exist_ok=True)
+        temporary = '{}.tmp-{}'.format(self.file, os.getpid())
+
+        with open(temporary, mode='w') as fd:
+            json.dump(self.files, fd, indent=1)
+        os.replace(temporary, self.file)
+
+    def __str__(self):
+        statuses = [record['status'] for record in self.files.values()]
+        return "Ledger {}: {} files, {} ok, {} failed, {} skipped".format(
+            self.file, len(statuses), statuses.count('ok'), statuses.count('failed'), statuses.count('skipped'))
+
+
+class Watcher:
+    """
+    Incremental ingestion of a folder (and its sub-folders) where the receivers keep dropping new files: the folder
+    is polled, and only the new or changed files (see Ledger) are checked. A file is only taken once it is settled
+    (not modified for some seconds, then still being written files wait), and the files arrived meanwhile are
+    checked together, up to a batch size: under a burst, the others wait for the next batches, with no queue kept
+    in memory. The ledger is saved after each batch, then a restarted watcher does not check the same files again
+    """
+    def __init__(self, folder, ledger=None, workers=settings.WORKERS, output_folder=None, store_folder=None,
+                 settle=settings.WATCH_SETTLE_SECONDS, max_batch=settings.WATCH_MAX_BATCH):
+        """
+        :param folder: The watched folder
+        :param ledger: Absolute path to the ledger (see Ledger.default)
+        :param workers: Number of processes checking the files of a batch (0 for one per CPU)
+        :param output_folder: Folder where the corrected rinex are saved (None to not save them)
+        :param store_folder: Folder where the results are appended, per station (None to not save them)
+        :param settle: Seconds with no modification before a file is taken
+        :param max_batch: Maximum number of files checked per batch
+        """
+        self.folder = folder
+        self.ledger = Ledger(ledger or Ledger.default(folder))
+        self.settle = settle
+        self.max_batch = max_batch
+        self.cycle_slip = cs.CycleSlip(folder, workers, output_folder, store_folder)
+
+    def pending(self):
+        """
+        :return: List of (path relative to the folder, os.stat_result, SHA-1) of the new or changed files, settled,
+            oldest first, up to max_batch
+        """
+        now = time.time()
+        candidates = []
+
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                path = os.path.relpath(os.path.join(root, name), self.folder)
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                if not self.ledger.unchanged(path, stat) and now - stat.st_mtime >= self.settle:
+                    candidates.append((stat.st_mtime, path, stat))
+
+        pending, touched = [], 0
+        for _, path, stat in sorted(candidates):
+            if len(pending) == self.max_batch:
+                break
+
+            sha1 = checksum(os.path.join(self.folder, path))
+            if self.ledger.same_content(path, sha1):
+                self.ledger.touch(path, stat)
+                touched += 1
+            else:
+                pending.append((path, stat, sha1))
+
+        if touched:
+            self.ledger.save()
+
+        return pending
+
+    def run_once(self):
+        """
+        Check a batch of new or changed files, saving the ledger
+
+        :return: The number of files taken (checked, or skipped when they are not supported rinex files)
+        """
+        pending = self.pending()
+        entries, files = [], {}
+
+        for path, stat, sha1 in pending:
+            entry = mf.Manifest.scan(os.path.join(self.folder, os.path.dirname(path)), os.path.basename(path))
+            if entry['status'] == mf.Manifest.STATUS_OK:
+                entries.append(entry)
+                files[entry['path']] = (path, stat, sha1)
+            else:
+                logging.info(">> Skipping {} ({}): {}".format(path, entry['status'], entry['error']))
+                self.ledger.record(path, stat, sha1, 'skipped', entry['error'])
+
+        if entries:
+            logging.info(">> {} new or changed file(s) in {}".format(len(entries), self.folder))
+            for entry, result in zip(entries, self.cycle_slip.check(entries)):
+                self.ledger.record(*files[entry['path']], result['status'], result['error'])
+
+        if pending:
+            self.ledger.save()
+
+        return len(pending)
+
+    def run(self, poll=settings.WATCH_POLL_SECONDS, once=False):
+        """
+        Watch the folder until interrupted (or only check the files waiting, once)
+
+        :param poll: Seconds between two polls, when there is no file waiting
+        :param once: Check the files waiting and return, instead of watching
+        :return: The number of files taken
+        """
+        logging.info(">> Watching {} ({})".format(self.folder, self.ledger))
+        taken = 0
+
+        try:
+            while True:
+                batch = self.run_once()
+                taken += batch
+                if once and batch < self.max_batch:
+                    break
+                if not batch:
+                    time.sleep(poll)
+        except KeyboardInterrupt:
+            pass
+
+        logging.info(">> {} file(s) taken while watching {} ({})".format(taken, self.folder, self.ledger))
+        return taken
@@ -0,0 +1,338 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import threading
+import time
+
+import cycle_slip as cs
+import manifest as mf
+import plots
+import settings as settings
+
+
+class WorkQueue:
+    """
+    Work queue kept on disk, in a folder shared by every worker (on a single node, or on many nodes over a shared
+    filesystem), with no broker: each operation holds an exclusive lock (fcntl) on the 'queue.lock' file
+        - items/<id>.json: a rinex to be checked (one per file)
+        - pending/<id>.json: an item never claimed, removed when it is claimed
+        - leases/<id>.json: the worker checking the item, and until when (renewed while the worker is alive)
+        - done/<id>.json: the result of the item, written once (atomically) when it is finished
+        - failed/<id>.json: an item whose result is not ok
+    An item whose lease expires (e.g. its worker crashed) is claimed again, up to QUEUE_MAX_ATTEMPTS times. The
+    leases compare the clock of the nodes, which must be kept synchronized (NTP). A claim only looks at the leases
+    (about one per worker) and at the first pending item, and the status counts the entries of the folders, then
+    neither of them grows with the items already done
+    """
+    _lock = 'queue.lock'
+    _folders = ('items', 'leases', 'done', 'failed')
+
+    def __init__(self, folder, lease=settings.LEASE_SECONDS, max_attempts=settings.QUEUE_MAX_ATTEMPTS):
+        """
+        :param folder: The queue folder (created if it does not exist)
+        :param lease: Seconds an item stays claimed by a worker with no renewal
+        :param max_attempts: Number of claims of an item before it is given up (as failed)
+        """
+        self.folder = folder
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        for name in self._folders:
+            os.makedirs(os.path.join(folder, name), exist_ok=True)
+
+        if not os.path.isdir(os.path.join(folder, 'pending')):
+            with self._locked():
+                self._upgrade()
+
+    def _upgrade(self):
+        """
+        Fill the pending and failed folders of a queue created with no such folders, once
+
+        :return: None
+        """
+        pending = os.path.join(self.folder, 'pending')
+        if os.path.isdir(pending):
+            return None
+
+        temporary = '{}.tmp-{}-{}'.format(pending, socket.gethostname(), os.getpid())
+        os.makedirs(temporary, exist_ok=True)
+        for item_id in self._list('items'):
+            result = self._read('done', item_id)
+            if result is not None and result['status'] != 'ok':
+                self._write('failed', item_id, {'file': result['file']})
+            elif result is None and not os.path.exists(self._path('leases', item_id)):
+                shutil.copyfile(self._path('items', item_id), os.path.join(temporary, item_id + '.json'))
+        os.rename(temporary, pending)
+
+        return None
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(os.path.join(self.folder, self._lock), mode='a') as fd:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+
+    def _path(self, name, item_id):
+        return os.path.join(self.folder, name, item_id + '.json')
+
+    def _read(self, name, item_id):
+        path = self._path(name, item_id)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, mode='r') as fd:
+            return json.load(fd)
+
+    def _write(self, name, item_id, content):
+        path = self._path(name, item_id)
+        temporary = '{}.tmp-{}-{}'.format(path, socket.gethostname(), os.getpid())
+
+        with open(temporary, mode='w') as fd:
+            json.dump(content, fd, default=str)
+        os.replace(temporary, path)
+
+    def _remove(self, name, item_id):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path(name, item_id))
+
+    def _list(self, name):
+        """
+        :param name: The folder (e.g. 'pending')
+        :return: Iterator over the ids of its items, in no particular order, without reading them
+        """
+        with os.scandir(os.path.join(self.folder, name)) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json'):
+                    yield entry.name[:-len('.json')]
+
+    def _count(self, name):
+        return sum(1 for _ in self._list(name))
+
+    @staticmethod
+    def item_id(folder, file):
+        """
+        :param folder: The rinex folder
+        :param file: The rinex file name
+        :return: The item id, unique per file (the same file always gives the same id)
+        """
+        return '{}-{}'.format(file, hashlib.sha1(os.path.abspath(folder).encode()).hexdigest()[:8])
+
+    def populate(self, manifest):
+        """
+        Add an item per valid file of the manifest. Files already in the queue (pending or done) are not added again
+
+        :param manifest: The manifest.Manifest of a rinex folder
+        :return: The number of items added
+        """
+        added = 0
+        with self._locked():
+            for entry in manifest.valid:
+                item_id = self.item_id(manifest.folder, entry['file'])
+                if not os.path.exists(self._path('items', item_id)):
+                    item = {'id': item_id, 'folder': os.path.abspath(manifest.folder), 'file': entry['file']}
+                    self._write('items', item_id, item)
+                    self._write('pending', item_id, item)
+                    added += 1
+
+        logging.info(">> {} item(s) added to the queue {}".format(added, self.folder))
+        return added
+
+    def claim(self, worker):
+        """
+        Claim an item whose lease expired (with no result) or, if there is none, a pending item
+
+        :param worker: The worker name
+        :return: The item (Python dict with id, folder and file), or None if there is no item to claim
+        """
+        now = time.time()
+        with self._locked():
+            for item_id in list(self._list('leases')):
+                lease = self._read('leases', item_id)
+                if lease is None or lease['expires'] > now:
+                    continue
+
+                if os.path.exists(self._path('done', item_id)):
+                    self._remove('leases', item_id)
+                    continue
+
+                if lease['attempts'] >= self.max_attempts:
+                    item = self._read('items', item_id)
+                    logging.warning(">> Giving up {} after {} attempts".format(item['file'], lease['attempts']))
+                    self._write('done', item_id, {'file': item['file'], 'status': 'failed', 'worker': None,
+                                                  'error': "Given up after {} attempts".format(lease['attempts'])})
+                    self._write('failed', item_id, {'file': item['file']})
+                    self._remove('leases', item_id)
+                    continue
+
+                self._write('leases', item_id, dict(lease, worker=worker, expires=now + self.lease,
+                                                    attempts=lease['attempts'] + 1))
+                return self._read('items', item_id)
+
+            for item_id in self._list('pending'):
+                # a lease or a result with the item still pending: its worker was killed while claiming it
+                if not os.path.exists(self._path('leases', item_id)) and \
+                        not os.path.exists(self._path('done', item_id)):
+                    self._write('leases', item_id, {'worker': worker, 'expires': now + self.lease, 'attempts': 1})
+                    self._remove('pending', item_id)
+                    return self._read('items', item_id)
+
+                self._remove('pending', item_id)
+
+        return None
+
+    def renew(self, item_id, worker):
+        """
+        :param item_id: The item id
+        :param worker: The worker name
+        :return: True if the lease still belongs to the worker (and was renewed), False otherwise
+        """
+        with self._locked():
+            lease = self._read('leases', item_id)
+            if lease is None or lease['worker'] != worker:
+                return False
+
+            lease['expires'] = time.time() + self.lease
+            self._write('leases', item_id, lease)
+
+        return True
+
+    def complete(self, item_id, worker, result):
+        """
+        Save the result of an item, releasing its lease. A result already saved (e.g. by a worker whose lease
+        expired meanwhile) is kept: each item has a single result
+
+        :param item_id: The item id
+        :param worker: The worker name
+        :param result: The result of the item (see CycleSlip.process_file)
+        :return: True if the result was saved, False if the item already had one
+        """
+        with self._locked():
+            lease = self._read('leases', item_id)
+            if lease is not None and lease['worker'] == worker:
+                self._remove('leases', item_id)
+
+            if os.path.exists(self._path('done', item_id)):
+                return False
+
+            self._write('done', item_id, dict(result, worker=worker))
+            if result['status'] != 'ok':
+                self._write('failed', item_id, {'file': result['file']})
+
+        return True
+
+    def status(self):
+        """
+        :return: Python dict with the number of items: total, done, failed, leased (being checked) and pending
+            (never claimed, or whose lease expired)
+        """
+        now = time.time()
+
+        with self._locked():
+            status = {name: self._count(name) for name in ('items', 'done', 'failed')}
+            status['leased'] = 0
+            for item_id in self._list('leases'):
+                lease = self._read('leases', item_id)
+                status['leased'] += lease is not None and lease['expires'] > now and \
+                    not os.path.exists(self._path('done', item_id))
+            status['pending'] = status['items'] - status['done'] - status['leased']
+
+        return status
+
+    def __str__(self):
+        return "Queue {folder}: {items} items, {done} done ({failed} failed), {leased} being checked, {pending} " \
+               "pending".format(folder=self.folder, **self.status())
+
+
+def work(folder, name=None, poll=settings.QUEUE_POLL_SECONDS, output_folder=None, store_folder=None,
+         lease=settings.LEASE_SECONDS):
+    """
+    Worker loop: claim an item, check the file (renewing its lease meanwhile) and save the result, until every item
+    of the queue is done. While the items left are claimed by other workers, it waits for them (or for their leases
+    to expire)
+
+    :param folder: The queue folder
+    :param name: The worker name (host:pid by default)
+    :param poll: Seconds to wait before claiming again, when all items left are claimed by other workers
+    :param output_folder: Folder where the corrected rinex are saved (None to not save them)
+    :param store_folder: Folder where the results are appended, per station (None to not save them)
+    :param lease: Seconds an item stays claimed by the worker with no renewal (see WorkQueue)
+    :return: The number of items checked by this worker
+    """
+    queue = WorkQueue(folder, lease)
+    name = name or '{}:{}'.format(socket.gethostname(), os.getpid())
+    checked = 0
+
+    while True:
+        item = queue.claim(name)
+        if item is None:
+            status = queue.status()
+            if status['pending'] + status['leased'] == 0:
+                break
+            time.sleep(poll)
+            continue
+
+        stop = threading.Event()
+
+        def heartbeat(item_id=item['id']):
+            while not stop.wait(queue.lease / 3):
+                if not queue.renew(item_id, name):
+                    logging.warning(">> Lease of {} lost by {}".format(item_id, name))
+                    break
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+
+        try:
+            entry = mf.Manifest.scan(item['folder'], item['file'])
+            if entry['status'] == mf.Manifest.STATUS_OK:
+                result = cs.CycleSlip(item['folder'], workers=1, output_folder=output_folder,
+                                      store_folder=store_folder).process_file(entry)
+            else:
+                result = {'file': item['file'], 'status': 'failed', 'error': entry['error'], 'seconds': None}
+        finally:
+            stop.set()
+            thread.join()
+
+        queue.complete(item['id'], name, result)
+        checked += 1
+
+    plots.renderer().close()
+    logging.info(">> Worker {} done: {} item(s) checked".format(name, checked))
+    return checked
+
+
+def run(folder, workers=1, output_folder=None, store_folder=None, lease=settings.LEASE_SECONDS,
+        poll=settings.QUEUE_POLL_SECONDS):
+    """
+    Start workers (processes) on this node, waiting for all of them
+
+    :param folder: The queue folder
+    :param workers: Number of worker processes (0 for one per CPU)
+    :param output_folder: Folder where the corrected rinex are saved (None to not save them)
+    :param store_folder: Folder where the results are appended, per station (None to not save them)
+    :param lease: Seconds an item stays claimed by a worker with no renewal (see WorkQueue)
+    :param poll: Seconds a worker waits before claiming again (see work)
+    :return: The WorkQueue object
+    """
+    workers = workers or os.cpu_count() or 1
+    options = {'output_folder': output_folder, 'store_folder': store_folder, 'lease': lease, 'poll': poll}
+    if workers == 1:
+        work(folder, **options)
+    else:
+        settings.ARC_WORKERS = 1
+        processes = [multiprocessing.Process(target=work, args=(folder,), kwargs=options) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    return WorkQueue(folder, lease)